@@ -0,0 +1 @@
+"""Implements benchmarks for the repository."""
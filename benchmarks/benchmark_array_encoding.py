@@ -0,0 +1,56 @@
+"""Benchmark for encoding the topic-word matrix returned by getTopics.
+
+Run with `python -m benchmarks.benchmark_array_encoding`. Compares the json path (python
+lists, str and json) with the raw float32 and Arrow IPC encodings for K x V matrices.
+"""
+import argparse
+import json
+import time
+from typing import Callable, List
+
+import numpy as np
+
+from cs_insights_prediction_endpoint.utils.array_encoding import (
+    ARROW_MEDIA_TYPE,
+    RAW_MEDIA_TYPE,
+    encode_array,
+    get_array_media_types,
+)
+
+
+def encode_json(array: np.ndarray) -> bytes:
+    """Emulates the json response of getTopics"""
+    return json.dumps({"output_data": {"getTopics": str(array.tolist())}}).encode()
+
+
+def measure(encode: Callable[[np.ndarray], bytes], array: np.ndarray, repeat: int) -> List[float]:
+    """Returns the mean milliseconds and the MiB of encode(array)"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        data = encode(array)
+    return [(time.perf_counter() - start) / repeat * 1000, len(data) / 2**20]
+
+
+def main() -> None:
+    """Runs the benchmark and prints the results"""
+    parser = argparse.ArgumentParser(description="Benchmark array encodings.")
+    parser.add_argument("--topics", type=int, nargs="+", default=[10, 50, 100], help="K.")
+    parser.add_argument("--vocabulary", type=int, default=50000, help="V.")
+    parser.add_argument("--repeat", type=int, default=3, help="Repetitions per encoding.")
+    args = parser.parse_args()
+
+    encodings = {"json": encode_json, "raw": lambda array: encode_array(array, RAW_MEDIA_TYPE)}
+    if ARROW_MEDIA_TYPE in get_array_media_types():
+        encodings["arrow"] = lambda array: encode_array(array, ARROW_MEDIA_TYPE)
+
+    print(f"{'topics':>8} {'encoding':>10} {'ms':>10} {'MiB':>10}")
+    rng = np.random.default_rng(0)
+    for topics in args.topics:
+        array = rng.dirichlet(np.ones(args.vocabulary), topics).astype(np.float32)
+        for name, encode in encodings.items():
+            milliseconds, size = measure(encode, array, args.repeat)
+            print(f"{topics:>8} {name:>10} {milliseconds:>10.2f} {size:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
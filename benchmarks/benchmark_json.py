@@ -0,0 +1,114 @@
+"""Microbenchmarks for serializing the largest json responses.
+
+Run with `python -m benchmarks.benchmark_json`. Renders the output of getTopics,
+predictBatch, getTopWords and getLDAvis with the JSONResponse of the standard library
+and with ORJSONResponse; getLDAvis is also sent pre-encoded, as the endpoint does now.
+"""
+import argparse
+import json
+import time
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from cs_insights_prediction_endpoint.models.generic_model import GenericOutputModel
+from cs_insights_prediction_endpoint.utils.json_response import ORJSONResponse, RawJSON
+
+
+def make_outputs(topics: int, vocabulary: int, documents: int) -> Dict[str, Any]:
+    """Creates function call outputs of the given size
+
+    Args:
+        topics (int): Number of topics (K)
+        vocabulary (int): Number of words (V)
+        documents (int): Number of documents of predictBatch
+
+    Returns:
+        Dict[str, Any]: The output_data of each function call
+    """
+    rng = np.random.default_rng(0)
+    matrix = rng.dirichlet(np.ones(vocabulary), topics)
+    top = np.argsort(-matrix, axis=1)[:, :100]
+    lda_vis = {
+        "mdsDat": {"x": rng.random(topics).tolist(), "y": rng.random(topics).tolist()},
+        "tinfo": {
+            "Term": [f"word{i}" for i in range(30 * topics)],
+            "Freq": rng.random(30 * topics).tolist(),
+        },
+        "token.table": {
+            "Topic": rng.integers(0, topics, vocabulary).tolist(),
+            "Freq": rng.random(vocabulary).tolist(),
+            "Term": [f"word{i}" for i in range(vocabulary)],
+        },
+        "topic.order": list(range(1, topics + 1)),
+    }
+    return {
+        "getTopics": {"getTopics": str(matrix.tolist())},
+        "predictBatch": {
+            "topics": rng.integers(0, topics, (documents, 5)).tolist(),
+            "probabilities": rng.random((documents, 5)).tolist(),
+        },
+        "getTopWords": {
+            "num_topics": topics,
+            "offset": 0,
+            "topics": [
+                {
+                    "topic": topic,
+                    "words": [
+                        {"id": int(i), "word": f"word{i}", "probability": float(matrix[topic, i])}
+                        for i in top[topic]
+                    ],
+                }
+                for topic in range(topics)
+            ],
+        },
+        "getLDAvis": lda_vis,
+    }
+
+
+def measure(render: Callable[[], Any], repeat: int) -> float:
+    """Returns the mean milliseconds of render"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        render()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main() -> None:
+    """Runs the benchmark and prints the results"""
+    parser = argparse.ArgumentParser(description="Benchmark json responses.")
+    parser.add_argument("--topics", type=int, default=50, help="Number of topics (K).")
+    parser.add_argument("--vocabulary", type=int, default=20000, help="Number of words (V).")
+    parser.add_argument("--documents", type=int, default=10000, help="Documents to predict.")
+    parser.add_argument("--repeat", type=int, default=5, help="Repetitions per measurement.")
+    args = parser.parse_args()
+
+    outputs = make_outputs(args.topics, args.vocabulary, args.documents)
+    print(f"{'function call':>14} {'path':>22} {'ms':>10}")
+    for name, output in outputs.items():
+        content = jsonable_encoder(GenericOutputModel(output_data=output))
+        paths: List[Any] = [
+            ("json", lambda: JSONResponse(content)),
+            ("orjson", lambda: ORJSONResponse(content)),
+        ]
+        if name == "getLDAvis":
+            encoded = json.dumps(output)
+            paths = [
+                (
+                    "json (decode+encode)",
+                    lambda: JSONResponse({"output_data": json.loads(encoded)}),
+                ),
+                (
+                    "orjson (decode+encode)",
+                    lambda: ORJSONResponse({"output_data": json.loads(encoded)}),
+                ),
+                ("raw", lambda: b'{"output_data":' + RawJSON(encoded).data + b"}"),
+            ]
+        for path, render in paths:
+            print(f"{name:>14} {path:>22} {measure(render, args.repeat):>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Benchmark for the training engines of the LdaModelWrapper.
+
+Run with `python -m benchmarks.benchmark_lda_engines`. Compares the wall-clock time of the
+initial fit and of an incremental update (train) using the single process engine and the
+multicore engine with different numbers of workers on a synthetic corpus.
+"""
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from cs_insights_prediction_endpoint.models.lda_model import LdaModelWrapper
+
+
+def make_corpus(documents: int, vocabulary: int, length: int, seed: int = 0) -> list:
+    """Creates a random bag of words corpus
+
+    Args:
+        documents (int): Number of documents
+        vocabulary (int): Number of distinct words
+        length (int): Number of words per document
+        seed (int): Seed of the random number generator
+
+    Returns:
+        list: The corpus as lists of (word id, count)
+    """
+    rng = np.random.default_rng(seed)
+    corpus = []
+    for _ in range(documents):
+        ids, counts = np.unique(rng.zipf(1.3, length) % vocabulary, return_counts=True)
+        corpus.append(list(zip(ids.tolist(), counts.tolist())))
+    return corpus
+
+
+def main() -> None:
+    """Runs the benchmark and prints the results"""
+    parser = argparse.ArgumentParser(description="Benchmark LDA training engines.")
+    parser.add_argument("--documents", type=int, default=20000, help="Documents in the corpus.")
+    parser.add_argument("--vocabulary", type=int, default=20000, help="Distinct words.")
+    parser.add_argument("--length", type=int, default=100, help="Words per document.")
+    parser.add_argument("--num-topics", type=int, default=50, help="Topics of the model.")
+    parser.add_argument(
+        "--workers", type=int, nargs="+", default=[1, 2, 4, 8], help="Multicore worker counts."
+    )
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.documents, args.vocabulary, args.length)
+    half = len(corpus) // 2
+    engines = [{"engine": "single"}] + [
+        {"engine": "multicore", "workers": workers} for workers in args.workers
+    ]
+
+    print(f"{'engine':>10} {'workers':>8} {'fit (s)':>10} {'train (s)':>10}")
+    with tempfile.TemporaryDirectory() as save_directory:
+        for engine in engines:
+            start = time.perf_counter()
+            model = LdaModelWrapper(
+                created_by="Benchmark",
+                type_of_model="lda",
+                save_directory=save_directory,
+                creation_parameters={
+                    **engine,
+                    "corpus": corpus[:half],
+                    "num_topics": args.num_topics,
+                    "random_state": 0,
+                },
+            )
+            fit = time.perf_counter() - start
+
+            start = time.perf_counter()
+            model.train({"corpus": corpus[half:]})
+            train = time.perf_counter() - start
+
+            workers = engine.get("workers", 1)
+            print(f"{engine['engine']:>10} {workers:>8} {fit:>10.3f} {train:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
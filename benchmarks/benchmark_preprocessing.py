@@ -0,0 +1,92 @@
+"""Benchmark for building the corpus of getLDAvis from raw texts.
+
+Run with `python -m benchmarks.benchmark_preprocessing`. Compares the previous path, which
+kept the tokens of every text before building the dictionary, with the chunked pipeline
+for different numbers of worker processes. Peak memory is traced in the main process.
+"""
+import argparse
+import time
+import tracemalloc
+from typing import Any, Callable, List
+
+import numpy as np
+from gensim.corpora.dictionary import Dictionary  # type: ignore
+
+from cs_insights_prediction_endpoint.utils.preprocessing import (
+    build_corpus,
+    preprocess_text,
+)
+
+words = (
+    "attention transformer topic model language corpus neural network translation parsing "
+    "semantic embedding evaluation dataset annotation retrieval question answering summary "
+    "speech dialogue generation knowledge graph entity relation extraction classification"
+).split()
+
+
+def make_texts(size: int, length: int, seed: int = 0) -> List[str]:
+    """Creates random abstracts
+
+    Args:
+        size (int): Number of texts
+        length (int): Number of words per text
+        seed (int): Seed of the random number generator
+
+    Returns:
+        List[str]: The texts; each one is unique, so the memoization does not apply
+    """
+    rng = np.random.default_rng(seed)
+    return [" ".join(rng.choice(words, length)) + f" paper{i} author{i % 997}" for i in range(size)]
+
+
+def serial_corpus(texts: List[str]) -> None:
+    """Emulates the previous path of getLDAvis"""
+    docs = [preprocess_text(text) for text in texts]
+    dictionary = Dictionary(docs)
+    [dictionary.doc2bow(doc) for doc in docs]
+
+
+def measure(build: Callable[[], Any]) -> List[float]:
+    """Returns the seconds and peak MiB of build"""
+    preprocess_text.cache_clear()
+    tracemalloc.start()
+    start = time.perf_counter()
+    build()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    return [seconds, peak]
+
+
+def main() -> None:
+    """Runs the benchmark and prints the results"""
+    parser = argparse.ArgumentParser(description="Benchmark corpus preprocessing.")
+    parser.add_argument("--texts", type=int, default=100000, help="Number of texts.")
+    parser.add_argument("--length", type=int, default=150, help="Words per text.")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="Texts per chunk.")
+    parser.add_argument(
+        "--workers", type=int, nargs="+", default=[0, 2, 4, 8], help="Worker process counts."
+    )
+    args = parser.parse_args()
+
+    texts = make_texts(args.texts, args.length)
+    # Start the worker processes before measuring
+    build_corpus(
+        texts[: args.chunk_size * 2], workers=max(args.workers), chunk_size=args.chunk_size
+    )
+
+    print(f"{'path':>10} {'workers':>8} {'seconds':>10} {'texts/s':>10} {'peak MiB':>10}")
+    seconds, peak = measure(lambda: serial_corpus(texts))
+    print(f"{'serial':>10} {1:>8} {seconds:>10.3f} {len(texts) / seconds:>10.0f} {peak:>10.1f}")
+    for workers in args.workers:
+        seconds, peak = measure(
+            lambda: build_corpus(texts, workers=workers, chunk_size=args.chunk_size)
+        )
+        print(
+            f"{'chunked':>10} {workers:>8} {seconds:>10.3f} "
+            f"{len(texts) / seconds:>10.0f} {peak:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
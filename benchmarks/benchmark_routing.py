@@ -0,0 +1,72 @@
+"""Benchmark for routing forwarded requests to the host of a created model.
+
+Run with `python -m benchmarks.benchmark_routing`. Compares the routing index of the
+RemoteStorageController with the previous scan over the created_models of every host.
+"""
+import argparse
+import random
+import time
+from typing import List, Optional
+
+import mongomock  # type: ignore
+
+from cs_insights_prediction_endpoint.models.model_hosts import RemoteHost
+from cs_insights_prediction_endpoint.utils.remote_storage_controller import (
+    RemoteStorageController,
+)
+from cs_insights_prediction_endpoint.utils.settings import get_settings
+
+
+def scan(hosts: List[RemoteHost], model_id: str) -> Optional[str]:
+    """Emulates the previous lookup scanning all hosts"""
+    for host in hosts:
+        if model_id in host.created_models:
+            return f"{host.ip}:{host.port}"
+    return None
+
+
+def main() -> None:
+    """Runs the benchmark and prints the results"""
+    parser = argparse.ArgumentParser(description="Benchmark model routing.")
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[1000, 100000, 1000000], help="Created models."
+    )
+    parser.add_argument("--hosts", type=int, default=10, help="Number of hosts.")
+    parser.add_argument("--lookups", type=int, default=1000, help="Lookups per measurement.")
+    args = parser.parse_args()
+
+    print(f"{'models':>10} {'index (us)':>12} {'scan (us)':>12}")
+    for size in args.sizes:
+        with mongomock.patch(servers=(("127.0.0.1", 27017),)):
+            rsc = RemoteStorageController(get_settings())
+            hosts = [
+                RemoteHost(
+                    ip=f"10.0.0.{i}",
+                    port="80",
+                    models=["lda"],
+                    created_models=[str(m) for m in range(i, size, args.hosts)],
+                )
+                for i in range(args.hosts)
+            ]
+            for host in hosts:
+                rsc.add_remote_host(host)
+            model_ids = [str(random.randrange(size)) for _ in range(args.lookups)]
+
+            start = time.perf_counter()
+            for model_id in model_ids:
+                rsc.find_created_model_in_remote_hosts(model_id)
+            index = (time.perf_counter() - start) / args.lookups * 1e6
+
+            scan_lookups = model_ids[: max(1, args.lookups // 100)]
+            start = time.perf_counter()
+            for model_id in scan_lookups:
+                scan(hosts, model_id)
+            scanned = (time.perf_counter() - start) / len(scan_lookups) * 1e6
+
+            for host in hosts:
+                rsc.remove_remote_host(host.ip)
+            print(f"{size:>10} {index:>12.2f} {scanned:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Benchmark for the startup of the StorageController with N stored models.
+
+Run with `python -m benchmarks.benchmark_startup`. Restoring models only loads their
+state from disk, while the previous startup path trained and saved a throwaway LDA
+for every stored model before loading it.
+"""
+import argparse
+import tempfile
+import time
+
+import mongomock  # type: ignore
+from gensim.test.utils import common_corpus  # type: ignore
+
+from cs_insights_prediction_endpoint.models.lda_model import LdaModelWrapper
+from cs_insights_prediction_endpoint.utils.settings import get_settings
+from cs_insights_prediction_endpoint.utils.storage_controller import StorageController
+
+
+def rebuild_startup(sc: StorageController) -> None:
+    """Emulates the previous startup path: train and save a throwaway model, then load
+
+    Args:
+        sc (StorageController): A storage controller connected to the model database
+    """
+    for db_model in sc.model_db.find({}):
+        model = LdaModelWrapper(**db_model)
+        model.load(model.get_save_path())
+
+
+def main() -> None:
+    """Runs the benchmark and prints the results"""
+    parser = argparse.ArgumentParser(description="Benchmark StorageController startup.")
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10, 50, 100], help="Numbers of stored models."
+    )
+    parser.add_argument("--num-topics", type=int, default=10, help="Topics per stored model.")
+    args = parser.parse_args()
+
+    print(f"{'models':>8} {'restore (s)':>12} {'lazy (s)':>10} {'rebuild (s)':>12}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as save_directory, mongomock.patch(
+            servers=(("127.0.0.1", 27017),)
+        ):
+            settings = get_settings()
+            sc = StorageController(settings)
+            for _ in range(size):
+                sc.add_model(
+                    LdaModelWrapper(
+                        created_by="Benchmark",
+                        type_of_model="lda",
+                        function_calls={},
+                        save_directory=save_directory,
+                        creation_parameters={
+                            "corpus": common_corpus,
+                            "num_topics": args.num_topics,
+                        },
+                    )
+                )
+
+            start = time.perf_counter()
+            StorageController(settings)
+            restore = time.perf_counter() - start
+
+            start = time.perf_counter()
+            StorageController(settings.copy(update={"lazy_model_loading": True}))
+            lazy = time.perf_counter() - start
+
+            start = time.perf_counter()
+            rebuild_startup(sc)
+            rebuild = time.perf_counter() - start
+
+            print(f"{size:>8} {restore:>12.3f} {lazy:>10.3f} {rebuild:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Benchmark for model lookups in the StorageController.
+
+Run with `python -m benchmarks.benchmark_storage_controller`. The lookup cost per
+call should stay flat for growing numbers of registered models.
+"""
+import argparse
+import random
+import timeit
+
+import mongomock  # type: ignore
+
+from cs_insights_prediction_endpoint.models.generic_model import GenericModel
+from cs_insights_prediction_endpoint.utils.settings import get_settings
+from cs_insights_prediction_endpoint.utils.storage_controller import StorageController
+
+
+def fill_storage_controller(sc: StorageController, number_of_models: int) -> None:
+    """Registers number_of_models dummy models in sc
+
+    Args:
+        sc (StorageController): The storage controller to fill
+        number_of_models (int): Number of models to register
+    """
+    for i in range(number_of_models):
+        sc.register_model(
+            GenericModel(
+                id=str(i),
+                name=f"Benchmark-{i}",
+                created_by=f"user-{i % 100}",
+                description="Benchmark model",
+                function_calls={},
+                type_of_model=random.choice(["lda", "other"]),
+            )
+        )
+
+
+def main() -> None:
+    """Runs the benchmark and prints the results"""
+    parser = argparse.ArgumentParser(description="Benchmark StorageController lookups.")
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[10, 100, 1000, 10000, 100000],
+        help="Numbers of registered models to benchmark.",
+    )
+    parser.add_argument(
+        "--lookups", type=int, default=100000, help="Number of lookups per registry size."
+    )
+    args = parser.parse_args()
+
+    print(f"{'models':>10} {'hit (ns/lookup)':>16} {'miss (ns/lookup)':>17}")
+    with mongomock.patch(servers=(("127.0.0.1", 27017),)):
+        for size in args.sizes:
+            sc = StorageController(get_settings())
+            fill_storage_controller(sc, size)
+            ids = [str(random.randrange(size)) for _ in range(args.lookups)]
+            lookup = iter(ids).__next__
+
+            hit = timeit.timeit(lambda: sc.get_model(lookup()), number=args.lookups)
+            miss = timeit.timeit(lambda: sc.get_model("Non-Existent"), number=args.lookups)
+            print(
+                f"{size:>10} {hit / args.lookups * 1e9:>16.1f}"
+                f" {miss / args.lookups * 1e9:>17.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
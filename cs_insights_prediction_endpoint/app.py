@@ -1,4 +1,7 @@
 """This module implements the main app."""
+import asyncio
+from typing import List
+
 from fastapi import FastAPI
 
 import cs_insights_prediction_endpoint
@@ -14,17 +17,29 @@ from cs_insights_prediction_endpoint.routes.route_model_forward import (
 )
 from cs_insights_prediction_endpoint.routes.route_status import router as status_router
 from cs_insights_prediction_endpoint.routes.route_topic import router as topic_router
+from cs_insights_prediction_endpoint.utils.host_health import get_health_monitor
+from cs_insights_prediction_endpoint.utils.http_client import create_http_client
+from cs_insights_prediction_endpoint.utils.job_controller import shutdown_job_controller
+from cs_insights_prediction_endpoint.utils.json_response import get_response_class
+from cs_insights_prediction_endpoint.utils.placement import get_address
+from cs_insights_prediction_endpoint.utils.preprocessing import (
+    shutdown_preprocessing_pool,
+)
+from cs_insights_prediction_endpoint.utils.remote_storage_controller import (
+    get_remote_storage_controller,
+)
 from cs_insights_prediction_endpoint.utils.settings import get_settings
 from cs_insights_prediction_endpoint.utils.version_getter import get_backend_version
 
+settings = get_settings()
+
 app = FastAPI(
     title="cs-insights-prediction-endpoint",
     docs_url="/api/docs",
     redoc_url="/api/redoc",
+    default_response_class=get_response_class(settings),
 )
 
-settings = get_settings()
-
 if "{version}" in settings.auth_backend_url:
     get_backend_version()
 
@@ -41,6 +56,38 @@ app.include_router(
 )
 
 if settings.node_type == "MAIN":
+
+    @app.on_event("startup")
+    async def open_http_client() -> None:
+        """Open the pooled http client used for forwarding requests to remote hosts"""
+        app.state.http_client = create_http_client(settings)
+
+    @app.on_event("shutdown")
+    async def close_http_client() -> None:
+        """Close the pooled http client and all of its connections"""
+        await app.state.http_client.aclose()
+
+    def get_remote_host_addresses() -> List[str]:
+        """Get the addresses of all registered remote hosts"""
+        return [
+            get_address(host) for host in get_remote_storage_controller().get_all_remote_hosts()
+        ]
+
+    @app.on_event("startup")
+    async def start_health_prober() -> None:
+        """Start probing the health of all remote hosts in the background"""
+        app.state.health_prober = None
+        if settings.health_check_interval > 0:
+            app.state.health_prober = asyncio.create_task(
+                get_health_monitor().run(lambda: app.state.http_client, get_remote_host_addresses)
+            )
+
+    @app.on_event("shutdown")
+    async def stop_health_prober() -> None:
+        """Stop probing the health of the remote hosts"""
+        if app.state.health_prober is not None:
+            app.state.health_prober.cancel()
+
     app.include_router(
         model_forward_router,
         tags=["ModelForward"],
@@ -54,12 +101,25 @@ if settings.node_type == "MAIN":
     )
 
 else:
+
+    @app.on_event("shutdown")
+    def shutdown_jobs() -> None:
+        """Cancel queued jobs and stop the worker processes running jobs"""
+        shutdown_job_controller()
+
     app.include_router(
         model_router,
         tags=["Model"],
         prefix=f"/api/v{cs_insights_prediction_endpoint.__version__.split('.')[0]}/models",
     )
 
+
+@app.on_event("shutdown")
+def shutdown_preprocessing() -> None:
+    """Stop the worker processes used for preprocessing texts"""
+    shutdown_preprocessing_pool()
+
+
 app.include_router(
     auth_router,
     tags=["Auth"],
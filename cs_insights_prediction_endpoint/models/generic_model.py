@@ -1,9 +1,13 @@
 """This modulew implements the generic-model"""
+import copy
+import os
+import re
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, Optional, TypeVar
+from types import MethodType
+from typing import Any, ClassVar, Dict, List, Optional, Set, TypeVar
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
 
 T = TypeVar("T", bound="GenericModel")
 
@@ -22,6 +26,12 @@ class GenericModel(BaseModel):
     type_of_model: str = Field(...)
     function_calls: dict = Field(...)
     processing_model: Any
+    # Version of the processing_model; every update is saved as a new version
+    version: int = 0
+    # Function calls that change the processing_model (e.g., training)
+    updating_function_calls: ClassVar[Set[str]] = set()
+    # Cleared by updating function calls that left the processing_model unchanged
+    _state_changed: bool = PrivateAttr(default=True)
 
     def __init__(self: T, **data: Any) -> None:
         """Constructor for GenericModel"""
@@ -56,6 +66,110 @@ class GenericModel(BaseModel):
         """
         return self.name
 
+    def get_save_path(self: T, version: Optional[int] = None) -> str:
+        """Returns the path a version of the state of the model is saved to.
+        Version 0 (the state saved on creation) keeps the path of unversioned models
+
+        Args:
+            version (Optional[int]): The version; defaults to the current version
+
+        Returns:
+            str: The path inside of save_directory
+        """
+        version = self.version if version is None else version
+        if version == 0:
+            return f"{self.save_directory}/{self.id}"
+        return f"{self.save_directory}/{self.id}.v{version}"
+
+    def get_saved_versions(self: T) -> List[int]:
+        """Returns the versions of the model saved in save_directory
+
+        Returns:
+            List[int]: The saved versions in ascending order
+        """
+        pattern = re.compile(re.escape(self.id) + r"(?:\.v(\d+))?")
+        versions = []
+        for file_name in os.listdir(self.save_directory):
+            match = pattern.fullmatch(file_name)
+            if match is not None:
+                versions.append(int(match.group(1) or 0))
+        return sorted(versions)
+
+    def get_saved_files(self: T, version: int) -> List[str]:
+        """Returns the files a saved version of the state of the model consists of, i.e.,
+        the save path and the files saved next to it (e.g., separately stored arrays)
+
+        Args:
+            version (int): The version
+
+        Returns:
+            List[str]: The paths of the files inside of save_directory
+        """
+        name = os.path.basename(self.get_save_path(version))
+        other_versions = re.compile(re.escape(self.id) + r"\.v\d+(?:\..*)?")
+        return sorted(
+            f"{self.save_directory}/{file_name}"
+            for file_name in os.listdir(self.save_directory)
+            if (file_name == name or file_name.startswith(f"{name}."))
+            and (version != 0 or other_versions.fullmatch(file_name) is None)
+        )
+
+    def delete_saved_versions(self: T, versions: Optional[List[int]] = None) -> None:
+        """Deletes saved versions of the state of the model
+
+        Args:
+            versions (Optional[List[int]]): The versions to delete; defaults to all versions
+        """
+        if versions is None:
+            versions = self.get_saved_versions()
+        for version in versions:
+            for path in self.get_saved_files(version):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def is_state_changed(self: T) -> bool:
+        """Returns whether the last updating function call changed the processing_model,
+        i.e., whether it has to be saved as a new version
+
+        Returns:
+            bool: False if the call left the processing_model unchanged (e.g., a cache hit)
+        """
+        return self._state_changed
+
+    def snapshot(self: T, copy_state: bool = True) -> T:
+        """Returns a copy of the model whose function calls run on the copy, e.g., to update
+        it while the model keeps serving requests
+
+        Args:
+            copy_state (bool): Whether the processing_model is copied or shared
+
+        Returns:
+            T: The copy of the model
+        """
+        processing_model = self.processing_model
+        if copy_state:
+            processing_model = copy.deepcopy(processing_model)
+        snapshot = self.copy(update={"processing_model": processing_model})
+        snapshot._state_changed = True
+        snapshot.function_calls = {
+            name: MethodType(function.__func__, snapshot)
+            if getattr(function, "__self__", None) is self
+            else function
+            for name, function in self.function_calls.items()
+        }
+        return snapshot
+
+    def replace_state(self: T, other: "GenericModel") -> None:
+        """Replaces the state of the model by the state of other, e.g., an updated snapshot;
+        subclasses also take over what they derived from the state
+
+        Args:
+            other (GenericModel): The model whose state is taken over
+        """
+        self.processing_model = other.processing_model
+
     def get_function_calls(self: T) -> list:
         """Returns the name of all the functions available
 
@@ -80,6 +194,36 @@ class GenericModel(BaseModel):
         """Function to load the state of the model"""
         raise NotImplementedError("GenericModel.load has to be implemented by the subclass")
 
+    def unload(self: T) -> None:
+        """Function to free the state of the model; it can be restored by calling load"""
+        self.processing_model = None
+
+    def is_loaded(self: T) -> bool:
+        """Returns whether the state of the model is currently in memory
+
+        Returns:
+            bool: True if the processing_model is loaded; False otherwise
+        """
+        return self.processing_model is not None
+
+    def get_memory_usage(self: T) -> int:
+        """Returns the (estimated) number of bytes the state of the model occupies.
+        Subclasses should override this to allow memory bounded caching of models.
+
+        Returns:
+            int: The number of bytes used by the processing_model
+        """
+        return 0
+
+    def get_memory_report(self: T) -> dict:
+        """Returns a report of the memory used by the state of the model.
+        Subclasses can add details such as memory shared with other processes.
+
+        Returns:
+            dict: A report containing at least the private_bytes of the model
+        """
+        return {"private_bytes": self.get_memory_usage()}
+
 
 class GenericInputModel(BaseModel):
     """Input for a generic model"""
@@ -1,30 +1,83 @@
 """This module implements the LDA-Model"""
-import json
+import glob
+import os
+import uuid
 from datetime import datetime
+from itertools import chain
 from typing import Any, Dict, List, Optional, Tuple, TypeVar
 
+import numpy as np
 import pyLDAvis  # type: ignore
 import pyLDAvis.gensim_models  # type: ignore
 from gensim.corpora.dictionary import Dictionary  # type: ignore
 from gensim.models.ldamodel import LdaModel  # type: ignore
-from gensim.parsing.preprocessing import (  # type: ignore
-    preprocess_string,
-    remove_stopwords,
-)
+from gensim.models.ldamulticore import LdaMulticore  # type: ignore
 from gensim.test.utils import common_corpus  # type: ignore
+from pydantic import PrivateAttr
 
 from cs_insights_prediction_endpoint.models.generic_model import (
     GenericInputModel,
     GenericModel,
     GenericOutputModel,
 )
+from cs_insights_prediction_endpoint.utils.json_response import RawJSON
+from cs_insights_prediction_endpoint.utils.memory_report import get_mapped_file_usage
+from cs_insights_prediction_endpoint.utils.preprocessing import (
+    build_corpus,
+    preprocess_text,
+)
+from cs_insights_prediction_endpoint.utils.result_cache import (
+    fingerprint,
+    get_lda_vis_cache,
+)
+from cs_insights_prediction_endpoint.utils.settings import get_settings
 
 T = TypeVar("T", bound="LdaModelWrapper")
 
+# Training engines selectable by the creation parameter "engine"
+lda_engines = {"single": LdaModel, "multicore": LdaMulticore}
+
+
+def create_lda_model(
+    engine: str = "single", workers: Optional[int] = None, **parameters: Any
+) -> Any:
+    """Creates (and trains if a corpus is given) a gensim LDA model using the given engine
+
+    Args:
+        engine (str): Either "single" (one process) or "multicore" (workers processes)
+        workers (Optional[int]): Number of worker processes of the multicore engine;
+                                 None uses all but one of the cpu cores
+        **parameters (Any): Parameters of the gensim LDA model (e.g., corpus, num_topics)
+
+    Raises:
+        ValueError: If the engine is unknown
+
+    Returns:
+        Any: The gensim LDA model; its update method uses the same engine
+    """
+    if engine not in lda_engines:
+        raise ValueError(f"Unknown engine {engine}; use one of {list(lda_engines)}")
+    if engine == "multicore":
+        parameters["workers"] = workers
+    return lda_engines[engine](**parameters)
+
+
+def get_engine_parameters(creation_parameters: Optional[dict]) -> Dict[str, Any]:
+    """Returns the engine and workers given in the creation parameters of a model"""
+    return {
+        key: value
+        for key, value in (creation_parameters or {}).items()
+        if key in ("engine", "workers")
+    }
+
 
 class LdaModelWrapper(GenericModel):
     """Implementation of the LDA (Latent Dirichlet Allocation Model)"""
 
+    updating_function_calls = {"train", "getLDAvis"}
+    # Word ids and probabilities of the top words of each topic (K x top_words_index_size)
+    _top_words: Optional[Tuple[np.ndarray, np.ndarray]] = PrivateAttr(default=None)
+
     def __init__(self: T, **data: Any) -> None:
         """Create LdaModelWrapper"""
         if "name" not in data:
@@ -32,10 +85,17 @@ class LdaModelWrapper(GenericModel):
         # XXX-TN We should consider adding "description" as a class config example
         if "description" not in data:
             data["description"] = "Latent Dirichlet allocation model"
-        if "creation_parameters" in data and data["creation_parameters"] != {}:
-            data["processing_model"] = LdaModel(**data["creation_parameters"])
-        else:
-            data["processing_model"] = LdaModel(common_corpus, num_topics=10)
+        # A given processing_model (e.g., None when restoring metadata only) is not rebuilt
+        restore = "processing_model" in data
+        if not restore:
+            parameters = dict(data.get("creation_parameters") or {})
+            engine_parameters = get_engine_parameters(parameters)
+            parameters = {
+                key: parameters[key] for key in parameters if key not in engine_parameters
+            }
+            if parameters == {}:
+                parameters = {"corpus": common_corpus, "num_topics": 10}
+            data["processing_model"] = create_lda_model(**engine_parameters, **parameters)
         data["function_calls"] = {
             "alpha": self.alpha,
             "beta": self.beta,
@@ -44,13 +104,31 @@ class LdaModelWrapper(GenericModel):
             "getk": self.get_k,
             "getNumTopics": self.get_num_topics,
             "getK": self.get_topics_in_dict,
-            "getTopics": self.get_topics,
+            "getTopics": self.get_topic_matrix,
             "getLDAvis": self.get_lda_vis,
             "train": self.train,
             "predict": self.predict,
+            "predictBatch": self.predict_batch,
+            "predictText": self.predict_text,
+            "getMemoryReport": self.get_memory_report,
+            "getTopWords": self.get_top_words,
         }
         super().__init__(**data)
-        self.save(f"{self.save_directory}/{self.id}")
+        if not restore:
+            self.save(self.get_save_path())
+            self.build_top_words_index()
+
+    def __setattr__(self: T, name: str, value: Any) -> None:
+        """Sets an attribute; replacing the processing_model invalidates the top words"""
+        if name == "processing_model":
+            self._top_words = None
+        super().__setattr__(name, value)
+
+    def replace_state(self: T, other: GenericModel) -> None:
+        """Replaces the state of the model by the state of other and takes over its top words"""
+        super().replace_state(other)
+        if isinstance(other, LdaModelWrapper):
+            self._top_words = other._top_words
 
     def alpha(self: T, document: str) -> dict:
         """Calc alpha and return"""
@@ -86,7 +164,7 @@ class LdaModelWrapper(GenericModel):
         Returns:
             Any: number of topics
         """
-        return len(self.get_topics_in_dict())
+        return int(self.processing_model.num_topics)
 
     def get_num_topics(self: T) -> int:
         """Returns and computes Number of topics
@@ -112,50 +190,134 @@ class LdaModelWrapper(GenericModel):
         """
         return self.get_topics_in_dict()
 
+    def get_topic_matrix(self: T) -> np.ndarray:
+        """Returns the topic-word matrix (K x V) as array, which avoids converting it to
+        python lists when it is returned in a binary encoding
+
+        Returns:
+            np.ndarray: The probabilities of the words for every topic
+        """
+        topics: np.ndarray = self.processing_model.get_topics()
+        return topics
+
+    def get_top_words(
+        self: T, top_n: int = 10, offset: int = 0, limit: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """Returns the most probable words of the topics from the precomputed top words index
+
+        Args:
+            top_n (int): Number of words per topic
+            offset (int): Index of the first topic to return
+            limit (Optional[int]): Maximum number of topics to return; None returns all
+
+        Raises:
+            ValueError: If top_n exceeds the size of the index or the paging is invalid
+
+        Returns:
+            Dict[str, Any]: The total number of topics and the requested topics, each
+                            containing its words with their ids and probabilities
+        """
+        index_size = get_settings().top_words_index_size
+        if not 0 < top_n <= index_size:
+            raise ValueError(f"top_n has to be between 1 and {index_size}")
+        if offset < 0 or (limit is not None and limit < 0):
+            raise ValueError("offset and limit must not be negative")
+        if self._top_words is None:
+            self.build_top_words_index()
+        word_ids, probabilities = self._top_words  # type: ignore
+        end = len(word_ids) if limit is None else offset + limit
+        id2word = self.processing_model.id2word
+        topics = [
+            {
+                "topic": topic,
+                "words": [
+                    {"id": int(word_id), "word": id2word[int(word_id)], "probability": float(p)}
+                    for word_id, p in zip(word_ids[topic, :top_n], probabilities[topic, :top_n])
+                ],
+            }
+            for topic in range(offset, min(end, len(word_ids)))
+        ]
+        return {"num_topics": len(word_ids), "offset": offset, "topics": topics}
+
+    def build_top_words_index(self: T) -> None:
+        """Precomputes the top_words_index_size most probable words of every topic"""
+        topics = self.processing_model.get_topics()
+        size = min(get_settings().top_words_index_size, topics.shape[1])
+        # Select the top words of each topic in O(V) and sort only those
+        word_ids = np.argpartition(-topics, size - 1, axis=1)[:, :size]
+        probabilities = np.take_along_axis(topics, word_ids, axis=1)
+        order = np.argsort(-probabilities, axis=1, kind="stable")
+        self._top_words = (
+            np.take_along_axis(word_ids, order, axis=1),
+            np.take_along_axis(probabilities, order, axis=1),
+        )
+
     def get_lda_vis(
         self: T,
         data: List[Dict[str, str]],
         num_topics: int = 10,
         passes: int = 3,
         random_state: int = 0xBEEF,
-    ) -> Any:
-        """Returns the json output of the LDAvis library, which then gets processed by the frontend
+    ) -> RawJSON:
+        """Returns the json output of the LDAvis library, which then gets processed by the frontend.
+        The model is trained with the engine (and workers) of the creation parameters.
+        Results are cached by a fingerprint of the model, the papers and the parameters.
+        On a cache hit, the model is neither retrained nor replaced.
 
         Args:
             data (Dict[str,str]): A dictionary containing the title and abstract texts of papers
 
         Returns:
-            Dict[str, any]: The json output of the LDAvis library. Consider reading
-                            https://pyldavis.readthedocs.io/en/latest/readme.html
-        """
-        docs = list([preprocess_string(remove_stopwords(i["title"])) for i in data])
-        docs = docs + (
-            list(
-                [
-                    preprocess_string(remove_stopwords(i["abstractText"]))
-                    for i in data
-                    if i["abstractText"] is not None
-                ]
-            )
+            RawJSON: The encoded json output of the LDAvis library. Consider reading
+                     https://pyldavis.readthedocs.io/en/latest/readme.html
+        """
+        engine_parameters = get_engine_parameters(self.creation_parameters)
+        cache = get_lda_vis_cache()
+        # The model is only retrained on a miss, so results of other models must not match
+        key = fingerprint(
+            self.id,
+            [[paper["title"], paper.get("abstractText")] for paper in data],
+            num_topics,
+            passes,
+            random_state,
+            engine_parameters.get("engine", "single"),
+            # The number of workers changes the results of the multicore engine
+            engine_parameters.get("workers"),
         )
-
-        dictionary = Dictionary(docs)
-        bow_corpus = [dictionary.doc2bow(doc) for doc in docs]
-
-        self.processing_model = LdaModel(
-            bow_corpus, num_topics=num_topics, passes=passes, random_state=random_state
+        cached = cache.get(key)
+        # A cache hit leaves the model as it is, so no new version has to be saved
+        self._state_changed = cached is None
+        if cached is not None:
+            return RawJSON(cached)
+
+        texts = chain(
+            (i["title"] for i in data),
+            (i["abstractText"] for i in data if i["abstractText"] is not None),
+        )
+        dictionary, bow_corpus = build_corpus(texts)
+
+        self.processing_model = create_lda_model(
+            **engine_parameters,
+            corpus=bow_corpus,
+            id2word=dictionary,
+            num_topics=num_topics,
+            passes=passes,
+            random_state=random_state,
         )
+        self.build_top_words_index()
 
         vis = pyLDAvis.gensim_models.prepare(
             self.processing_model, bow_corpus, dictionary, mds="mmds"
         )
 
-        return json.loads(vis.to_json())
+        result = vis.to_json()
+        cache.set(key, result)
+        return RawJSON(result)
 
     def train(self: T, input_object: dict) -> None:
         """Trains the LDAModel given a inputObject.
         The input object should at least contain some paper ids,
-        which will be requested from the backend
+        which will be requested from the backend. Updates use the engine of the model
 
         Arguments:
             input_object (dict): An inputObject where
@@ -163,7 +325,9 @@ class LdaModelWrapper(GenericModel):
         """
         # XXX-TN For now we will use corpus as input, which will be a proccessed bag of words.
         #        Later on this will be an array of paper ids. Maybe create an Issue?
+        self.make_writable()
         self.processing_model.update(**input_object)
+        self.build_top_words_index()
 
     def predict(self: T, input_object: dict) -> list:
         """Given some input_object the LDAModel will classfiy the input data
@@ -180,13 +344,160 @@ class LdaModelWrapper(GenericModel):
         #        Later on this will be an array of paper. ids Maybe create an Issue?
         return list(self.processing_model.get_document_topics(**input_object))
 
+    def predict_batch(
+        self: T,
+        documents: List[List[Tuple[int, float]]],
+        minimum_probability: Optional[float] = None,
+        top_k: Optional[int] = None,
+    ) -> dict:
+        """Classifies many bag-of-words documents at once. The documents are inferred in
+        chunks of the model's chunksize, each as one matrix of topic distributions
+
+        Arguments:
+            documents (List[List[Tuple[int, float]]]): The documents as bag-of-words
+            minimum_probability (Optional[float]): Topics with a lower probability are
+                                                   omitted; defaults to the model's setting
+            top_k (Optional[int]): Return at most top_k topics per document
+
+        Raises:
+            ValueError: If top_k is not between 1 and the number of topics
+
+        Returns:
+            dict: For each document the ids of its topics ("topics") and their probabilities
+                  ("probabilities"), both ordered by descending probability
+        """
+        num_topics = self.processing_model.num_topics
+        if top_k is not None and not 0 < top_k <= num_topics:
+            raise ValueError(f"top_k has to be between 1 and {num_topics}")
+        if minimum_probability is None:
+            minimum_probability = self.processing_model.minimum_probability
+        # Same lower bound as used by gensim's get_document_topics
+        minimum_probability = max(minimum_probability, 1e-8)
+        chunksize = self.processing_model.chunksize
+        topics: List[List[int]] = []
+        probabilities: List[List[float]] = []
+        for start in range(0, len(documents), chunksize):
+            end = start + chunksize
+            gamma, _ = self.processing_model.inference(documents[start:end])
+            theta = gamma / gamma.sum(axis=1, keepdims=True)
+            order = np.argsort(-theta, axis=1)[:, :top_k]
+            ordered_theta = np.take_along_axis(theta, order, axis=1)
+            for document_topics, document_theta in zip(order, ordered_theta):
+                keep = document_theta >= minimum_probability
+                topics.append(document_topics[keep].tolist())
+                probabilities.append(document_theta[keep].tolist())
+        return {"topics": topics, "probabilities": probabilities}
+
+    def predict_text(self: T, title: str, abstractText: Optional[str] = None) -> list:
+        """Classifies a paper given as raw text. The text is tokenized with the shared
+        preprocessing pipeline and mapped to bag-of-words with the dictionary of the model
+
+        Arguments:
+            title (str): The title of the paper
+            abstractText (Optional[str]): The abstract of the paper
+
+        Returns:
+            list: A list containg the classified topics [(int, float)]
+            as well as probabilites for the topics
+        """
+        dictionary = self.get_dictionary()
+        if dictionary is None:
+            raise ValueError("The model has no dictionary to map raw text to its vocabulary")
+        tokens = preprocess_text(title)
+        if abstractText is not None:
+            tokens = tokens + preprocess_text(abstractText)
+        return list(self.processing_model.get_document_topics(dictionary.doc2bow(tokens)))
+
+    def get_dictionary(self: T) -> Optional[Dictionary]:
+        """Returns the dictionary (token <-> id mapping) the model was trained with.
+        gensim persists it next to the model file as <path>.id2word
+
+        Returns:
+            Optional[Dictionary]: The dictionary; None if the model was trained on plain ids
+        """
+        id2word = self.processing_model.id2word
+        return id2word if isinstance(id2word, Dictionary) else None
+
     def save(self: T, path: str) -> None:
-        """Function for saving a model to a path"""
-        self.processing_model.save(path)
+        """Function for saving a model to a path.
+        The topic-word arrays (and other arrays with at least model_mmap_sep_limit elements)
+        are stored in separate .npy files so that they can be memory-mapped on load.
+        All files are written under a temporary name first and then renamed, so processes
+        that memory-mapped a previous save keep reading consistent data
+        """
+        temporary_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        self.processing_model.save(
+            temporary_path, separately=["eta"], sep_limit=get_settings().model_mmap_sep_limit
+        )
+        for temporary_file in glob.glob(glob.escape(temporary_path) + "*"):
+            os.replace(temporary_file, temporary_file.replace(temporary_path, path, 1))
 
     def load(self: T, path: str) -> None:
-        """Function for loading a model from a path"""
-        self.processing_model.load(path)
+        """Function for loading a model from a path.
+        If model_mmap is set, the separately stored arrays are memory-mapped read-only, so
+        all worker processes on a host share one copy of them in the page cache
+        """
+        mmap = "r" if get_settings().model_mmap else None
+        self.processing_model = LdaModel.load(path, mmap=mmap)
+
+    def get_arrays(self: T) -> Dict[str, Any]:
+        """Returns the large numpy arrays of the processing_model
+
+        Returns:
+            Dict[str, Any]: The arrays by name
+        """
+        return {
+            "expElogbeta": self.processing_model.expElogbeta,
+            "sstats": self.processing_model.state.sstats,
+            "alpha": self.processing_model.alpha,
+            "eta": self.processing_model.eta,
+        }
+
+    def make_writable(self: T) -> None:
+        """Replaces read-only memory-mapped arrays by private copies before they get updated"""
+        for name, array in self.get_arrays().items():
+            if isinstance(array, np.memmap):
+                owner = self.processing_model.state if name == "sstats" else self.processing_model
+                setattr(owner, name, np.array(array))
+
+    def get_memory_usage(self: T) -> int:
+        """Returns the number of bytes used by the private (not memory-mapped) arrays of the model
+
+        Returns:
+            int: The number of bytes used by the processing_model; 0 if it is not loaded
+        """
+        if self.processing_model is None:
+            return 0
+        arrays = self.get_arrays().values()
+        return int(sum(array.nbytes for array in arrays if not isinstance(array, np.memmap)))
+
+    def get_memory_report(self: T) -> dict:
+        """Returns the memory used by the arrays of the model, split into private memory
+        and memory-mapped files that are shared between processes
+
+        Returns:
+            dict: private_bytes and mapped_bytes of the arrays; resident_bytes, shared_bytes
+                  and private_mapped_bytes of the mapped files in this process
+        """
+        arrays = self.get_arrays()
+        mapped_files = [
+            os.path.abspath(array.filename)
+            for array in arrays.values()
+            if isinstance(array, np.memmap) and array.filename is not None
+        ]
+        mapped_usage = get_mapped_file_usage(mapped_files)
+        return {
+            "private_bytes": self.get_memory_usage(),
+            "mapped_bytes": int(
+                sum(array.nbytes for array in arrays.values() if isinstance(array, np.memmap))
+            ),
+            "resident_bytes": mapped_usage["resident_bytes"],
+            "shared_bytes": mapped_usage["shared_bytes"],
+            "private_mapped_bytes": mapped_usage["private_bytes"],
+            "mapped_arrays": [
+                name for name, array in arrays.items() if isinstance(array, np.memmap)
+            ],
+        }
 
 
 class LdaInputModel(GenericInputModel):
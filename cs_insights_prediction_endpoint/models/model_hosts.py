@@ -18,3 +18,5 @@ class RemoteHost(BaseModel):
     # token: str # Authentication token
     models: List[str] = Field(...)  # List of possible models (names like lda)
     created_models: List[str]  # List of actual created models (ids)
+    # Relative share of created models placed on the host
+    capacity: float = Field(default=1.0, gt=0)
@@ -1,10 +1,15 @@
 """This module implements the hosts managment"""
-from typing import List
+from typing import Dict, List
 
 from fastapi import APIRouter, Depends, HTTPException, status
 from pydantic import BaseModel
 
 from cs_insights_prediction_endpoint.models.model_hosts import RemoteHost
+from cs_insights_prediction_endpoint.utils.host_health import (
+    HealthMonitor,
+    get_health_monitor,
+)
+from cs_insights_prediction_endpoint.utils.placement import get_address
 from cs_insights_prediction_endpoint.utils.remote_storage_controller import (
     RemoteStorageController,
     get_remote_storage_controller,
@@ -42,13 +47,34 @@ def list_all_remote_hosts(
     return RemoteHostListResponse(remote_host_list=rsc.get_all_remote_hosts())
 
 
+@router.get(
+    "/health",
+    response_description="Get the health of all hosts",
+    status_code=status.HTTP_200_OK,
+)
+def get_remote_host_health(
+    rsc: RemoteStorageController = Depends(get_remote_storage_controller),
+    monitor: HealthMonitor = Depends(get_health_monitor),
+) -> Dict[str, dict]:
+    """Get the health (circuit state, latency, error rate and load) of all remote hosts
+
+    Returns:
+        Dict[str, dict]: The health of every registered host by its address
+    """
+    report = monitor.get_report()
+    return {
+        get_address(host): report.get(get_address(host), {"state": "closed", "requests": 0})
+        for host in rsc.get_all_remote_hosts()
+    }
+
+
 @router.post(
     "/",
     response_description="Get all currently available hosts",
     response_model=RemoteHost,
     status_code=status.HTTP_200_OK,
 )
-def add_remote_host(
+async def add_remote_host(
     remote_host: RemoteHost, rsc: RemoteStorageController = Depends(get_remote_storage_controller)
 ) -> RemoteHost:
     """Add a remote host to the remote host list
@@ -59,7 +85,7 @@ def add_remote_host(
     Returns:
         RemoteHost: The added remote host
     """
-    rsc.add_remote_host(remote_host)
+    await rsc.add_remote_host_async(remote_host)
     return remote_host
 
 
@@ -69,7 +95,7 @@ def add_remote_host(
     response_model=RemoteHostDeleteRequest,
     status_code=status.HTTP_200_OK,
 )
-def delete_remote_host(
+async def delete_remote_host(
     to_delete: RemoteHostDeleteRequest,
     rsc: RemoteStorageController = Depends(get_remote_storage_controller),
 ) -> RemoteHostDeleteRequest:
@@ -81,6 +107,6 @@ def delete_remote_host(
     Returns:
         RemoteHost: The deleted remote host
     """
-    if not rsc.remove_remote_host(to_delete.ip):
+    if not await rsc.remove_remote_host_async(to_delete.ip):
         raise HTTPException(status_code=404, detail="Host not found")
     return to_delete
@@ -1,15 +1,36 @@
 """This module implements the endpoint logic for models."""
+import asyncio
+import json
+from functools import partial
 from importlib import import_module
-from typing import Any, Dict, List
+from typing import Any, AsyncIterator, Dict, List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Response, status
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
 from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
 
 from cs_insights_prediction_endpoint import __version__
 from cs_insights_prediction_endpoint.models.generic_model import (
     GenericInputModel,
+    GenericModel,
     GenericOutputModel,
 )
+from cs_insights_prediction_endpoint.utils.array_encoding import (
+    ARROW_MEDIA_TYPE,
+    RAW_MEDIA_TYPE,
+    SHAPE_HEADER,
+    encode_array,
+    get_shape_header,
+    negotiate_array_media_type,
+)
+from cs_insights_prediction_endpoint.utils.job_controller import (
+    Job,
+    JobController,
+    JobQueueFullError,
+    get_job_controller,
+)
+from cs_insights_prediction_endpoint.utils.json_response import RawJSON
 from cs_insights_prediction_endpoint.utils.remote_storage_controller import (
     RemoteStorageController,
     get_remote_storage_controller,
@@ -24,6 +45,10 @@ from cs_insights_prediction_endpoint.utils.storage_controller import (
 
 router: APIRouter = APIRouter()
 
+# Header of responses rejected by the load shedding of the host (e.g., a full job queue);
+# the host is healthy, so such responses are not counted as failures of the host
+LOAD_SHEDDING_HEADER = "x-load-shedding"
+
 
 class StorageControllerListReponse(BaseModel):
     """Response model for both
@@ -41,6 +66,79 @@ class ModelSpecificFunctionCallResponse(BaseModel):
     function_calls: List[str]
 
 
+class ModelCacheStatisticsResponse(BaseModel):
+    """Response model for the statistics of the lazy model cache"""
+
+    hits: int
+    misses: int
+    evictions: int
+    resident_models: int
+    resident_bytes: int
+
+
+class ModelMemoryReportResponse(BaseModel):
+    """Response model for the memory reports of all loaded models"""
+
+    models: Dict[str, dict]
+
+
+class TrainingResponse(BaseModel):
+    """Response model for training a model from a streamed corpus"""
+
+    documents: int
+    chunks: int
+
+
+class ModelVersionsResponse(BaseModel):
+    """Response model for the current and the saved versions of a model"""
+
+    version: int
+    versions: List[int]
+
+
+class ModelRollbackRequest(BaseModel):
+    """Request model for restoring a saved version of a model"""
+
+    version: int
+
+
+class JobSubmissionResponse(BaseModel):
+    """Response model for the submission of an asynchronous function call"""
+
+    job_id: str
+
+
+class JobStatusResponse(BaseModel):
+    """Response model for the status of an asynchronous function call"""
+
+    job_id: str
+    model_id: str
+    function_call: str
+    state: str
+    position: Optional[int]
+    submitted_at: float
+    started_at: Optional[float]
+    finished_at: Optional[float]
+    queued_seconds: float
+    running_seconds: Optional[float]
+    error: Optional[str]
+
+
+class JobStatisticsResponse(BaseModel):
+    """Response model for the queue depth and durations of asynchronous function calls"""
+
+    workers: int
+    queued: int
+    running: int
+    submitted: int
+    succeeded: int
+    failed: int
+    cancelled: int
+    mean_queued_seconds: float
+    mean_running_seconds: float
+    max_running_seconds: float
+
+
 class ModelCreationResponse(BaseModel):
     """Response Model for the successfull creation of a model"""
 
@@ -104,6 +202,33 @@ class ModelCreationRequest(BaseModel):
     model_specification: dict
 
 
+class BulkModelCreationRequest(BaseModel):
+    """Request model for creating many models with one request"""
+
+    models: List[ModelCreationRequest]
+
+
+class BulkModelDeletionRequest(BaseModel):
+    """Request model for deleting many models with one request"""
+
+    model_ids: List[str]
+
+
+class BulkItemResult(BaseModel):
+    """Result of one item of a bulk request; index is its position in the request"""
+
+    index: int
+    status_code: int
+    model_id: Optional[str] = None
+    detail: Optional[str] = None
+
+
+class BulkResponse(BaseModel):
+    """Response model for bulk requests with the result of every item"""
+
+    results: List[BulkItemResult]
+
+
 @router.get(
     "/implemented",
     response_description="Lists all currently available(implemented) models",
@@ -122,6 +247,128 @@ def list_all_implemented_models(
     return StorageControllerListReponse(models=models)
 
 
+@router.get(
+    "/cache",
+    response_description="Statistics of the lazy model cache",
+    response_model=ModelCacheStatisticsResponse,
+    status_code=status.HTTP_200_OK,
+)
+def get_model_cache_statistics(
+    sc: StorageController = Depends(get_storage_controller),
+) -> ModelCacheStatisticsResponse:
+    """Endpoint for getting the hit/miss/eviction counters of the lazy model cache"""
+    return ModelCacheStatisticsResponse(**sc.get_cache_statistics())
+
+
+@router.get(
+    "/memory",
+    response_description="Memory reports of all loaded models",
+    response_model=ModelMemoryReportResponse,
+    status_code=status.HTTP_200_OK,
+)
+def get_model_memory_report(
+    sc: StorageController = Depends(get_storage_controller),
+) -> ModelMemoryReportResponse:
+    """Endpoint for getting the private and shared memory used by every loaded model"""
+    return ModelMemoryReportResponse(models=sc.get_memory_report())
+
+
+@router.get(
+    "/jobs",
+    response_description="Statistics of the asynchronous function calls",
+    response_model=JobStatisticsResponse,
+    status_code=status.HTTP_200_OK,
+)
+def get_job_statistics(
+    jc: JobController = Depends(get_job_controller),
+) -> JobStatisticsResponse:
+    """Endpoint for getting the queue depth, job counters and durations of the job queue"""
+    return JobStatisticsResponse(**jc.get_statistics())
+
+
+@router.post(
+    "/bulk",
+    response_description="Creates many models",
+    response_model=BulkResponse,
+    status_code=status.HTTP_207_MULTI_STATUS,
+)
+async def create_models(
+    bulk_creation_request: BulkModelCreationRequest,
+    settings: Settings = Depends(get_settings),
+    sc: StorageController = Depends(get_storage_controller),
+) -> BulkResponse:
+    """Endpoint for creating many models. The models are built in parallel and their metadata
+    is stored in one batch; the result of every model is reported separately
+
+    Arguments:
+        bulk_creation_request (BulkModelCreationRequest): The ModelCreationRequests of the models
+
+    Returns:
+        BulkResponse: The created model id or the error of every model
+    """
+    check_bulk_size(len(bulk_creation_request.models), settings)
+    # Building a model may train it, so only a few are built at the same time
+    semaphore = asyncio.Semaphore(settings.bulk_create_concurrency)
+
+    async def build(index: int, model_creation_request: ModelCreationRequest) -> Any:
+        async with semaphore:
+            try:
+                return await run_in_threadpool(build_model, model_creation_request, settings)
+            except HTTPException as error:
+                return BulkItemResult(
+                    index=index, status_code=error.status_code, detail=error.detail
+                )
+            except Exception as error:  # a failing model must not fail the others
+                return BulkItemResult(index=index, status_code=500, detail=str(error))
+
+    outcomes = await asyncio.gather(
+        *(build(index, request) for index, request in enumerate(bulk_creation_request.models))
+    )
+    models = [outcome for outcome in outcomes if isinstance(outcome, GenericModel)]
+    await sc.add_models_async(models)
+    return BulkResponse(
+        results=[
+            BulkItemResult(index=index, status_code=201, model_id=outcome.id)
+            if isinstance(outcome, GenericModel)
+            else outcome
+            for index, outcome in enumerate(outcomes)
+        ]
+    )
+
+
+@router.delete(
+    "/bulk",
+    response_description="Deletes many models",
+    response_model=BulkResponse,
+    status_code=status.HTTP_207_MULTI_STATUS,
+)
+async def delete_models(
+    bulk_deletion_request: BulkModelDeletionRequest,
+    settings: Settings = Depends(get_settings),
+    sc: StorageController = Depends(get_storage_controller),
+) -> BulkResponse:
+    """Endpoint for deleting many models; their metadata is deleted in one batch
+
+    Arguments:
+        bulk_deletion_request (BulkModelDeletionRequest): The ids of the models
+
+    Returns:
+        BulkResponse: Whether every model was deleted or not found
+    """
+    check_bulk_size(len(bulk_deletion_request.model_ids), settings)
+    deleted = set(await sc.del_models_async(bulk_deletion_request.model_ids))
+    return BulkResponse(
+        results=[
+            BulkItemResult(index=index, status_code=200, model_id=model_id)
+            if model_id in deleted
+            else BulkItemResult(
+                index=index, status_code=404, model_id=model_id, detail="Model not found"
+            )
+            for index, model_id in enumerate(bulk_deletion_request.model_ids)
+        ]
+    )
+
+
 @router.get(
     "/{current_model_id}",
     response_description="Lists all function calls of the current model",
@@ -132,16 +379,11 @@ def list_all_function_calls(
     current_model_id: str, sc: StorageController = Depends(get_storage_controller)
 ) -> BaseModel:
     """Endpoint for getting a list of all implemented function calls"""
-    # validate id
-    current_model = sc.get_model(current_model_id)
-    if current_model is None:
+    # The names are listed without loading the model (e.g., in lazy loading mode)
+    current_model_function_calls = sc.get_function_calls(current_model_id)
+    if current_model_function_calls is None:
         # error not found
         raise HTTPException(status_code=404, detail="Model not found")
-
-    # get fun calls
-    current_model_function_calls = (
-        current_model.get_function_calls()
-    )  # current model functioncalls list
     return ModelSpecificFunctionCallResponse(function_calls=current_model_function_calls)
 
 
@@ -151,18 +393,15 @@ def list_all_function_calls(
     response_model=ModelDeletionResponse,
     status_code=status.HTTP_200_OK,
 )
-def delete_model(
+async def delete_model(
     current_model_id: str, sc: StorageController = Depends(get_storage_controller)
 ) -> ModelDeletionResponse:
     """Endpoint for deleting a model"""
-    # validate id
-    current_model = sc.get_model(current_model_id)
-    if current_model is None:
-        # error not found
+    # The model is not looked up first, which would load it from disk just to delete it
+    try:
+        await sc.del_model_async(current_model_id)
+    except KeyError:
         raise HTTPException(status_code=404, detail="Model not implemented")
-
-    # delete it
-    sc.del_model(current_model.get_id())
     return ModelDeletionResponse(model_id=current_model_id)
 
 
@@ -187,7 +426,7 @@ def list_all_created_models(
     response_model=ModelCreationResponse,
     status_code=status.HTTP_201_CREATED,
 )
-def create_model(
+async def create_model(
     model_creation_request: ModelCreationRequest,
     response: Response,
     settings: Settings = Depends(get_settings),
@@ -202,22 +441,49 @@ def create_model(
     Returns:
         dict: Either an error or the created model id
     """
-    model = None
+    # Creating a model may train it, so it must not block the event loop
+    model = await run_in_threadpool(build_model, model_creation_request, settings)
+    await sc.add_model_async(model)
+    response.headers["location"] = f"/api/v{__version__.split('.')[0]}/models/{model.id}"
+
+    return ModelCreationResponse(model_id=model.id)
+
+
+def build_model(model_creation_request: ModelCreationRequest, settings: Settings) -> GenericModel:
+    """Build (and train) the model specified by model_creation_request
+
+    Raises:
+        HTTPException: 404 if the model type is not implemented; 400 if the specification
+                       is invalid
+
+    Returns:
+        GenericModel: The model; it is not added to the storage controller yet
+    """
+    model: Optional[GenericModel] = None
     for implemented_models in settings.implemented_models:
         if model_creation_request.model_type in implemented_models:
             model_specs = implemented_models[model_creation_request.model_type]
             model_module = import_module(model_specs[0])  # TODO Use proper model
             model_class = model_specs[1]
-            model = getattr(model_module, model_class)(
-                type_of_model=model_creation_request.model_type,
-                **(model_creation_request.model_specification),
-            )
+            try:
+                model = getattr(model_module, model_class)(
+                    type_of_model=model_creation_request.model_type,
+                    **(model_creation_request.model_specification),
+                )
+            except ValueError as error:
+                raise HTTPException(status_code=400, detail=str(error))
     if model is None:
         raise HTTPException(status_code=404, detail="Model not implemented")
-    sc.add_model(model)
-    response.headers["location"] = f"/api/v{__version__.split('.')[0]}/models/{model.id}"
+    return model
 
-    return ModelCreationResponse(model_id=model.id)
+
+def check_bulk_size(size: int, settings: Settings) -> None:
+    """Raise a HTTPException (400) if a bulk request has more than bulk_max_items items"""
+    if size > settings.bulk_max_items:
+        raise HTTPException(
+            status_code=400,
+            detail=f"A bulk request can contain at most {settings.bulk_max_items} items",
+        )
 
 
 @router.post(
@@ -225,39 +491,337 @@ def create_model(
     response_description="Runs a function",
     response_model=GenericOutputModel,
     status_code=status.HTTP_200_OK,
+    responses={
+        200: {
+            "content": {
+                RAW_MEDIA_TYPE: {"schema": {"type": "string", "format": "binary"}},
+                ARROW_MEDIA_TYPE: {"schema": {"type": "string", "format": "binary"}},
+            },
+            "description": "Numeric outputs are encoded in binary if accepted by the client",
+        }
+    },
 )
 def get_information(
+    request: Request,
     current_model_id: str,
     generic_input: GenericInputModel,
     sc: StorageController = Depends(get_storage_controller),
-) -> BaseModel:
-    """Gets info out of post data"""
-    return run_function(current_model_id, generic_input.function_call, generic_input.input_data, sc)
+) -> Any:
+    """Gets info out of post data. Array outputs (e.g., getTopics) are returned as
+    float32 in a binary encoding if the accept header asks for one
+    """
+    output = call_function(
+        current_model_id, generic_input.function_call, generic_input.input_data, sc
+    )
+    return build_output_response(request, generic_input.function_call, output)
+
+
+@router.post(
+    "/{current_model_id}/train",
+    response_description="Trains the model from a streamed corpus",
+    response_model=TrainingResponse,
+    status_code=status.HTTP_200_OK,
+    openapi_extra={
+        "requestBody": {
+            "content": {
+                "application/x-ndjson": {
+                    "schema": {
+                        "type": "string",
+                        "description": "One bag of words [[word_id, count], ...] per line",
+                    }
+                }
+            },
+            "required": True,
+        }
+    },
+)
+async def train_model_stream(
+    request: Request,
+    current_model_id: str,
+    chunk_size: Optional[int] = None,
+    settings: Settings = Depends(get_settings),
+    sc: StorageController = Depends(get_storage_controller),
+) -> TrainingResponse:
+    """Endpoint for training a model from NDJSON documents (one bag of words per line).
+    A copy of the model is updated once per chunk of documents while the body is read, so
+    only one chunk is held in memory. The copy becomes the new version of the model when
+    the body was read completely; until then the previous version serves all requests.
+    """
+    chunk_size = chunk_size or settings.train_chunk_size
+    staged = await run_in_threadpool(sc.begin_update, current_model_id)
+    if staged is None:
+        raise HTTPException(status_code=404, detail="Model not found")
+    documents = 0
+    chunks = 0
+    chunk: List[Any] = []
+    try:
+        async for document in iter_ndjson(request.stream()):
+            chunk.append(document)
+            documents += 1
+            if len(chunk) >= chunk_size:
+                await run_in_threadpool(staged.train, {"corpus": chunk})
+                chunks += 1
+                chunk = []
+        if chunk:
+            await run_in_threadpool(staged.train, {"corpus": chunk})
+            chunks += 1
+    except BaseException:
+        sc.abort_update(current_model_id)
+        raise
+    await run_in_threadpool(sc.commit_update, current_model_id, staged)
+    return TrainingResponse(documents=documents, chunks=chunks)
+
+
+@router.get(
+    "/{current_model_id}/versions",
+    response_description="The current and the saved versions of the model",
+    response_model=ModelVersionsResponse,
+    status_code=status.HTTP_200_OK,
+)
+def get_model_versions(
+    current_model_id: str, sc: StorageController = Depends(get_storage_controller)
+) -> ModelVersionsResponse:
+    """Endpoint for listing the version of a model and all versions saved on disk"""
+    versions = sc.get_model_versions(current_model_id)
+    if versions is None:
+        raise HTTPException(status_code=404, detail="Model not found")
+    return ModelVersionsResponse(**versions)
+
+
+@router.post(
+    "/{current_model_id}/rollback",
+    response_description="Restores a saved version of the model",
+    response_model=ModelVersionsResponse,
+    status_code=status.HTTP_200_OK,
+)
+def rollback_model(
+    current_model_id: str,
+    rollback_request: ModelRollbackRequest,
+    sc: StorageController = Depends(get_storage_controller),
+) -> ModelVersionsResponse:
+    """Endpoint for restoring a saved version of a model; requests are served by the
+    current version until the saved one was loaded
+    """
+    try:
+        sc.rollback_model(current_model_id, rollback_request.version)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Model not found")
+    except ValueError as error:
+        raise HTTPException(status_code=404, detail=str(error))
+    versions = sc.get_model_versions(current_model_id)
+    if versions is None:
+        raise HTTPException(status_code=404, detail="Model not found")
+    return ModelVersionsResponse(**versions)
+
+
+async def iter_ndjson(stream: AsyncIterator[bytes]) -> AsyncIterator[Any]:
+    """Parses the lines of a streamed NDJSON body; empty lines are skipped
+
+    Args:
+        stream (AsyncIterator[bytes]): The chunks of the body
+
+    Raises:
+        HTTPException: 400 if a line is not valid json
+
+    Yields:
+        Any: The parsed value of every line
+    """
+    # Pieces of the current line; only new data is split, so long lines stay linear
+    pieces: List[bytes] = []
+    line_number = 0
+    async for data in stream:
+        *lines, rest = data.split(b"\n")
+        if lines:
+            lines[0] = b"".join(pieces + [lines[0]])
+            pieces = []
+        pieces.append(rest)
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                yield parse_ndjson_line(line, line_number)
+    buffer = b"".join(pieces)
+    if buffer.strip():
+        yield parse_ndjson_line(buffer, line_number + 1)
+
+
+def parse_ndjson_line(line: bytes, line_number: int) -> Any:
+    """Parses a single line of a NDJSON body or raises a 400 HTTPException"""
+    try:
+        return json.loads(line)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid json in line {line_number}")
 
 
 def run_function(
     current_model_id: str, req_function: str, data_input: Dict[Any, Any], sc: StorageController
 ) -> BaseModel:
     """Runs a given function of a given model"""
-    # Validate id
-    current_model = sc.get_model(current_model_id)
-    if current_model is None:
-        # error not found
-        raise HTTPException(status_code=404, detail="Model not found")
+    output = call_function(current_model_id, req_function, data_input, sc)
+    return build_output_model(req_function, output)
 
-    # Check if the function is actually availabe in the requested model
-    # Return an HTTPException if not; Execute the function and return Dict otherwise
-    try:
-        my_fn = current_model.function_calls[req_function]
-    except KeyError:
-        raise HTTPException(status_code=404, detail="Function not implemented")
-    # Run function and parse output dict into actual response model
-    output = my_fn(**data_input)
+
+def call_function(
+    current_model_id: str, req_function: str, data_input: Dict[Any, Any], sc: StorageController
+) -> Any:
+    """Runs a given function of a given model and returns its raw output. Functions that
+    update the model (e.g., train) run on a copy, which is saved as its new version
+    """
+    with sc.use_model(current_model_id, req_function) as current_model:
+        # Validate id
+        if current_model is None:
+            # error not found
+            raise HTTPException(status_code=404, detail="Model not found")
+
+        # Check if the function is actually availabe in the requested model
+        # Return an HTTPException if not; Execute the function and return Dict otherwise
+        try:
+            my_fn = current_model.function_calls[req_function]
+        except KeyError:
+            raise HTTPException(status_code=404, detail="Function not implemented")
+        # Run function and parse output dict into actual response model
+        try:
+            output = my_fn(**data_input)
+        except ValueError as error:
+            raise HTTPException(status_code=400, detail=str(error))
+    return output
+
+
+def build_output_response(request: Request, req_function: str, output: Any) -> Any:
+    """Builds the response for the output of a function call. Arrays are encoded in binary
+    if the client accepts it and pre-encoded json is sent without decoding it
+
+    Args:
+        request (Request): The request of the client
+        req_function (str): The name of the function call
+        output (Any): The output of the function call
+
+    Returns:
+        Any: A Response or the GenericOutputModel to serialize
+    """
+    media_type = negotiate_array_media_type(request.headers.get("accept"))
+    if media_type is not None and isinstance(output, np.ndarray):
+        return Response(
+            content=encode_array(output, media_type),
+            media_type=media_type,
+            headers={SHAPE_HEADER: get_shape_header(output)},
+        )
+    if isinstance(output, RawJSON):
+        return Response(
+            content=b'{"output_data":' + output.data + b"}", media_type="application/json"
+        )
+    return build_output_model(req_function, output)
+
+
+def build_output_model(req_function: str, output: Any) -> GenericOutputModel:
+    """Builds the response model from the output of a function call"""
+    if isinstance(output, RawJSON):
+        output = output.loads()
     # XXX-TN we have to ensure that we return a dict on a function call
     #        i dont know if the following is the best way to achive this
+    if isinstance(output, np.ndarray):
+        output = output.tolist()
     if not type(output) is dict:
         # raise HTTPException(status_code=500, detail="Model did not return a valid response")
         output = {req_function: str(output)}  # TODO-TN this is relly hacky
     out_model_response = GenericOutputModel(output_data=output)
 
     return out_model_response
+
+
+@router.post(
+    "/{current_model_id}/jobs",
+    response_description="Runs a function asynchronously",
+    response_model=JobSubmissionResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+)
+def submit_job(
+    current_model_id: str,
+    generic_input: GenericInputModel,
+    response: Response,
+    sc: StorageController = Depends(get_storage_controller),
+    jc: JobController = Depends(get_job_controller),
+) -> JobSubmissionResponse:
+    """Endpoint for queuing a function call (e.g., train), which returns the id of the job"""
+    with sc.use_model(current_model_id) as current_model:
+        if current_model is None:
+            raise HTTPException(status_code=404, detail="Model not found")
+        # The job gets a snapshot sharing the loaded state, so evicting the model before the
+        # job is dispatched does not unload the state the job runs on; its version is the
+        # base of the update, which is rejected if the model changed while the job ran
+        snapshot = current_model.snapshot(copy_state=False)
+    try:
+        job = jc.submit(
+            snapshot,
+            generic_input.function_call,
+            generic_input.input_data,
+            on_update=partial(sc.install_version, current_model_id, base_version=snapshot.version),
+        )
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Function not implemented")
+    except JobQueueFullError as error:
+        raise HTTPException(
+            status_code=503, detail=str(error), headers={LOAD_SHEDDING_HEADER: "job-queue"}
+        )
+    response.headers[
+        "location"
+    ] = f"/api/v{__version__.split('.')[0]}/models/{current_model_id}/jobs/{job.id}"
+    return JobSubmissionResponse(job_id=job.id)
+
+
+@router.get(
+    "/{current_model_id}/jobs/{job_id}",
+    response_description="Status of an asynchronous function call",
+    response_model=JobStatusResponse,
+    status_code=status.HTTP_200_OK,
+)
+def get_job_status(
+    current_model_id: str, job_id: str, jc: JobController = Depends(get_job_controller)
+) -> JobStatusResponse:
+    """Endpoint for getting the state, queue position and durations of a job"""
+    job = get_job(current_model_id, job_id, jc)
+    return JobStatusResponse(**jc.get_status(job))
+
+
+@router.get(
+    "/{current_model_id}/jobs/{job_id}/result",
+    response_description="Result of an asynchronous function call",
+    response_model=GenericOutputModel,
+    status_code=status.HTTP_200_OK,
+)
+def get_job_result(
+    request: Request,
+    current_model_id: str,
+    job_id: str,
+    jc: JobController = Depends(get_job_controller),
+) -> Any:
+    """Endpoint for getting the output of a finished job"""
+    job = get_job(current_model_id, job_id, jc)
+    if job.state == "failed":
+        raise HTTPException(status_code=job.error_status, detail=job.error)
+    if job.state != "succeeded":
+        raise HTTPException(status_code=409, detail=f"Job is {job.state}")
+    return build_output_response(request, job.function_call, job.output)
+
+
+@router.delete(
+    "/{current_model_id}/jobs/{job_id}",
+    response_description="Cancels an asynchronous function call",
+    response_model=JobStatusResponse,
+    status_code=status.HTTP_200_OK,
+)
+def cancel_job(
+    current_model_id: str, job_id: str, jc: JobController = Depends(get_job_controller)
+) -> JobStatusResponse:
+    """Endpoint for cancelling a job; the result of a running job is discarded"""
+    job = get_job(current_model_id, job_id, jc)
+    if not jc.cancel(job):
+        raise HTTPException(status_code=409, detail=f"Job is {job.state}")
+    return JobStatusResponse(**jc.get_status(job))
+
+
+def get_job(current_model_id: str, job_id: str, jc: JobController) -> Job:
+    """Returns the job job_id of the model current_model_id or raises a 404 HTTPException"""
+    job = jc.get_job(job_id)
+    if job is None or job.model_id != current_model_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
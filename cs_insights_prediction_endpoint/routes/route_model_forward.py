@@ -1,12 +1,30 @@
 """This module implements the endpoint logic for models."""
-from typing import List, Optional
+import asyncio
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Set, Union
 
-import requests
+import httpx
 from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from starlette.background import BackgroundTask
 
 from cs_insights_prediction_endpoint import __version__
 from cs_insights_prediction_endpoint.models.generic_model import GenericInputModel
+from cs_insights_prediction_endpoint.routes.route_model import (
+    LOAD_SHEDDING_HEADER,
+    BulkItemResult,
+    BulkModelCreationRequest,
+    BulkModelDeletionRequest,
+    BulkResponse,
+    ModelRollbackRequest,
+    ModelVersionsResponse,
+    check_bulk_size,
+)
+from cs_insights_prediction_endpoint.utils.array_encoding import SHAPE_HEADER
+from cs_insights_prediction_endpoint.utils.host_health import get_health_monitor
+from cs_insights_prediction_endpoint.utils.http_client import get_http_client
 from cs_insights_prediction_endpoint.utils.remote_storage_controller import (
     RemoteStorageController,
     get_remote_storage_controller,
@@ -21,6 +39,20 @@ from cs_insights_prediction_endpoint.utils.storage_controller import (
 
 router: APIRouter = APIRouter()
 
+# Headers of the client request that are passed on to the remote host
+forwarded_request_headers = ["accept", "content-type", "content-length"]
+# Headers of the remote host response (besides content-type) passed on to the client
+forwarded_response_headers = ["location", SHAPE_HEADER, LOAD_SHEDDING_HEADER]
+# Status codes of remote hosts counted as failures of the host, unless the host shed the load
+# on purpose (see LOAD_SHEDDING_HEADER)
+failure_status_codes = {502, 503, 504}
+
+
+class HostNotReachedException(HTTPException):
+    """Raised if a request never reached the remote host because connecting failed, so it can
+    be sent to another host without being processed twice
+    """
+
 
 class StorageControllerListReponse(BaseModel):
     """Response model for both
@@ -56,21 +88,200 @@ def forward_list_all_implemented_models(
     return StorageControllerListReponse(models=rsc.get_all_models())
 
 
+@router.post(
+    "/bulk",
+    response_description="Creates many models",
+    response_model=BulkResponse,
+    status_code=status.HTTP_207_MULTI_STATUS,
+)
+async def forward_create_models(
+    request: Request,
+    bulk_creation_request: BulkModelCreationRequest,
+    settings: Settings = Depends(get_settings),
+    rsc: RemoteStorageController = Depends(get_remote_storage_controller),
+    client: httpx.AsyncClient = Depends(get_http_client),
+) -> BulkResponse:
+    """Endpoint for creating many models. The models are grouped by the host they are placed on
+    and every group is created with one bulk request; groups of hosts that were not reached
+    (or whose circuit is open) fail over to the next host
+
+    Arguments:
+        bulk_creation_request (BulkModelCreationRequest): The ModelCreationRequests of the models
+
+    Returns:
+        BulkResponse: The created model id or the error of every model
+    """
+    models = bulk_creation_request.models
+    check_bulk_size(len(models), settings)
+    # Models are placed by their name if given; unnamed models are spread randomly
+    placement_keys = [str(model.model_specification.get("name", uuid.uuid4())) for model in models]
+    monitor = get_health_monitor()
+    deadline = get_deadline(settings)
+    failed_hosts: Set[str] = set()
+    results: Dict[int, BulkItemResult] = {}
+    pending = list(range(len(models)))
+    while pending:
+        groups: Dict[str, List[int]] = {}
+        unavailable = failed_hosts | monitor.get_unavailable()
+        for index in pending:
+            host = rsc.place_model(
+                models[index].model_type, placement_keys[index], exclude=unavailable
+            )
+            if host is not None:
+                groups.setdefault(host, []).append(index)
+            elif index not in results:
+                # Items of failed hosts keep the error of their last host
+                if rsc.find_model_in_remote_hosts(models[index].model_type) is None:
+                    detail = "No hosts contain the specified model"
+                    results[index] = BulkItemResult(index=index, status_code=404, detail=detail)
+                else:
+                    detail = "No healthy hosts contain the specified model"
+                    results[index] = BulkItemResult(index=index, status_code=503, detail=detail)
+        pending = []
+        # Like single requests, a host whose circuit is half open gets one trial request
+        for host in list(groups):
+            if not monitor.allow_request(host):
+                failed_hosts.add(host)
+                pending.extend(groups.pop(host))
+        outcomes = await asyncio.gather(
+            *(
+                forward_bulk_request(
+                    client,
+                    "POST",
+                    f"http://{host}{request.url.path}",
+                    {"models": [models[index].dict() for index in indexes]},
+                    deadline,
+                    settings,
+                )
+                for host, indexes in groups.items()
+            )
+        )
+        for (host, indexes), outcome in zip(groups.items(), outcomes):
+            if isinstance(outcome, BulkResponse):
+                created_models = []
+                for result in outcome.results:
+                    index = indexes[result.index]
+                    results[index] = result.copy(update={"index": index})
+                    if result.status_code == status.HTTP_201_CREATED and result.model_id:
+                        created_models.append(result.model_id)
+                await rsc.add_models_to_created_model_list_async(host.split(":")[0], created_models)
+            else:
+                for index in indexes:
+                    results[index] = BulkItemResult(
+                        index=index, status_code=outcome.status_code, detail=outcome.detail
+                    )
+                # Groups that reached the host may have been created partly, so they are not
+                # sent to another host
+                if isinstance(outcome, HostNotReachedException):
+                    failed_hosts.add(host)
+                    pending.extend(indexes)
+        if deadline is not None and time.monotonic() >= deadline:
+            break
+    for index in pending:
+        if index not in results:
+            results[index] = BulkItemResult(
+                index=index, status_code=503, detail="Remote host unavailable"
+            )
+    return BulkResponse(results=[results[index] for index in range(len(models))])
+
+
+@router.delete(
+    "/bulk",
+    response_description="Deletes many models",
+    response_model=BulkResponse,
+    status_code=status.HTTP_207_MULTI_STATUS,
+)
+async def forward_delete_models(
+    request: Request,
+    bulk_deletion_request: BulkModelDeletionRequest,
+    settings: Settings = Depends(get_settings),
+    rsc: RemoteStorageController = Depends(get_remote_storage_controller),
+    client: httpx.AsyncClient = Depends(get_http_client),
+) -> BulkResponse:
+    """Endpoint for deleting many models; the models of every host are deleted with one
+    bulk request
+
+    Arguments:
+        bulk_deletion_request (BulkModelDeletionRequest): The ids of the models
+
+    Returns:
+        BulkResponse: Whether every model was deleted or the error
+    """
+    model_ids = bulk_deletion_request.model_ids
+    check_bulk_size(len(model_ids), settings)
+    monitor = get_health_monitor()
+    results: Dict[int, BulkItemResult] = {}
+    groups: Dict[str, List[int]] = {}
+    available: Dict[str, bool] = {}
+    for index, model_id in enumerate(model_ids):
+        host = rsc.find_created_model_in_remote_hosts(model_id)
+        if host is not None and host not in available:
+            available[host] = monitor.allow_request(host)
+        if host is None:
+            results[index] = BulkItemResult(
+                index=index, status_code=404, model_id=model_id, detail="Model not found"
+            )
+        elif not available[host]:
+            results[index] = BulkItemResult(
+                index=index, status_code=503, model_id=model_id, detail="Remote host unavailable"
+            )
+        else:
+            groups.setdefault(host, []).append(index)
+    deadline = get_deadline(settings)
+    outcomes = await asyncio.gather(
+        *(
+            forward_bulk_request(
+                client,
+                "DELETE",
+                f"http://{host}{request.url.path}",
+                {"model_ids": [model_ids[index] for index in indexes]},
+                deadline,
+                settings,
+            )
+            for host, indexes in groups.items()
+        )
+    )
+    for (host, indexes), outcome in zip(groups.items(), outcomes):
+        if isinstance(outcome, BulkResponse):
+            deleted_models = []
+            for result in outcome.results:
+                index = indexes[result.index]
+                results[index] = result.copy(update={"index": index})
+                if result.status_code == status.HTTP_200_OK and result.model_id:
+                    deleted_models.append(result.model_id)
+            await rsc.remove_models_from_created_model_list_async(
+                host.split(":")[0], deleted_models
+            )
+        else:
+            for index in indexes:
+                results[index] = BulkItemResult(
+                    index=index,
+                    status_code=outcome.status_code,
+                    model_id=model_ids[index],
+                    detail=outcome.detail,
+                )
+    return BulkResponse(results=[results[index] for index in range(len(model_ids))])
+
+
 @router.get(
     "/{current_model_id}",
     response_description="Lists all function calls of the current model",
     # response_model=ModelSpecificFunctionCallResponse,
     status_code=status.HTTP_200_OK,
 )
-def forward_list_all_function_calls(
+async def forward_list_all_function_calls(
     request: Request,
     current_model_id: str,
     rsc: RemoteStorageController = Depends(get_remote_storage_controller),
+    client: httpx.AsyncClient = Depends(get_http_client),
 ) -> Response:
     """Endpoint for getting a list of all implemented function calls"""
-    host = get_host(current_model_id, rsc)
-    r = requests.get(f"http://{host}{request.url.path}")
-    return build_response(r)
+    host = await get_host(current_model_id, rsc)
+    upstream = client.build_request(
+        "GET", f"http://{host}{request.url.path}", headers=get_forward_headers(request)
+    )
+    r = await send_request(client, upstream, stream=True)
+    return build_streaming_response(r)
 
 
 @router.delete(
@@ -79,17 +290,21 @@ def forward_list_all_function_calls(
     # response_model=ModelDeletionResponse,
     status_code=status.HTTP_200_OK,
 )
-def forward_delete_model(
+async def forward_delete_model(
     request: Request,
     current_model_id: str,
     rsc: RemoteStorageController = Depends(get_remote_storage_controller),
+    client: httpx.AsyncClient = Depends(get_http_client),
 ) -> Response:
     """Endpoint for deleting a model"""
-    host = get_host(current_model_id, rsc)
-    r = requests.delete(f"http://{host}{request.url.path}")
-    if host is not None and r.ok:
-        rsc.remove_model_from_created_model_list(host.split(":")[0], current_model_id)
-    return build_response(r)
+    host = await get_host(current_model_id, rsc)
+    upstream = client.build_request(
+        "DELETE", f"http://{host}{request.url.path}", headers=get_forward_headers(request)
+    )
+    r = await send_request(client, upstream, stream=True)
+    if r.is_success:
+        await rsc.remove_model_from_created_model_list_async(host.split(":")[0], current_model_id)
+    return build_streaming_response(r)
 
 
 @router.get(
@@ -114,11 +329,12 @@ def forward_list_all_created_models(
     # response_model=ModelCreationResponse,
     status_code=status.HTTP_201_CREATED,
 )
-def forward_create_model(
+async def forward_create_model(
     request: Request,
     model_creation_request: ModelCreationRequest,
     settings: Settings = Depends(get_settings),
     rsc: RemoteStorageController = Depends(get_remote_storage_controller),
+    client: httpx.AsyncClient = Depends(get_http_client),
 ) -> Response:
     """Endpoint for creating a model
 
@@ -129,18 +345,54 @@ def forward_create_model(
     Returns:
         dict: Either an error or the created model id
     """
-    host = rsc.find_model_in_remote_hosts(model_creation_request.model_type)
-    if host is None:
+    # Models are placed by their name if given; unnamed models are spread randomly
+    placement_key = str(model_creation_request.model_specification.get("name", uuid.uuid4()))
+    if rsc.find_model_in_remote_hosts(model_creation_request.model_type) is None:
         raise HTTPException(status_code=404, detail="No hosts contain the specified model")
-    else:
-        r = requests.post(f"http://{host}{request.url.path}", json=model_creation_request.dict())
-        response = build_response(r)
-        if r.ok:
-            # Append new model to list:
-            model_id = r.json()["model_id"]
-            rsc.add_model_to_created_model_list(host.split(":")[0], model_id)
-            response.headers["location"] = f"/api/v{__version__.split('.')[0]}/models/{model_id}"
-        return response
+    monitor = get_health_monitor()
+    # All attempts share one deadline, so failing over never exceeds the forward timeout
+    deadline = get_deadline(settings)
+    failed_hosts: Set[str] = set()
+    last_error: Optional[HTTPException] = None
+    while True:
+        host = rsc.place_model(
+            model_creation_request.model_type,
+            placement_key,
+            exclude=failed_hosts | monitor.get_unavailable(),
+        )
+        if host is None:
+            break
+        if not monitor.allow_request(host):
+            failed_hosts.add(host)
+            continue
+        upstream = client.build_request(
+            "POST",
+            f"http://{host}{request.url.path}",
+            json=model_creation_request.dict(),
+            timeout=get_remaining_timeout(deadline, settings),
+        )
+        try:
+            r = await send_request(client, upstream)
+        except HostNotReachedException as error:
+            # Only requests that never reached the host fail over; any other failure may
+            # have created the model already, so another host would create a duplicate
+            last_error = error
+            failed_hosts.add(host)
+            if deadline is not None and time.monotonic() >= deadline:
+                raise
+            continue
+        break
+    if host is None:
+        if last_error is not None:
+            raise last_error
+        raise HTTPException(status_code=503, detail="No healthy hosts contain the specified model")
+    response = build_response(r)
+    if r.is_success:
+        # Append new model to list:
+        model_id = r.json()["model_id"]
+        await rsc.add_model_to_created_model_list_async(host.split(":")[0], model_id)
+        response.headers["location"] = f"/api/v{__version__.split('.')[0]}/models/{model_id}"
+    return response
 
 
 @router.post(
@@ -148,28 +400,262 @@ def forward_create_model(
     response_description="Runs a function",
     # response_model=GenericOutputModel,
     status_code=status.HTTP_200_OK,
+    # The body is streamed to the remote host unparsed, which validates it as GenericInputModel
+    openapi_extra={
+        "requestBody": {
+            "content": {"application/json": {"schema": GenericInputModel.schema()}},
+            "required": True,
+        }
+    },
 )
-def forward_get_information(
+async def forward_get_information(
     request: Request,
     current_model_id: str,
-    generic_input: GenericInputModel,
     rsc: RemoteStorageController = Depends(get_remote_storage_controller),
+    client: httpx.AsyncClient = Depends(get_http_client),
 ) -> Response:
     """Gets info out of post data"""
-    host = get_host(current_model_id, rsc)
-    r = requests.post(f"http://{host}{request.url.path}", json=generic_input.dict())
-    return build_response(r)
+    host = await get_host(current_model_id, rsc)
+    upstream = client.build_request(
+        "POST",
+        f"http://{host}{request.url.path}",
+        content=request.stream(),
+        headers=get_forward_headers(request),
+    )
+    r = await send_request(client, upstream, stream=True)
+    return build_streaming_response(r)
+
+
+@router.post(
+    "/{current_model_id}/train",
+    response_description="Trains the model from a streamed corpus",
+    status_code=status.HTTP_200_OK,
+    # The NDJSON body is streamed to the remote host as it arrives
+    openapi_extra={
+        "requestBody": {
+            "content": {"application/x-ndjson": {"schema": {"type": "string"}}},
+            "required": True,
+        }
+    },
+)
+async def forward_train_model_stream(
+    request: Request,
+    current_model_id: str,
+    rsc: RemoteStorageController = Depends(get_remote_storage_controller),
+    client: httpx.AsyncClient = Depends(get_http_client),
+) -> Response:
+    """Forwards a streamed corpus to the host containing the model"""
+    host = await get_host(current_model_id, rsc)
+    upstream = client.build_request(
+        "POST",
+        f"http://{host}{request.url.path}",
+        params=request.query_params,
+        content=request.stream(),
+        headers=get_forward_headers(request),
+    )
+    r = await send_request(client, upstream, stream=True)
+    return build_streaming_response(r)
+
+
+@router.api_route(
+    "/{current_model_id}/jobs{job_path:path}",
+    methods=["GET", "POST", "DELETE"],
+    response_description="Submits, queries or cancels an asynchronous function call",
+    # The body is streamed to the remote host unparsed, which validates it as GenericInputModel
+    openapi_extra={
+        "requestBody": {
+            "content": {"application/json": {"schema": GenericInputModel.schema()}},
+            "required": False,
+        }
+    },
+)
+async def forward_job_request(
+    request: Request,
+    current_model_id: str,
+    job_path: str,
+    rsc: RemoteStorageController = Depends(get_remote_storage_controller),
+    client: httpx.AsyncClient = Depends(get_http_client),
+) -> Response:
+    """Forwards requests to the jobs of a model to the host containing the model"""
+    host = await get_host(current_model_id, rsc)
+    upstream = client.build_request(
+        request.method,
+        f"http://{host}{request.url.path}",
+        content=request.stream() if request.method == "POST" else None,
+        headers=get_forward_headers(request),
+    )
+    r = await send_request(client, upstream, stream=True)
+    return build_streaming_response(r)
+
+
+@router.get(
+    "/{current_model_id}/versions",
+    response_description="The current and the saved versions of the model",
+    response_model=ModelVersionsResponse,
+    status_code=status.HTTP_200_OK,
+)
+@router.post(
+    "/{current_model_id}/rollback",
+    response_description="Restores a saved version of the model",
+    response_model=ModelVersionsResponse,
+    status_code=status.HTTP_200_OK,
+    openapi_extra={
+        "requestBody": {
+            "content": {"application/json": {"schema": ModelRollbackRequest.schema()}},
+            "required": True,
+        }
+    },
+)
+async def forward_version_request(
+    request: Request,
+    current_model_id: str,
+    rsc: RemoteStorageController = Depends(get_remote_storage_controller),
+    client: httpx.AsyncClient = Depends(get_http_client),
+) -> Response:
+    """Forwards requests to the versions of a model to the host containing the model"""
+    host = await get_host(current_model_id, rsc)
+    upstream = client.build_request(
+        request.method,
+        f"http://{host}{request.url.path}",
+        content=request.stream() if request.method == "POST" else None,
+        headers=get_forward_headers(request),
+    )
+    r = await send_request(client, upstream, stream=True)
+    return build_streaming_response(r)
+
+
+async def get_host(current_model_id: str, rsc: RemoteStorageController) -> str:
+    """Get host containing the model current_model_id; fails fast if its circuit is open"""
+    host = await rsc.locate_created_model_async(current_model_id)
+    if host is None:
+        raise HTTPException(status_code=404, detail="Model not found")
+    if not get_health_monitor().allow_request(host):
+        raise HTTPException(status_code=503, detail="Remote host unavailable")
+    return host
 
 
-def get_host(current_model_id: str, rsc: RemoteStorageController) -> Optional[str]:
-    """Get host containing the model current_model_id"""
-    return rsc.find_created_model_in_remote_hosts(current_model_id)
+def get_deadline(settings: Settings) -> Optional[float]:
+    """Get the deadline (monotonic time) of all requests forwarded for one request"""
+    if settings.forward_timeout is None:
+        return None
+    return time.monotonic() + settings.forward_timeout
 
 
-def build_response(r: requests.Response) -> Response:
-    """Build the Response from a requests.Response object"""
+def get_remaining_timeout(deadline: Optional[float], settings: Settings) -> httpx.Timeout:
+    """Get the timeout of a request that has to finish before deadline (None: no deadline)"""
+    if deadline is None:
+        return httpx.Timeout(None, connect=settings.forward_connect_timeout)
+    remaining = max(deadline - time.monotonic(), 0.0)
+    return httpx.Timeout(remaining, connect=min(settings.forward_connect_timeout, remaining))
+
+
+def get_forward_headers(request: Request) -> Dict[str, str]:
+    """Get the headers of the incoming request that are passed on to the remote host"""
+    return {
+        header: request.headers[header]
+        for header in forwarded_request_headers
+        if header in request.headers
+    }
+
+
+async def send_request(
+    client: httpx.AsyncClient, upstream: httpx.Request, stream: bool = False
+) -> httpx.Response:
+    """Send a request to a remote host using the shared client
+
+    Args:
+        client (httpx.AsyncClient): The shared http client
+        upstream (httpx.Request): The request to send to the remote host; its outcome is
+                                  recorded in the health of the host
+        stream (bool): Whether to return before the response body was read. Streamed responses
+                       have to be closed by the caller (see build_streaming_response)
+
+    Returns:
+        httpx.Response: The response of the remote host
+    """
+    monitor = get_health_monitor()
+    address = get_upstream_address(upstream)
+    start = time.monotonic()
+    try:
+        r = await client.send(upstream, stream=stream)
+    except httpx.ConnectTimeout:
+        monitor.record(address, False)
+        raise HostNotReachedException(status_code=504, detail="Remote host timed out")
+    except httpx.ConnectError:
+        monitor.record(address, False)
+        raise HostNotReachedException(status_code=502, detail="Remote host not reachable")
+    except httpx.TimeoutException:
+        monitor.record(address, False)
+        raise HTTPException(status_code=504, detail="Remote host timed out")
+    except httpx.TransportError:
+        monitor.record(address, False)
+        raise HTTPException(status_code=502, detail="Remote host not reachable")
+    healthy = r.status_code not in failure_status_codes or LOAD_SHEDDING_HEADER in r.headers
+    monitor.record(address, healthy, time.monotonic() - start)
+    return r
+
+
+async def forward_bulk_request(
+    client: httpx.AsyncClient,
+    method: str,
+    url: str,
+    body: Dict[str, Any],
+    deadline: Optional[float],
+    settings: Settings,
+) -> Union[BulkResponse, HTTPException]:
+    """Forward a bulk request to a remote host
+
+    Returns:
+        Union[BulkResponse, HTTPException]: The results of the remote host; or the error if the
+                                            whole request failed (a HostNotReachedException
+                                            if it was not sent)
+    """
+    upstream = client.build_request(
+        method, url, json=body, timeout=get_remaining_timeout(deadline, settings)
+    )
+    try:
+        r = await send_request(client, upstream)
+    except HTTPException as error:
+        return error
+    if r.status_code != status.HTTP_207_MULTI_STATUS:
+        try:
+            return HTTPException(status_code=r.status_code, detail=r.json().get("detail"))
+        except (ValueError, AttributeError):
+            return HTTPException(status_code=r.status_code, detail=r.text)
+    return BulkResponse(**r.json())
+
+
+def get_upstream_address(upstream: httpx.Request) -> str:
+    """Get the address (ip:port) of the remote host a request is sent to"""
+    port = upstream.url.port
+    if port is None:
+        # httpx omits default ports, which are part of the addresses of remote hosts
+        port = 443 if upstream.url.scheme == "https" else 80
+    return f"{upstream.url.host}:{port}"
+
+
+def build_response(r: httpx.Response) -> Response:
+    """Build the Response from a httpx.Response object"""
     return Response(
         content=r.content,
         status_code=r.status_code,
         media_type="application/json",
     )
+
+
+def build_streaming_response(r: httpx.Response) -> StreamingResponse:
+    """Build a StreamingResponse that passes the body of a streamed httpx.Response
+    through chunk by chunk (e.g., binary encoded arrays are not decoded);
+    the upstream response is closed once it was sent
+    """
+    return StreamingResponse(
+        r.aiter_bytes(),
+        status_code=r.status_code,
+        media_type=r.headers.get("content-type", "application/json"),
+        headers={
+            header: r.headers[header]
+            for header in forwarded_response_headers
+            if header in r.headers
+        },
+        background=BackgroundTask(r.aclose),
+    )
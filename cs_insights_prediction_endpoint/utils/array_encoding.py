@@ -0,0 +1,138 @@
+"""This module implements compact binary encodings of numeric function call outputs"""
+import struct
+from typing import Dict, List, Optional
+
+import numpy as np
+
+try:
+    import pyarrow  # type: ignore
+    import pyarrow.ipc  # type: ignore
+except ImportError:
+    pyarrow = None
+
+# Raw little-endian float32 values preceded by a shape header (see encode_raw)
+RAW_MEDIA_TYPE = "application/octet-stream"
+# Arrow IPC stream containing a single float32 (fixed size list) column named "values"
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+# Response header containing the comma separated shape of an encoded array
+SHAPE_HEADER = "x-array-shape"
+
+
+def get_array_media_types() -> List[str]:
+    """Returns the binary media types supported by the installed packages"""
+    if pyarrow is None:
+        return [RAW_MEDIA_TYPE]
+    return [RAW_MEDIA_TYPE, ARROW_MEDIA_TYPE]
+
+
+def negotiate_array_media_type(accept: Optional[str]) -> Optional[str]:
+    """Selects the binary media type the accept header of a request prefers over JSON, i.e.,
+    the listed binary type with the highest quality if that is higher than the quality of
+    JSON (given by the most specific of "application/json", "application/*" and "*/*")
+
+    Args:
+        accept (Optional[str]): The accept header, e.g., "application/octet-stream"
+
+    Returns:
+        Optional[str]: The binary media type; None if the client prefers JSON or did not ask
+                       for a binary type
+    """
+    if accept is None:
+        return None
+    supported = get_array_media_types()
+    qualities: Dict[str, float] = {}
+    for media_range in accept.split(","):
+        media_type, *parameters = [part.strip() for part in media_range.split(";")]
+        qualities.setdefault(media_type.lower(), get_quality(parameters))
+    json_quality = next(
+        (
+            qualities[media_range]
+            for media_range in ["application/json", "application/*", "*/*"]
+            if media_range in qualities
+        ),
+        0.0,
+    )
+    # The first listed of the binary types with the highest quality
+    best = max(
+        (media_type for media_type in qualities if media_type in supported),
+        key=qualities.__getitem__,
+        default=None,
+    )
+    if best is None or qualities[best] <= max(json_quality, 0):
+        return None
+    return best
+
+
+def get_quality(parameters: List[str]) -> float:
+    """Returns the quality (q parameter) of a media range; 1 if it is missing or invalid
+
+    Args:
+        parameters (List[str]): The parameters of the media range, e.g., ["q=0.5"]
+
+    Returns:
+        float: The quality between 0 and 1
+    """
+    for parameter in parameters:
+        name, _, value = parameter.partition("=")
+        if name.strip().lower() == "q":
+            try:
+                return float(value)
+            except ValueError:
+                return 1.0
+    return 1.0
+
+
+def encode_array(array: np.ndarray, media_type: str) -> bytes:
+    """Encodes array as float32 using media_type (RAW_MEDIA_TYPE or ARROW_MEDIA_TYPE)"""
+    if media_type == ARROW_MEDIA_TYPE:
+        return encode_arrow(array)
+    return encode_raw(array)
+
+
+def encode_raw(array: np.ndarray) -> bytes:
+    """Encodes array as the number of dimensions (uint32), the size of each dimension
+    (uint64) and the values in C order (float32), all little-endian
+
+    Args:
+        array (np.ndarray): A numeric array
+
+    Returns:
+        bytes: The encoded array
+    """
+    values = np.ascontiguousarray(array, dtype="<f4")
+    header = struct.pack(f"<I{values.ndim}Q", values.ndim, *values.shape)
+    return header + values.tobytes()
+
+
+def decode_raw(data: bytes) -> np.ndarray:
+    """Decodes an array encoded by encode_raw"""
+    (ndim,) = struct.unpack_from("<I", data)
+    shape = struct.unpack_from(f"<{ndim}Q", data, 4)
+    return np.frombuffer(data, dtype="<f4", offset=4 + 8 * ndim).reshape(shape)
+
+
+def encode_arrow(array: np.ndarray) -> bytes:
+    """Encodes array as an Arrow IPC stream. The rows (along the last dimension) of a
+    matrix are stored as fixed size lists; the shape is stored in the metadata of the schema
+
+    Args:
+        array (np.ndarray): A numeric array
+
+    Returns:
+        bytes: The encoded array
+    """
+    values = np.ascontiguousarray(array, dtype=np.float32)
+    column = pyarrow.array(values.reshape(-1))
+    if values.ndim >= 2:
+        column = pyarrow.FixedSizeListArray.from_arrays(column, values.shape[-1])
+    batch = pyarrow.record_batch([column], names=["values"])
+    batch = batch.replace_schema_metadata({"shape": get_shape_header(values)})
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, batch.schema) as writer:
+        writer.write_batch(batch)
+    return bytes(sink.getvalue())
+
+
+def get_shape_header(array: np.ndarray) -> str:
+    """Returns the value of the SHAPE_HEADER of an encoded array"""
+    return ",".join(str(size) for size in np.shape(array))
@@ -0,0 +1,76 @@
+"""This module implements the database access shared by the storage controllers"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from typing import Any, Callable, Dict, TypeVar
+
+import pymongo
+from pymongo import MongoClient
+
+from cs_insights_prediction_endpoint.utils.settings import Settings, get_settings
+
+R = TypeVar("R")
+
+# One pooled client per process and database uri
+mongo_clients: Dict[str, MongoClient] = {}
+mongo_clients_lock = threading.Lock()
+
+
+def get_mongo_uri(settings: Settings) -> str:
+    """Returns the uri of the database given by settings"""
+    return (
+        f"mongodb://{settings.mongo_user.get_secret_value()}"
+        + f":{settings.mongo_password.get_secret_value()}@{settings.mongo_host}"
+    )
+
+
+def get_mongo_client(settings: Settings) -> MongoClient:
+    """Returns the client of this process for the database given by settings.
+    The client pools its connections, so all storage controllers share them.
+
+    Args:
+        settings (Settings): Settings object used for information on the database
+
+    Returns:
+        MongoClient: The shared client
+    """
+    uri = get_mongo_uri(settings)
+    with mongo_clients_lock:
+        client = mongo_clients.get(uri)
+        if client is None:
+            client = pymongo.MongoClient(uri, maxPoolSize=settings.mongo_max_pool_size)
+            mongo_clients[uri] = client
+        return client
+
+
+def close_mongo_clients() -> None:
+    """Closes all clients; the next call of get_mongo_client creates a new one"""
+    with mongo_clients_lock:
+        for client in mongo_clients.values():
+            client.close()
+        mongo_clients.clear()
+
+
+@lru_cache()
+def get_database_executor() -> ThreadPoolExecutor:
+    """Return the executor running database operations of async route handlers"""
+    return ThreadPoolExecutor(
+        max_workers=get_settings().mongo_executor_workers, thread_name_prefix="database"
+    )
+
+
+async def run_in_database_executor(function: Callable[..., R], *args: Any, **kwargs: Any) -> R:
+    """Runs a blocking database operation in the database executor, so waiting for the
+    database neither blocks the event loop nor the threadpool of the route handlers
+
+    Args:
+        function (Callable[..., R]): The blocking function (e.g., a storage controller method)
+        *args (Any): Positional arguments of function
+        **kwargs (Any): Keyword arguments of function
+
+    Returns:
+        R: The result of function
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_database_executor(), partial(function, *args, **kwargs))
@@ -0,0 +1,252 @@
+"""This module implements the health checks and circuit breakers of remote hosts"""
+import asyncio
+import logging
+import threading
+import time
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Optional, Set, TypeVar
+
+import httpx
+
+from cs_insights_prediction_endpoint import __version__
+from cs_insights_prediction_endpoint.utils.settings import Settings, get_settings
+
+CB = TypeVar("CB", bound="CircuitBreaker")
+HH = TypeVar("HH", bound="HostHealth")
+HM = TypeVar("HM", bound="HealthMonitor")
+
+logger = logging.getLogger(__name__)
+
+# States of a circuit breaker
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Circuit breaker of a remote host. After failure_threshold consecutive failures the
+    circuit opens and requests fail fast instead of waiting for the host. After
+    reset_timeout seconds it is half open and a single trial request is let through;
+    its success closes the circuit again, its failure opens it for another reset_timeout.
+    """
+
+    def __init__(self: CB, failure_threshold: int, reset_timeout: float) -> None:
+        """Constructor for the circuit breaker
+
+        Args:
+            failure_threshold (int): Consecutive failures opening the circuit
+            reset_timeout (float): Seconds the circuit stays open before a trial request
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_running = False
+
+    @property
+    def state(self: CB) -> str:
+        """The current state of the circuit (closed, open or half_open)"""
+        if self.opened_at is None:
+            return CLOSED
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return HALF_OPEN
+        return OPEN
+
+    def allow_request(self: CB) -> bool:
+        """Returns whether a request may be sent; in the half open state only one
+        trial request is allowed until its outcome was recorded
+        """
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and not self.trial_running:
+            self.trial_running = True
+            return True
+        return False
+
+    def is_available(self: CB) -> bool:
+        """Returns whether requests may be sent, without starting a trial request"""
+        return self.state == CLOSED or (self.state == HALF_OPEN and not self.trial_running)
+
+    def record_success(self: CB) -> None:
+        """Closes the circuit"""
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def record_failure(self: CB) -> None:
+        """Counts a failure; opens the circuit at the threshold or if a trial failed"""
+        self.consecutive_failures += 1
+        if self.opened_at is not None or self.consecutive_failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self.trial_running = False
+
+
+class HostHealth:
+    """Health of a remote host: its circuit breaker, the exponentially weighted moving
+    averages of latency and error rate, and the job load reported by the last probe
+    """
+
+    def __init__(self: HH, breaker: CircuitBreaker, smoothing: float) -> None:
+        """Constructor for the host health
+
+        Args:
+            breaker (CircuitBreaker): The circuit breaker of the host
+            smoothing (float): Weight of the latest request in the moving averages
+        """
+        self.breaker = breaker
+        self.smoothing = smoothing
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.requests = 0
+        self.last_checked: Optional[float] = None
+        self.free_workers: Optional[int] = None
+        self.queued_jobs: Optional[int] = None
+
+    def record(self: HH, success: bool, latency: Optional[float] = None) -> None:
+        """Records the outcome of a request (or probe) sent to the host"""
+        self.requests += 1
+        self.error_rate += self.smoothing * ((0.0 if success else 1.0) - self.error_rate)
+        if latency is not None:
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency += self.smoothing * (latency - self.latency)
+        if success:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+
+    def get_report(self: HH) -> dict:
+        """Returns the health of the host as a dict"""
+        return {
+            "state": self.breaker.state,
+            "consecutive_failures": self.breaker.consecutive_failures,
+            "latency_ms": None if self.latency is None else round(self.latency * 1000, 3),
+            "error_rate": round(self.error_rate, 4),
+            "requests": self.requests,
+            "last_checked": self.last_checked,
+            "free_workers": self.free_workers,
+            "queued_jobs": self.queued_jobs,
+        }
+
+
+class HealthMonitor:
+    """Tracks the health of all remote hosts of this process. Outcomes of forwarded requests
+    are recorded by the forwarder; a background prober checks every host periodically,
+    which also closes the circuits of recovered hosts.
+    """
+
+    def __init__(self: HM, settings: Settings) -> None:
+        """Constructor for the health monitor
+
+        Args:
+            settings (Settings): Settings object holding the thresholds and intervals
+        """
+        self.failure_threshold = settings.circuit_failure_threshold
+        self.reset_timeout = settings.circuit_reset_timeout
+        self.smoothing = settings.health_smoothing
+        self.check_interval = settings.health_check_interval
+        self.check_timeout = settings.health_check_timeout
+        self.hosts: Dict[str, HostHealth] = {}
+        self.lock = threading.Lock()
+
+    def get_host_health(self: HM, address: str) -> HostHealth:
+        """Returns the health of the host address; creates it on first use"""
+        with self.lock:
+            health = self.hosts.get(address)
+            if health is None:
+                breaker = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+                health = HostHealth(breaker, self.smoothing)
+                self.hosts[address] = health
+            return health
+
+    def allow_request(self: HM, address: str) -> bool:
+        """Returns whether a request may be sent to the host address"""
+        with self.lock:
+            health = self.hosts.get(address)
+            return health is None or health.breaker.allow_request()
+
+    def get_unavailable(self: HM) -> Set[str]:
+        """Returns the addresses of all hosts whose circuit is open"""
+        with self.lock:
+            return {
+                address
+                for address, health in self.hosts.items()
+                if not health.breaker.is_available()
+            }
+
+    def record(self: HM, address: str, success: bool, latency: Optional[float] = None) -> None:
+        """Records the outcome of a request sent to the host address"""
+        health = self.get_host_health(address)
+        with self.lock:
+            health.record(success, latency)
+
+    def get_report(self: HM) -> Dict[str, dict]:
+        """Returns the health of all hosts by address"""
+        with self.lock:
+            return {address: health.get_report() for address, health in self.hosts.items()}
+
+    def forget(self: HM, addresses: Iterable[str]) -> None:
+        """Drops the health of all hosts not in addresses (e.g., removed hosts)"""
+        keep = set(addresses)
+        with self.lock:
+            for address in list(self.hosts):
+                if address not in keep:
+                    del self.hosts[address]
+
+    async def probe(self: HM, client: httpx.AsyncClient, address: str) -> None:
+        """Checks the host address by requesting the statistics of its job controller.
+        Every response below 500 counts as healthy; timeouts, transport errors and
+        server errors count as failures.
+        """
+        url = f"http://{address}/api/v{__version__.split('.')[0]}/models/jobs"
+        start = time.monotonic()
+        try:
+            r = await client.get(url, timeout=self.check_timeout)
+        except httpx.HTTPError as error:
+            logger.info("Health check of %s failed: %s", address, error)
+            self.record(address, False)
+            return
+        finally:
+            self.get_host_health(address).last_checked = time.time()
+        self.record(address, r.status_code < 500, time.monotonic() - start)
+        if r.status_code == 200:
+            try:
+                statistics = r.json()
+                health = self.get_host_health(address)
+                health.free_workers = statistics["workers"] - statistics["running"]
+                health.queued_jobs = statistics["queued"]
+            except (ValueError, KeyError, TypeError):
+                pass
+
+    async def probe_all(self: HM, client: httpx.AsyncClient, addresses: List[str]) -> None:
+        """Checks all hosts concurrently and forgets hosts that were removed"""
+        self.forget(addresses)
+        await asyncio.gather(*(self.probe(client, address) for address in addresses))
+
+    async def run(
+        self: HM,
+        get_client: Callable[[], httpx.AsyncClient],
+        get_addresses: Callable[[], List[str]],
+    ) -> None:
+        """Checks all hosts every check_interval seconds until cancelled
+
+        Args:
+            get_client (Callable[[], httpx.AsyncClient]): Returns the http client to use
+            get_addresses (Callable[[], List[str]]): Returns the addresses of all hosts;
+                                                     it is called in a thread
+        """
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                addresses = await asyncio.get_running_loop().run_in_executor(None, get_addresses)
+                await self.probe_all(get_client(), addresses)
+            except Exception as error:  # the prober must keep running
+                logger.warning("Checking the health of the remote hosts failed: %s", error)
+
+
+@lru_cache()
+def get_health_monitor() -> HealthMonitor:
+    """Return the health monitor instance"""
+    return HealthMonitor(get_settings())
@@ -0,0 +1,40 @@
+"""This module implements the shared http client used to forward requests to remote hosts"""
+import httpx
+from fastapi import Request
+
+from cs_insights_prediction_endpoint.utils.settings import Settings, get_settings
+
+
+def create_http_client(settings: Settings) -> httpx.AsyncClient:
+    """Creates the pooled async client used to forward requests to SECONDARY nodes.
+    Connections are pooled per remote host and kept alive between forwarded requests.
+
+    Args:
+        settings (Settings): Settings object holding the pool limits and timeouts
+
+    Returns:
+        httpx.AsyncClient: The configured client
+    """
+    limits = httpx.Limits(
+        max_connections=settings.forward_max_connections,
+        max_keepalive_connections=settings.forward_max_keepalive_connections,
+        keepalive_expiry=settings.forward_keepalive_expiry,
+    )
+    timeout = httpx.Timeout(settings.forward_timeout, connect=settings.forward_connect_timeout)
+    return httpx.AsyncClient(limits=limits, timeout=timeout)
+
+
+def get_http_client(request: Request) -> httpx.AsyncClient:
+    """Return the app-lifetime http client; (re)creates it if it is missing or closed
+
+    Args:
+        request (Request): The current request, used to access the app state
+
+    Returns:
+        httpx.AsyncClient: The shared http client
+    """
+    client = getattr(request.app.state, "http_client", None)
+    if client is None or client.is_closed:
+        client = create_http_client(get_settings())
+        request.app.state.http_client = client
+    return client
@@ -0,0 +1,673 @@
+"""This module implements a job controller running long function calls asynchronously"""
+import fcntl
+import io
+import json
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache, partial
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Optional, Set, Tuple, Type, TypeVar
+
+import numpy as np
+from pymongo.collection import Collection
+
+from cs_insights_prediction_endpoint.models.generic_model import GenericModel
+from cs_insights_prediction_endpoint.utils.database import get_mongo_client
+from cs_insights_prediction_endpoint.utils.json_response import RawJSON
+from cs_insights_prediction_endpoint.utils.settings import get_settings
+from cs_insights_prediction_endpoint.utils.storage_controller import VersionConflictError
+
+J = TypeVar("J", bound="Job")
+JC = TypeVar("JC", bound="JobController")
+HS = TypeVar("HS", bound="HostSlots")
+
+
+class JobQueueFullError(Exception):
+    """Raised if a job is submitted while the queue is full"""
+
+
+def encode_output(output: Any) -> dict:
+    """Encodes the output of a job for the database: arrays in the npy format, pre-encoded
+    json as it is and other outputs as json
+
+    Args:
+        output (Any): The output of the function call
+
+    Returns:
+        dict: The encoded output
+    """
+    if isinstance(output, np.ndarray):
+        buffer = io.BytesIO()
+        np.save(buffer, output, allow_pickle=False)
+        return {"npy": buffer.getvalue()}
+    if isinstance(output, RawJSON):
+        return {"raw_json": output.data}
+    return {"json": json.dumps(output, default=encode_json_value)}
+
+
+def encode_json_value(value: Any) -> Any:
+    """Converts values json does not know (e.g., numpy numbers) for encode_output"""
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    return str(value)
+
+
+def decode_output(document: dict) -> Any:
+    """Decodes an output encoded by encode_output"""
+    if "npy" in document:
+        return np.load(io.BytesIO(document["npy"]), allow_pickle=False)
+    if "raw_json" in document:
+        return RawJSON(document["raw_json"])
+    return json.loads(document["json"])
+
+
+def is_process_alive(pid: int) -> bool:
+    """Returns whether a process with pid runs on this host"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class HostSlots:
+    """Limits the number of jobs running at the same time on a host. A running job holds a
+    lock on one of the slot files in a directory of the host; the locks are shared by all
+    processes of the host and released by the operating system if a process exits
+    """
+
+    def __init__(self: HS, directory: str, slots: int) -> None:
+        """Constructor for the slots of a host
+
+        Args:
+            directory (str): The directory of the slot files on the host
+            slots (int): Number of jobs running at the same time
+        """
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        self.paths = [os.path.join(directory, f"slot-{slot}.lock") for slot in range(slots)]
+        # Locks (slot -> file descriptor) belong to a process, so they are tracked per process
+        self.held: Dict[int, int] = {}
+
+    def acquire(self: HS) -> Optional[int]:
+        """Locks a free slot without waiting
+
+        Returns:
+            Optional[int]: The locked slot; None if all slots are taken
+        """
+        for slot, path in enumerate(self.paths):
+            if slot in self.held:
+                continue
+            descriptor = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.lockf(descriptor, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(descriptor)
+                continue
+            self.held[slot] = descriptor
+            return slot
+        return None
+
+    def release(self: HS, slot: int) -> None:
+        """Unlocks a slot locked by acquire"""
+        descriptor = self.held.pop(slot, None)
+        if descriptor is not None:
+            os.close(descriptor)
+
+
+def run_job(model: GenericModel, function_call: str, input_data: dict) -> Tuple[Any, Any]:
+    """Runs a function call of a model inside of a worker process
+
+    Args:
+        model (GenericModel): A copy of the model
+        function_call (str): The name of the function call
+        input_data (dict): The keyword arguments of the function call
+
+    Returns:
+        Tuple[Any, Any]: The output and the changed processing_model (None if unchanged)
+    """
+    output = model.function_calls[function_call](**input_data)
+    if function_call in model.updating_function_calls and model.is_state_changed():
+        return output, model.processing_model
+    return output, None
+
+
+class Job:
+    """A function call of a model that is run asynchronously"""
+
+    def __init__(
+        self: J,
+        model: GenericModel,
+        function_call: str,
+        input_data: dict,
+        on_update: Optional[Callable[[Any], Any]] = None,
+    ) -> None:
+        """Constructor for a job
+
+        Args:
+            model (GenericModel): The model to run the function call on
+            function_call (str): The name of the function call
+            input_data (dict): The keyword arguments of the function call
+            on_update (Optional[Callable[[Any], Any]]): Called with the updated
+                processing_model instead of replacing the one of model (e.g., to save it
+                as a new version)
+        """
+        self.id = str(uuid.uuid4())
+        self.model = model
+        self.on_update = on_update
+        self.model_id = model.id
+        self.function_call = function_call
+        self.input_data = input_data
+        self.state = "queued"
+        self.submitted_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.output: Any = None
+        self.error: Optional[str] = None
+        self.error_status = 500
+        self.future: Optional["Future[Tuple[Any, Any]]"] = None
+        # The slot of the host the job runs in (see HostSlots)
+        self.slot: Optional[int] = None
+
+    def to_document(self: J) -> dict:
+        """Returns the state of the job as stored in the database, including the output
+        of a succeeded job
+        """
+        document = {
+            "id": self.id,
+            "model_id": self.model_id,
+            "function_call": self.function_call,
+            "state": self.state,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "error_status": self.error_status,
+        }
+        if self.state == "succeeded":
+            document["output"] = encode_output(self.output)
+        return document
+
+    @classmethod
+    def from_document(cls: Type[J], document: dict) -> J:
+        """Returns a job of another process from its database document; it has no model
+
+        Args:
+            document (dict): The document written by the process running the job
+
+        Returns:
+            J: The job
+        """
+        job = cls.__new__(cls)
+        job.id = document["id"]
+        job.model = None  # type: ignore
+        job.on_update = None
+        job.model_id = document["model_id"]
+        job.function_call = document["function_call"]
+        job.input_data = {}
+        job.state = document["state"]
+        job.submitted_at = document["submitted_at"]
+        job.started_at = document["started_at"]
+        job.finished_at = document["finished_at"]
+        job.output = None
+        if document.get("output") is not None:
+            job.output = decode_output(document["output"])
+        job.error = document["error"]
+        job.error_status = document["error_status"]
+        job.future = None
+        job.slot = None
+        return job
+
+    def is_finished(self: J) -> bool:
+        """Returns whether the job succeeded, failed or was cancelled"""
+        return self.state in ("succeeded", "failed", "cancelled")
+
+    def get_status(self: J, position: Optional[int] = None) -> dict:
+        """Returns the state of the job and how long it waited and ran
+
+        Args:
+            position (Optional[int]): The position of the job in the queue
+
+        Returns:
+            dict: The status of the job
+        """
+        now = time.time()
+        return {
+            "job_id": self.id,
+            "model_id": self.model_id,
+            "function_call": self.function_call,
+            "state": self.state,
+            "position": position,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "queued_seconds": (self.started_at or self.finished_at or now) - self.submitted_at,
+            "running_seconds": None
+            if self.started_at is None
+            else (self.finished_at or now) - self.started_at,
+            "error": self.error,
+        }
+
+
+class JobController:
+    """Job Controller class that runs function calls of models in a bounded process pool.
+    Jobs of the same model run one after another, so updates of the model are not lost.
+    With a collection, the jobs are also stored in the database, so every (uvicorn) worker
+    process of the host can report, return and cancel them; with slots, the number of
+    running jobs is limited for all processes of the host together.
+    """
+
+    def __init__(
+        self: JC,
+        workers: int,
+        max_queued: int,
+        history_size: int,
+        start_method: str = "spawn",
+        collection: Optional[Collection] = None,
+        slots: Optional[HostSlots] = None,
+        slot_poll_interval: float = 1.0,
+    ) -> None:
+        """Constructor for the job controller
+
+        Args:
+            workers (int): Number of worker processes
+            max_queued (int): Maximum number of jobs waiting for a worker (of the host if
+                              jobs are stored in collection)
+            history_size (int): Number of finished jobs kept for retrieving their results
+            start_method (str): The multiprocessing start method of the worker processes
+            collection (Optional[Collection]): The database collection storing the jobs
+            slots (Optional[HostSlots]): The slots of the host a job needs to run
+            slot_poll_interval (float): Seconds between attempts to start queued jobs while
+                                        all slots of the host are taken
+        """
+        self.workers = workers
+        self.max_queued = max_queued
+        self.history_size = history_size
+        self.start_method = start_method
+        self.collection = collection
+        self.slots = slots
+        self.slot_poll_interval = slot_poll_interval
+        self.retry_timer: Optional[threading.Timer] = None
+        self.host = socket.gethostname()
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.update_executor: Optional[ThreadPoolExecutor] = None
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self.queued: Deque[Job] = deque()
+        self.running: Dict[str, Job] = {}
+        self.busy_models: Set[str] = set()
+        # Reentrant, since callbacks of futures that are already done run immediately
+        self.lock = threading.RLock()
+        self.counters = {"submitted": 0, "succeeded": 0, "failed": 0, "cancelled": 0}
+        self.total_queued_seconds = 0.0
+        self.total_running_seconds = 0.0
+        self.max_running_seconds = 0.0
+        # Jobs of exited processes are failed before the first job is queued
+        self.abandoned_jobs_failed = False
+
+    def store(self: JC, job: Job) -> None:
+        """Writes the state of job to the database; a job cancelled by another process
+        stays cancelled
+        """
+        if self.collection is None:
+            return
+        self.collection.update_one(
+            {"id": job.id, "state": {"$ne": "cancelled"}},
+            {"$set": job.to_document(), "$setOnInsert": {"host": self.host, "pid": os.getpid()}},
+            upsert=job.state == "queued",
+        )
+
+    def is_cancelled_elsewhere(self: JC, job: Job) -> bool:
+        """Returns whether job was cancelled by another process of the host"""
+        if self.collection is None:
+            return False
+        return self.collection.find_one({"id": job.id, "state": "cancelled"}) is not None
+
+    def fail_abandoned_jobs(self: JC) -> None:
+        """Marks unfinished jobs of processes of this host that exited as failed"""
+        if self.collection is None:
+            return
+        unfinished = {"host": self.host, "state": {"$in": ["queued", "running"]}}
+        abandoned = [
+            pid for pid in self.collection.distinct("pid", unfinished) if not is_process_alive(pid)
+        ]
+        if abandoned:
+            self.collection.update_many(
+                {**unfinished, "pid": {"$in": abandoned}},
+                {
+                    "$set": {
+                        "state": "failed",
+                        "finished_at": time.time(),
+                        "error": "The process running the job exited",
+                    }
+                },
+            )
+
+    def count_queued(self: JC) -> int:
+        """Returns the number of queued jobs (of all processes of the host, if stored)"""
+        if self.collection is None:
+            return len(self.queued)
+        if not self.abandoned_jobs_failed:
+            self.fail_abandoned_jobs()
+            self.abandoned_jobs_failed = True
+        return self.collection.count_documents({"host": self.host, "state": "queued"})
+
+    def submit(
+        self: JC,
+        model: GenericModel,
+        function_call: str,
+        input_data: dict,
+        on_update: Optional[Callable[[Any], Any]] = None,
+    ) -> Job:
+        """Queues a function call of model
+
+        Args:
+            model (GenericModel): The model to run the function call on
+            function_call (str): The name of the function call
+            input_data (dict): The keyword arguments of the function call
+            on_update (Optional[Callable[[Any], Any]]): Called with the updated
+                                                        processing_model (see Job)
+
+        Raises:
+            KeyError: If the model does not implement function_call
+            JobQueueFullError: If max_queued jobs are already waiting
+
+        Returns:
+            Job: The queued job
+        """
+        if function_call not in model.function_calls:
+            raise KeyError(function_call)
+        job = Job(model, function_call, input_data, on_update)
+        with self.lock:
+            if self.count_queued() >= self.max_queued:
+                raise JobQueueFullError("Job queue is full")
+            self.jobs[job.id] = job
+            self.queued.append(job)
+            self.store(job)
+            self.counters["submitted"] += 1
+            self.schedule()
+        return job
+
+    def schedule(self: JC) -> None:
+        """Starts queued jobs of idle models while workers are available; needs the lock"""
+        for job in list(self.queued):
+            if len(self.running) >= self.workers:
+                break
+            # Jobs can already be started by a nested call through finish
+            if job.state != "queued" or job.model_id in self.busy_models:
+                continue
+            if self.is_cancelled_elsewhere(job):
+                self.cancel(job)
+                continue
+            if self.slots is not None:
+                job.slot = self.slots.acquire()
+                if job.slot is None:
+                    # Jobs of other processes use all slots of the host
+                    self.retry_later()
+                    break
+            self.queued.remove(job)
+            self.running[job.id] = job
+            self.busy_models.add(job.model_id)
+            job.state = "running"
+            job.started_at = time.time()
+            self.store(job)
+            try:
+                job.future = self.get_executor().submit(
+                    run_job, job.model, job.function_call, job.input_data
+                )
+            except BrokenProcessPool:
+                # A worker died (e.g., killed for using too much memory); start a new pool
+                # and let the remaining processes of the broken one exit
+                if self.executor is not None:
+                    self.executor.shutdown(wait=False)
+                self.executor = None
+                job.future = self.get_executor().submit(
+                    run_job, job.model, job.function_call, job.input_data
+                )
+            job.future.add_done_callback(partial(self.finish, job))
+
+    def retry_later(self: JC) -> None:
+        """Tries to start the queued jobs again after slot_poll_interval; needs the lock"""
+        if self.retry_timer is None:
+            self.retry_timer = threading.Timer(self.slot_poll_interval, self.retry_schedule)
+            self.retry_timer.daemon = True
+            self.retry_timer.start()
+
+    def retry_schedule(self: JC) -> None:
+        """Starts queued jobs if slots of the host were freed in the meantime"""
+        with self.lock:
+            self.retry_timer = None
+            if self.queued:
+                self.schedule()
+
+    def get_executor(self: JC) -> ProcessPoolExecutor:
+        """Returns the process pool; it is started on first use"""
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context(self.start_method),
+            )
+        return self.executor
+
+    def swap_processing_model(self: JC, job: Job, future: "Future[Tuple[Any, Any]]") -> None:
+        """Replaces the processing_model of the model by the one updated by the job"""
+        if job.state == "cancelled" or future.cancelled() or future.exception() is not None:
+            return
+        if self.is_cancelled_elsewhere(job):
+            self.cancel(job)
+            return
+        processing_model = future.result()[1]
+        if processing_model is None:
+            return
+        if job.on_update is None:
+            job.model.processing_model = processing_model
+        else:
+            job.on_update(processing_model)
+
+    def finish(self: JC, job: Job, future: "Future[Tuple[Any, Any]]") -> None:
+        """Frees the worker of a job that left the process pool and starts the next jobs.
+        Jobs updating their model are completed on an update thread, so slow saves of the
+        updates do not hold up the results of other jobs (callbacks of the pool run on one
+        thread); other jobs of the model wait until the update is installed
+        """
+        with self.lock:
+            self.running.pop(job.id, None)
+            if self.slots is not None and job.slot is not None:
+                self.slots.release(job.slot)
+                job.slot = None
+            if self.executor is not None:
+                self.schedule()
+        if future.cancelled() or future.exception() is not None or future.result()[1] is None:
+            self.complete(job, future)
+        else:
+            self.get_update_executor().submit(self.complete, job, future)
+
+    def complete(self: JC, job: Job, future: "Future[Tuple[Any, Any]]") -> None:
+        """Installs the update of a job that left the process pool and stores its outcome"""
+        swap_error: Optional[str] = None
+        swap_error_status = 500
+        try:
+            self.swap_processing_model(job, future)
+        except VersionConflictError as error:
+            swap_error, swap_error_status = str(error), 409
+        except Exception as error:  # noqa: B902
+            swap_error = f"{type(error).__name__}: {error}"
+        with self.lock:
+            job.finished_at = job.finished_at or time.time()
+            if job.state != "cancelled":
+                try:
+                    job.output, _ = future.result()
+                    job.state = "succeeded"
+                    if swap_error is not None:
+                        job.state, job.error = "failed", swap_error
+                        job.error_status = swap_error_status
+                except ValueError as error:
+                    job.state, job.error, job.error_status = "failed", str(error), 400
+                except Exception as error:  # noqa: B902
+                    job.state, job.error = "failed", f"{type(error).__name__}: {error}"
+                self.counters[job.state] += 1
+                self.record_duration(job)
+            self.store(job)
+            # The model is not needed anymore and can be freed
+            job.model = None  # type: ignore
+            self.busy_models.discard(job.model_id)
+            self.trim_history()
+            if self.executor is not None:
+                self.schedule()
+
+    def get_update_executor(self: JC) -> ThreadPoolExecutor:
+        """Returns the threads installing the updates of jobs; they are started on first use"""
+        if self.update_executor is None:
+            self.update_executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="job-update"
+            )
+        return self.update_executor
+
+    def record_duration(self: JC, job: Job) -> None:
+        """Adds the queued and running time of a finished job to the statistics"""
+        if job.started_at is not None and job.finished_at is not None:
+            running_seconds = job.finished_at - job.started_at
+            self.total_queued_seconds += job.started_at - job.submitted_at
+            self.total_running_seconds += running_seconds
+            self.max_running_seconds = max(self.max_running_seconds, running_seconds)
+
+    def trim_history(self: JC) -> None:
+        """Forgets the oldest finished jobs beyond history_size; needs the lock"""
+        finished = [job_id for job_id, job in self.jobs.items() if job.is_finished()]
+        forgotten = finished[: max(0, len(finished) - self.history_size)]
+        for job_id in forgotten:
+            del self.jobs[job_id]
+        if self.collection is not None and forgotten:
+            self.collection.delete_many({"id": {"$in": forgotten}})
+
+    def get_job(self: JC, job_id: str) -> Optional[Job]:
+        """Returns the job with job_id if it is known; jobs of other processes of the host
+        are read from the database
+        """
+        job = self.jobs.get(job_id)
+        if job is not None or self.collection is None:
+            return job
+        document = self.collection.find_one({"id": job_id})
+        if document is None:
+            return None
+        if document["state"] in ("queued", "running") and not is_process_alive(document["pid"]):
+            self.fail_abandoned_jobs()
+            document = self.collection.find_one({"id": job_id}) or document
+        return Job.from_document(document)
+
+    def get_status(self: JC, job: Job) -> dict:
+        """Returns the status of job including its position in the queue; the position of
+        jobs of other processes is not known
+        """
+        with self.lock:
+            position = None
+            if job.state == "queued" and self.jobs.get(job.id) is job:
+                position = next(i for i, queued in enumerate(self.queued) if queued is job)
+            return job.get_status(position)
+
+    def cancel(self: JC, job: Job) -> bool:
+        """Cancels a job. Queued jobs are removed from the queue; a running job is
+        completed by its worker, but its result is discarded
+
+        Args:
+            job (Job): The job to cancel
+
+        Returns:
+            bool: True if the job was cancelled; False if it was already finished
+        """
+        with self.lock:
+            if job.is_finished():
+                return False
+            if self.jobs.get(job.id) is not job:
+                return self.cancel_elsewhere(job)
+            if job.state == "queued":
+                self.queued.remove(job)
+                job.model = None  # type: ignore
+            job.state = "cancelled"
+            job.finished_at = time.time()
+            self.counters["cancelled"] += 1
+            self.store(job)
+            self.trim_history()
+            return True
+
+    def cancel_elsewhere(self: JC, job: Job) -> bool:
+        """Cancels a job of another process of the host in the database; the process skips
+        the job or discards its result (see cancel)
+        """
+        if self.collection is None:
+            return False
+        finished_at = time.time()
+        result = self.collection.update_one(
+            {"id": job.id, "state": {"$in": ["queued", "running"]}},
+            {"$set": {"state": "cancelled", "finished_at": finished_at}},
+        )
+        if result.modified_count == 0:
+            return False
+        job.state, job.finished_at = "cancelled", finished_at
+        return True
+
+    def get_statistics(self: JC) -> dict:
+        """Returns the queue depth and the job counters and durations"""
+        with self.lock:
+            finished = self.counters["succeeded"] + self.counters["failed"]
+            return {
+                "workers": self.workers,
+                "queued": len(self.queued),
+                "running": len(self.running),
+                **self.counters,
+                "mean_queued_seconds": self.total_queued_seconds / finished if finished else 0.0,
+                "mean_running_seconds": self.total_running_seconds / finished if finished else 0.0,
+                "max_running_seconds": self.max_running_seconds,
+            }
+
+    def shutdown(self: JC) -> None:
+        """Cancels all queued jobs and stops the worker processes"""
+        with self.lock:
+            for job in self.queued:
+                job.state = "cancelled"
+                job.finished_at = time.time()
+                self.counters["cancelled"] += 1
+                self.store(job)
+            self.queued.clear()
+            if self.retry_timer is not None:
+                self.retry_timer.cancel()
+                self.retry_timer = None
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        # All finished jobs were handed over by the pool; their updates are installed first
+        with self.lock:
+            update_executor, self.update_executor = self.update_executor, None
+        if update_executor is not None:
+            update_executor.shutdown(wait=True)
+
+
+@lru_cache()
+def get_job_controller() -> JobController:
+    """Return the JobController object"""
+    settings = get_settings()
+    return JobController(
+        workers=settings.job_workers,
+        max_queued=settings.job_max_queued,
+        history_size=settings.job_history_size,
+        start_method=settings.job_start_method,
+        collection=get_mongo_client(settings)[settings.model_db_name][
+            f"{settings.model_db_name}_jobs"
+        ],
+        slots=HostSlots(settings.job_slot_directory, settings.job_workers),
+        slot_poll_interval=settings.job_slot_poll_interval,
+    )
+
+
+def shutdown_job_controller() -> None:
+    """Cancels the queued jobs and stops the worker processes if the controller was created"""
+    if get_job_controller.cache_info().currsize:
+        get_job_controller().shutdown()
+        get_job_controller.cache_clear()
@@ -0,0 +1,51 @@
+"""This module implements the json serialization of responses"""
+import json
+from typing import Any, Type, TypeVar, Union
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore
+
+from cs_insights_prediction_endpoint.utils.settings import Settings
+
+R = TypeVar("R", bound="RawJSON")
+
+
+class RawJSON:
+    """An already encoded json value (e.g., the output of pyLDAvis), which is put into
+    responses as is instead of being decoded and encoded again
+    """
+
+    def __init__(self: R, data: Union[str, bytes]) -> None:
+        """Constructor for a pre-encoded json value
+
+        Args:
+            data (Union[str, bytes]): The json document
+        """
+        self.data = data.encode("utf-8") if isinstance(data, str) else data
+
+    def __eq__(self: R, other: object) -> bool:
+        """Returns whether other is the same json document"""
+        return isinstance(other, RawJSON) and self.data == other.data
+
+    def loads(self: R) -> Any:
+        """Decodes the json document"""
+        return json.loads(self.data)
+
+
+def get_response_class(settings: Settings) -> Type[JSONResponse]:
+    """Returns the default response class configured by json_response_class
+
+    Args:
+        settings (Settings): Settings object selecting "orjson" or "json"
+
+    Returns:
+        Type[JSONResponse]: ORJSONResponse if selected and orjson is installed;
+                            the JSONResponse of the standard library otherwise
+    """
+    if settings.json_response_class == "orjson" and orjson is not None:
+        return ORJSONResponse
+    return JSONResponse
@@ -0,0 +1,40 @@
+"""This module implements utilities to report the memory usage of memory-mapped files"""
+from typing import Dict, Iterable
+
+# Fields of /proc/<pid>/smaps that are summed up per mapped file (values in kB)
+smaps_fields = {
+    "Rss": "resident_bytes",
+    "Shared_Clean": "shared_bytes",
+    "Shared_Dirty": "shared_bytes",
+    "Private_Clean": "private_bytes",
+    "Private_Dirty": "private_bytes",
+}
+
+
+def get_mapped_file_usage(paths: Iterable[str], smaps: str = "/proc/self/smaps") -> Dict[str, int]:
+    """Returns how many bytes of the given memory-mapped files are resident in this process
+    and how many of those are shared with other processes (e.g., other uvicorn workers)
+
+    Args:
+        paths (Iterable[str]): Absolute paths of the mapped files
+        smaps (str): The smaps file to read; only available on Linux
+
+    Returns:
+        Dict[str, int]: resident_bytes, shared_bytes and private_bytes of all mappings;
+                        all zero if the smaps file is not available
+    """
+    usage = {"resident_bytes": 0, "shared_bytes": 0, "private_bytes": 0}
+    paths = set(paths)
+    try:
+        with open(smaps) as smaps_file:
+            in_mapping = False
+            for line in smaps_file:
+                field, _, value = line.partition(":")
+                if " " in field:
+                    # Header line of a mapping: "<address> <perms> <offset> <dev> <inode> <path>"
+                    in_mapping = line.split()[-1] in paths
+                elif in_mapping and field in smaps_fields:
+                    usage[smaps_fields[field]] += int(value.split()[0]) * 1024
+    except OSError:
+        pass
+    return usage
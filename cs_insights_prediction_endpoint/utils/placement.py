@@ -0,0 +1,118 @@
+"""This module implements the placement of created models on remote hosts"""
+import bisect
+import hashlib
+import math
+from typing import Dict, List, Optional, Sequence, Tuple, TypeVar
+
+from cs_insights_prediction_endpoint.models.model_hosts import RemoteHost
+
+HR = TypeVar("HR", bound="HashRing")
+
+# Strategies selectable by the setting placement_strategy
+placement_strategies = ["first", "consistent_hash", "least_loaded", "weighted"]
+
+
+def hash_key(key: str) -> int:
+    """Returns a stable 64 bit hash of key (unlike hash, it is equal in every process)"""
+    return int.from_bytes(hashlib.sha1(key.encode("utf-8")).digest()[:8], "big")
+
+
+def get_address(host: RemoteHost) -> str:
+    """Returns the address (ip:port) requests to host are sent to"""
+    return f"{host.ip}:{host.port}"
+
+
+class HashRing:
+    """Consistent hash ring of hosts. Every host owns a number of virtual nodes proportional
+    to its capacity, so when a host joins or leaves only the keys of its own virtual nodes
+    move (about 1/N of all keys) and all other keys keep their host.
+    """
+
+    def __init__(self: HR, virtual_nodes: int) -> None:
+        """Constructor for the hash ring
+
+        Args:
+            virtual_nodes (int): Number of virtual nodes of a host with a capacity of 1
+        """
+        self.virtual_nodes = virtual_nodes
+        self.hashes: List[int] = []
+        self.nodes: List[str] = []
+        self.hosts: Dict[str, float] = {}
+
+    def add_host(self: HR, address: str, capacity: float = 1.0) -> None:
+        """Adds the virtual nodes of the host address to the ring"""
+        if address in self.hosts:
+            self.remove_host(address)
+        self.hosts[address] = capacity
+        for replica in range(max(1, round(self.virtual_nodes * capacity))):
+            node_hash = hash_key(f"{address}#{replica}")
+            index = bisect.bisect(self.hashes, node_hash)
+            self.hashes.insert(index, node_hash)
+            self.nodes.insert(index, address)
+
+    def remove_host(self: HR, address: str) -> None:
+        """Removes all virtual nodes of the host address from the ring"""
+        if self.hosts.pop(address, None) is None:
+            return
+        kept = [(h, node) for h, node in zip(self.hashes, self.nodes) if node != address]
+        self.hashes = [h for h, _ in kept]
+        self.nodes = [node for _, node in kept]
+
+    def sync(self: HR, hosts: Dict[str, float]) -> None:
+        """Adds, updates and removes hosts, so the ring contains exactly hosts"""
+        for address in list(self.hosts):
+            if address not in hosts:
+                self.remove_host(address)
+        for address, capacity in hosts.items():
+            if self.hosts.get(address) != capacity:
+                self.add_host(address, capacity)
+
+    def get_host(self: HR, key: str, candidates: Optional[Sequence[str]] = None) -> Optional[str]:
+        """Returns the host owning key, i.e., the first (candidate) host clockwise of its hash
+
+        Args:
+            key (str): The key to place (e.g., the name of a model)
+            candidates (Optional[Sequence[str]]): Hosts that can be chosen; None allows all
+
+        Returns:
+            Optional[str]: The address of the host; None if no candidate is in the ring
+        """
+        if not self.hashes:
+            return None
+        allowed = None if candidates is None else set(candidates)
+        start = bisect.bisect(self.hashes, hash_key(key))
+        for offset in range(len(self.nodes)):
+            node = self.nodes[(start + offset) % len(self.nodes)]
+            if allowed is None or node in allowed:
+                return node
+        return None
+
+
+def select_least_loaded(hosts: Sequence[RemoteHost]) -> Optional[RemoteHost]:
+    """Returns the host with the fewest created models relative to its capacity"""
+    if not hosts:
+        return None
+    return min(hosts, key=lambda host: (len(host.created_models) + 1) / host.capacity)
+
+
+def select_weighted(hosts: Sequence[RemoteHost], key: str) -> Optional[RemoteHost]:
+    """Returns a host with a probability proportional to its capacity using weighted
+    rendezvous hashing. The choice is stable for a key and only keys of a host that
+    leaves (or of the host that joins) move.
+
+    Args:
+        hosts (Sequence[RemoteHost]): The hosts to choose from
+        key (str): The key to place (e.g., the name of a model)
+
+    Returns:
+        Optional[RemoteHost]: The chosen host; None if there are no hosts
+    """
+
+    def score(host: RemoteHost) -> Tuple[float, str]:
+        # Map the hash into (0, 1) and weigh it by the capacity of the host
+        unit = (hash_key(f"{key}@{get_address(host)}") + 1) / (2**64 + 1)
+        return -host.capacity / math.log(unit), get_address(host)
+
+    if not hosts:
+        return None
+    return max(hosts, key=score)
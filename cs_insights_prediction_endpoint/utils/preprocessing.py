@@ -0,0 +1,119 @@
+"""This module implements the text preprocessing shared by all models"""
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import lru_cache
+from itertools import islice
+from typing import Deque, Iterable, Iterator, List, Optional, Tuple
+
+from gensim.corpora.dictionary import Dictionary  # type: ignore
+from gensim.parsing.preprocessing import (  # type: ignore
+    preprocess_string,
+    remove_stopwords,
+)
+
+from cs_insights_prediction_endpoint.utils.settings import get_settings
+
+
+@lru_cache(maxsize=get_settings().preprocessing_cache_size)
+def preprocess_text(text: str) -> Tuple[str, ...]:
+    """Tokenizes a raw text (e.g., a title or an abstract) into stemmed tokens without
+    stopwords. Results are memoized, so repeated texts skip the tokenization.
+
+    Args:
+        text (str): The raw text
+
+    Returns:
+        Tuple[str, ...]: The tokens of the text
+    """
+    return tuple(preprocess_string(remove_stopwords(text)))
+
+
+def preprocess_chunk(texts: List[str]) -> List[Tuple[str, ...]]:
+    """Tokenizes a chunk of texts inside of a worker process"""
+    return [preprocess_text(text) for text in texts]
+
+
+def get_preprocessing_workers() -> int:
+    """Returns the number of worker processes used for preprocessing"""
+    workers = get_settings().preprocessing_workers
+    if workers is None:
+        return os.cpu_count() or 1
+    return workers
+
+
+@lru_cache()
+def get_preprocessing_pool() -> ProcessPoolExecutor:
+    """Return the process pool used for preprocessing"""
+    return ProcessPoolExecutor(
+        max_workers=get_preprocessing_workers(),
+        mp_context=multiprocessing.get_context(get_settings().job_start_method),
+    )
+
+
+def shutdown_preprocessing_pool() -> None:
+    """Stops the worker processes of the preprocessing pool if it was started"""
+    if get_preprocessing_pool.cache_info().currsize:
+        get_preprocessing_pool().shutdown(wait=True)
+        get_preprocessing_pool.cache_clear()
+
+
+def iter_preprocessed(
+    texts: Iterable[str],
+    workers: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+) -> Iterator[Tuple[str, ...]]:
+    """Tokenizes texts in chunks in a process pool and yields the tokens in order.
+    At most two chunks per worker are in flight, so memory stays bounded for long
+    (e.g., streamed) inputs. Inputs fitting into a single chunk are tokenized in process.
+
+    Args:
+        texts (Iterable[str]): The raw texts
+        workers (Optional[int]): Number of worker processes (default: preprocessing_workers)
+        chunk_size (Optional[int]): Texts per chunk (default: preprocessing_chunk_size)
+
+    Yields:
+        Tuple[str, ...]: The tokens of each text
+    """
+    workers = get_preprocessing_workers() if workers is None else workers
+    chunk_size = chunk_size or get_settings().preprocessing_chunk_size
+    iterator = iter(texts)
+    chunk = list(islice(iterator, chunk_size))
+    if workers <= 1 or len(chunk) < chunk_size:
+        while chunk:
+            yield from preprocess_chunk(chunk)
+            chunk = list(islice(iterator, chunk_size))
+        return
+
+    pool = get_preprocessing_pool()
+    in_flight: Deque["Future[List[Tuple[str, ...]]]"] = deque()
+    while chunk or in_flight:
+        while chunk and len(in_flight) < 2 * workers:
+            in_flight.append(pool.submit(preprocess_chunk, chunk))
+            chunk = list(islice(iterator, chunk_size))
+        yield from in_flight.popleft().result()
+
+
+def build_corpus(
+    texts: Iterable[str],
+    workers: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+) -> Tuple[Dictionary, List[List[Tuple[int, int]]]]:
+    """Builds the dictionary and bag of words corpus of texts in a single pass.
+    Only the bag of words of each text is kept, not its tokens.
+
+    Args:
+        texts (Iterable[str]): The raw texts
+        workers (Optional[int]): Number of worker processes (default: preprocessing_workers)
+        chunk_size (Optional[int]): Texts per chunk (default: preprocessing_chunk_size)
+
+    Returns:
+        Tuple[Dictionary, List[List[Tuple[int, int]]]]: The dictionary and the corpus
+    """
+    dictionary = Dictionary()
+    bow_corpus = [
+        dictionary.doc2bow(tokens, allow_update=True)
+        for tokens in iter_preprocessed(texts, workers, chunk_size)
+    ]
+    return dictionary, bow_corpus
@@ -1,23 +1,51 @@
 """This module implements a remote storage controller for the endpoint management"""
 
+import logging
+import threading
+import time
 from functools import lru_cache
-from typing import List, Optional, TypeVar
+from typing import AbstractSet, Any, Dict, List, Optional, TypeVar
 
-import pymongo
-from pymongo import MongoClient
+from pymongo import DeleteOne, InsertOne, MongoClient, UpdateOne
 from pymongo.collection import Collection
+from pymongo.errors import PyMongoError
 
 from cs_insights_prediction_endpoint.models.model_hosts import RemoteHost
+from cs_insights_prediction_endpoint.utils.database import (
+    get_mongo_client,
+    run_in_database_executor,
+)
+from cs_insights_prediction_endpoint.utils.placement import (
+    HashRing,
+    get_address,
+    placement_strategies,
+    select_least_loaded,
+    select_weighted,
+)
 from cs_insights_prediction_endpoint.utils.settings import Settings, get_settings
+from cs_insights_prediction_endpoint.utils.write_behind import WriteBehindBuffer
 
 RS = TypeVar("RS", bound="RemoteStorageController")
 
+logger = logging.getLogger(__name__)
+
+# Number of changes kept in the log of the registry version; workers further behind than the
+# log reaches reload all hosts instead of applying the changes
+registry_change_log_size = 1000
+# Id of the document holding the version and the change log in the collection of the hosts
+registry_document_id = "registry"
+
 # Attributes to exclude when saving pydentic models to the database
 # exclude_attributes: Any = {}
 
 
 class RemoteStorageController:
-    """StorageController for stroing remote hosts"""
+    """StorageController for stroing remote hosts.
+    The registry of hosts is loaded from the database. Every change increments its version
+    and logs the created models added to or removed from a host (or the ip of an added or
+    removed host) with the same bulk_write; on MAIN nodes a background thread applies the
+    logged changes whenever the version differs, so all workers share the registry.
+    """
 
     remote_host_list: List[RemoteHost] = []
 
@@ -27,13 +55,233 @@ class RemoteStorageController:
         Args:
             settings (Settings): Settings object used for information on the databse
         """
-        self.remote_host_client: MongoClient = pymongo.MongoClient(
-            f"mongodb://{settings.mongo_user.get_secret_value()}"
-            + f":{settings.mongo_password.get_secret_value()}@{settings.mongo_host}",
-        )
+        self.remote_host_client: MongoClient = get_mongo_client(settings)
         self.remote_host_db: Collection = self.remote_host_client[settings.remote_host_db_name][
             settings.remote_host_db_name
         ]
+        if settings.placement_strategy not in placement_strategies:
+            raise ValueError(
+                f"Unknown placement strategy {settings.placement_strategy};"
+                + f" use one of {placement_strategies}"
+            )
+        self.placement_strategy = settings.placement_strategy
+        self.hash_ring = HashRing(settings.placement_virtual_nodes)
+        # Routing index (created model id -> host), kept in sync with the created_models lists
+        self.model_routes: Dict[str, RemoteHost] = {}
+        # Positions of the created models in the list of each host (ip -> model id -> index),
+        # so a model is removed in constant time by moving the last model to its position
+        self.model_positions: Dict[str, Dict[str, int]] = {}
+
+        # The version is the last one whose changes were applied; own changes are applied
+        # right away and again (without effect) when refreshing, so it is not advanced by them
+        self.registry_lock = threading.RLock()
+        self.registry_version = 0
+        self.load_registry()
+        # Changes of the created model lists are written in batches if write-behind is enabled;
+        # the version is incremented once a batch was written, so other workers apply it then
+        self.write_buffer: Optional[WriteBehindBuffer] = None
+        if settings.write_behind_interval > 0:
+            self.write_buffer = WriteBehindBuffer(
+                self.remote_host_db,
+                settings.write_behind_interval,
+                settings.write_behind_max_batch,
+                on_flush=self.log_changes,
+            )
+        # Lookups of unknown models refresh the registry at most every miss_refresh_interval
+        # seconds, so requests for missing models do not all read the database
+        self.miss_refresh_lock = threading.Lock()
+        self.miss_refresh_interval = settings.remote_host_miss_refresh_interval
+        self.last_miss_refresh = float("-inf")
+        self.stop_event = threading.Event()
+        self.refresh_interval = settings.remote_host_refresh_interval
+        # Only MAIN nodes route requests by the registry
+        if settings.node_type == "MAIN" and self.refresh_interval > 0:
+            threading.Thread(target=self.refresh_loop, daemon=True).start()
+
+    def load_registry(self: RS) -> None:
+        """Loads all hosts from the database and rebuilds the routing index"""
+        with self.registry_lock:
+            # The version is read first; a change in between is loaded by the next refresh
+            version = self.get_registry_version()
+            hosts = [
+                RemoteHost(**document)
+                for document in self.remote_host_db.find({"ip": {"$exists": True}})
+            ]
+            model_routes: Dict[str, RemoteHost] = {}
+            model_positions: Dict[str, Dict[str, int]] = {}
+            for host in hosts:
+                for model_id in host.created_models:
+                    model_routes[model_id] = host
+                model_positions[host.ip] = get_positions(host.created_models)
+            self.remote_host_list = hosts
+            self.model_routes = model_routes
+            self.model_positions = model_positions
+            self.registry_version = version
+
+    def get_registry_version(self: RS) -> int:
+        """Returns the version of the registry stored in the database"""
+        document = self.remote_host_db.find_one({"_id": registry_document_id}, {"version": 1})
+        return 0 if document is None else int(document["version"])
+
+    def log_changes(self: RS, changes: List[Dict[str, Any]]) -> None:
+        """Increments the version after buffered changes were written and logs them
+
+        Args:
+            changes (List[Dict[str, Any]]): The written changes (see get_version_update)
+        """
+        if changes:
+            self.remote_host_db.bulk_write([get_version_update(changes)])
+
+    def flush(self: RS) -> None:
+        """Writes all buffered changes now; callers writing to the database directly hold the
+        registry_lock, so the buffered changes are written before their change
+        """
+        if self.write_buffer is not None:
+            self.write_buffer.flush()
+
+    def refresh_registry(self: RS) -> bool:
+        """Applies the changes logged since the last refresh if the version in the database
+        differs; if this worker is further behind than the log reaches, all hosts are reloaded
+
+        Returns:
+            bool: True if changes were applied; False otherwise
+        """
+        version = self.get_registry_version()
+        if version == self.registry_version:
+            return False
+        # Own buffered changes are logged before applying the log, so they are not reverted by
+        # older changes; they are written before taking the registry_lock, so routing lookups
+        # do not wait for the write
+        self.flush()
+        with self.registry_lock:
+            # Changes buffered since then (usually none)
+            self.flush()
+            while True:
+                behind = version - self.registry_version
+                if behind == 0:
+                    # Applied by another thread in the meantime
+                    return False
+                if behind < 0 or behind > registry_change_log_size:
+                    self.load_registry()
+                    return True
+                document = self.remote_host_db.find_one(
+                    {"_id": registry_document_id}, {"version": 1, "changes": {"$slice": -behind}}
+                )
+                if document is None:
+                    self.load_registry()
+                    return True
+                if document["version"] == version:
+                    break
+                # Changed in between, so the log is read again up to the new version
+                version = document["version"]
+            changes = document.get("changes", [])
+            if len(changes) < behind:
+                self.load_registry()
+                return True
+            for entry in changes:
+                self.apply_changes(entry)
+            self.registry_version = version
+            return True
+
+    def apply_changes(self: RS, changes: List[Dict[str, Any]]) -> None:
+        """Applies logged changes to the hosts in memory; needs the registry_lock. Applying a
+        change again has no effect, so own changes are applied again in the order of the log
+
+        Args:
+            changes (List[Dict[str, Any]]): Created models added to ("add") or removed from
+                                            ("remove") the host ip; changes with neither reload
+                                            the host (e.g., after it was added or removed)
+        """
+        for change in changes:
+            ip = change["ip"]
+            if "add" not in change and "remove" not in change:
+                self.load_hosts({ip})
+                continue
+            host = self.get_remote_host(ip)
+            if host is None:
+                continue
+            for model_id in change.get("add", []):
+                if model_id not in self.model_positions.get(ip, {}):
+                    self.append_created_model(host, model_id)
+            for model_id in change.get("remove", []):
+                self.discard_created_model(host, model_id)
+
+    def load_hosts(self: RS, ips: AbstractSet[str]) -> None:
+        """Reloads the hosts ips from the database; needs the registry_lock
+
+        Args:
+            ips (AbstractSet[str]): The ips of the hosts to reload; hosts no longer in the
+                                    database are removed, new ones are added
+        """
+        documents = {
+            document["ip"]: document
+            for document in self.remote_host_db.find({"ip": {"$in": sorted(ips)}})
+        }
+        hosts: List[RemoteHost] = []
+        for host in self.remote_host_list:
+            if host.ip in ips:
+                self.unindex_host(host)
+                document = documents.pop(host.ip, None)
+                if document is None:
+                    continue
+                host = RemoteHost(**document)
+                self.index_host(host)
+            hosts.append(host)
+        for document in documents.values():
+            host = RemoteHost(**document)
+            self.index_host(host)
+            hosts.append(host)
+        self.remote_host_list = hosts
+
+    def refresh_loop(self: RS) -> None:
+        """Refreshes the registry every refresh_interval seconds until close is called"""
+        while not self.stop_event.wait(self.refresh_interval):
+            try:
+                self.refresh_registry()
+            except PyMongoError as error:
+                logger.warning("Refreshing the remote hosts failed: %s", error)
+
+    def close(self: RS) -> None:
+        """Stops refreshing the registry and writes all buffered changes"""
+        self.stop_event.set()
+        if self.write_buffer is not None:
+            self.write_buffer.close()
+
+    def index_host(self: RS, host: RemoteHost) -> None:
+        """Adds the created models of host to the routing index"""
+        for model_id in host.created_models:
+            self.model_routes[model_id] = host
+        self.model_positions[host.ip] = get_positions(host.created_models)
+
+    def unindex_host(self: RS, host: RemoteHost) -> None:
+        """Removes the created models of host from the routing index"""
+        for model_id in host.created_models:
+            if self.model_routes.get(model_id) is host:
+                del self.model_routes[model_id]
+        self.model_positions.pop(host.ip, None)
+
+    def append_created_model(self: RS, host: RemoteHost, model_id: str) -> None:
+        """Appends a model to the created models of host and indexes it; needs the
+        registry_lock
+        """
+        self.model_positions.setdefault(host.ip, {})[model_id] = len(host.created_models)
+        host.created_models.append(model_id)
+        self.model_routes[model_id] = host
+
+    def discard_created_model(self: RS, host: RemoteHost, model_id: str) -> None:
+        """Removes a model from the created models of host in constant time by moving the
+        last model to its position; unknown models are ignored. Needs the registry_lock
+        """
+        positions = self.model_positions.get(host.ip, {})
+        position = positions.pop(model_id, None)
+        if position is None:
+            return
+        last = host.created_models.pop()
+        if last != model_id:
+            host.created_models[position] = last
+            positions[last] = position
+        if self.model_routes.get(model_id) is host:
+            del self.model_routes[model_id]
 
     def get_all_models(self: RS) -> List[str]:
         """Returns all implemented models from every host
@@ -81,17 +329,73 @@ class RemoteStorageController:
 
     def add_model_to_created_model_list(self: RS, ip: str, model_id: str) -> None:
         """Adds a newly created model to the list of remote models"""
-        r_host: Optional[RemoteHost] = self.get_remote_host(ip)
-        if r_host is not None:
-            r_host.created_models.append(model_id)
-            self.remote_host_db.update_one({"ip": ip}, {"$set": r_host.dict()})
+        with self.registry_lock:
+            r_host: Optional[RemoteHost] = self.get_remote_host(ip)
+            if r_host is not None:
+                self.append_created_model(r_host, model_id)
+                self.write(
+                    UpdateOne({"ip": ip}, {"$push": {"created_models": model_id}}),
+                    {"ip": ip, "add": [model_id]},
+                    key=f"{ip}/{model_id}",
+                )
 
     def remove_model_from_created_model_list(self: RS, ip: str, model_id: str) -> None:
         """Removes a created model from the list of remote models"""
-        r_host: Optional[RemoteHost] = self.get_remote_host(ip)
-        if r_host is not None:
-            r_host.created_models.remove(model_id)
-            self.remote_host_db.update_one({"ip": ip}, {"$set": r_host.dict()})
+        with self.registry_lock:
+            r_host: Optional[RemoteHost] = self.get_remote_host(ip)
+            if r_host is not None:
+                self.discard_created_model(r_host, model_id)
+                self.write(
+                    UpdateOne({"ip": ip}, {"$pull": {"created_models": model_id}}),
+                    {"ip": ip, "remove": [model_id]},
+                    cancels=f"{ip}/{model_id}",
+                )
+
+    def add_models_to_created_model_list(self: RS, ip: str, model_ids: List[str]) -> None:
+        """Adds newly created models to the list of remote models with one write"""
+        with self.registry_lock:
+            r_host: Optional[RemoteHost] = self.get_remote_host(ip)
+            if r_host is not None and model_ids:
+                for model_id in model_ids:
+                    self.append_created_model(r_host, model_id)
+                self.write(
+                    UpdateOne({"ip": ip}, {"$push": {"created_models": {"$each": model_ids}}}),
+                    {"ip": ip, "add": model_ids},
+                )
+
+    def remove_models_from_created_model_list(self: RS, ip: str, model_ids: List[str]) -> None:
+        """Removes created models from the list of remote models with one write"""
+        with self.registry_lock:
+            r_host: Optional[RemoteHost] = self.get_remote_host(ip)
+            if r_host is not None and model_ids:
+                for model_id in model_ids:
+                    self.discard_created_model(r_host, model_id)
+                self.write(
+                    UpdateOne({"ip": ip}, {"$pull": {"created_models": {"$in": model_ids}}}),
+                    {"ip": ip, "remove": model_ids},
+                )
+
+    def write(
+        self: RS,
+        operation: UpdateOne,
+        change: Dict[str, Any],
+        key: Optional[str] = None,
+        cancels: Optional[str] = None,
+    ) -> None:
+        """Writes a change of a created model list and logs it now or, with write-behind, with
+        the next batch; needs the registry_lock
+
+        Args:
+            operation (UpdateOne): The change to write
+            change (Dict[str, Any]): The change to log (see apply_changes)
+            key (Optional[str]): A key a later change can cancel the buffered change by
+            cancels (Optional[str]): The key of a buffered change this change reverts;
+                                     if it is still buffered, neither change is written
+        """
+        if self.write_buffer is None:
+            self.remote_host_db.bulk_write([operation, get_version_update([change])], ordered=True)
+        elif cancels is None or not self.write_buffer.cancel(cancels):
+            self.write_buffer.submit(operation, key, tag=change)
 
     def find_created_model_in_remote_hosts(self: RS, to_search: str) -> Optional[str]:
         """Returns the ip of the remote hosts containing the created_model 'to_search'
@@ -101,10 +405,39 @@ class RemoteStorageController:
         Returns:
             Optional[str]: The ip of the host if it was found; None otherwise
         """
-        for host in self.remote_host_list:
-            if to_search in host.created_models:
-                return f"{host.ip}:{host.port}"
-        return None
+        host = self.model_routes.get(to_search)
+        if host is None:
+            return None
+        return f"{host.ip}:{host.port}"
+
+    def locate_created_model(self: RS, model_id: str) -> Optional[str]:
+        """Returns the address of the host containing the created model; on a miss the
+        registry is refreshed once (at most every miss_refresh_interval seconds), since the
+        model may have been created by another worker
+
+        Args:
+            model_id (str): An created model id
+        Returns:
+            Optional[str]: The address (ip:port) of the host if it was found; None otherwise
+        """
+        host = self.find_created_model_in_remote_hosts(model_id)
+        if host is None and self.may_refresh_on_miss():
+            # Another thread may have refreshed the registry in the meantime, so the model is
+            # looked up again even if nothing was reloaded
+            self.refresh_registry()
+            host = self.find_created_model_in_remote_hosts(model_id)
+        return host
+
+    def may_refresh_on_miss(self: RS) -> bool:
+        """Returns True if a lookup miss may refresh the registry now, i.e., no miss did in
+        the last miss_refresh_interval seconds
+        """
+        with self.miss_refresh_lock:
+            now = time.monotonic()
+            if now - self.last_miss_refresh < self.miss_refresh_interval:
+                return False
+            self.last_miss_refresh = now
+            return True
 
     def find_model_in_remote_hosts(self: RS, to_search: str) -> Optional[str]:
         """Returns the ip of the remote hosts containing the model 'to_search'
@@ -119,6 +452,42 @@ class RemoteStorageController:
                 return f"{host.ip}:{host.port}"
         return None
 
+    def place_model(
+        self: RS, model_type: str, key: str, exclude: AbstractSet[str] = frozenset()
+    ) -> Optional[str]:
+        """Returns the address of the host a new model should be created on
+
+        Args:
+            model_type (str): The type of the model (e.g., lda); only hosts implementing
+                              it are chosen
+            key (str): A key identifying the model (e.g., its name) for hash based strategies
+            exclude (AbstractSet[str]): Addresses of hosts not to choose (e.g., unhealthy hosts);
+                                       with consistent hashing the next host on the ring is used
+
+        Returns:
+            Optional[str]: The address (ip:port) of the host; None if no (remaining) host
+                           implements the model type
+        """
+        candidates = [
+            host
+            for host in self.remote_host_list
+            if model_type in host.models and get_address(host) not in exclude
+        ]
+        if not candidates:
+            return None
+        if self.placement_strategy == "consistent_hash":
+            self.hash_ring.sync(
+                {get_address(host): host.capacity for host in self.remote_host_list}
+            )
+            return self.hash_ring.get_host(key, [get_address(host) for host in candidates])
+        if self.placement_strategy == "least_loaded":
+            host = select_least_loaded(candidates)
+        elif self.placement_strategy == "weighted":
+            host = select_weighted(candidates, key)
+        else:
+            host = candidates[0]
+        return None if host is None else get_address(host)
+
     def add_remote_host(self: RS, to_add: RemoteHost) -> RemoteHost:
         """Add a remote host to the list
 
@@ -129,8 +498,13 @@ class RemoteStorageController:
             RemoteHost: The host that was added; or None on failure
         """
         # self.remote_host_db.insert_one(to_add.dict(exclude=exclude_attributes))
-        self.remote_host_db.insert_one(to_add.dict())
-        self.remote_host_list.append(to_add)
+        with self.registry_lock:
+            self.flush()
+            self.remote_host_db.bulk_write(
+                [InsertOne(to_add.dict()), get_version_update([{"ip": to_add.ip}])], ordered=True
+            )
+            self.remote_host_list.append(to_add)
+            self.index_host(to_add)
         return to_add
 
     def remove_remote_host(self: RS, ip: str) -> bool:
@@ -141,13 +515,90 @@ class RemoteStorageController:
         Returns:
             bool: True if host was found and removed; False otherwise
         """
-        for i, host in enumerate(self.remote_host_list):
-            if host.ip == ip:
-                self.remote_host_db.delete_one({"ip": ip})
-                self.remote_host_list.remove(host)
-                return True
+        with self.registry_lock:
+            self.flush()
+            for i, host in enumerate(self.remote_host_list):
+                if host.ip == ip:
+                    self.remote_host_db.bulk_write(
+                        [DeleteOne({"ip": ip}), get_version_update([{"ip": ip}])], ordered=True
+                    )
+                    self.remote_host_list.remove(host)
+                    self.unindex_host(host)
+                    return True
         return False
 
+    async def refresh_registry_async(self: RS) -> bool:
+        """Reloads the registry if it changed without blocking the event loop
+        (see refresh_registry)
+        """
+        return await run_in_database_executor(self.refresh_registry)
+
+    async def locate_created_model_async(self: RS, model_id: str) -> Optional[str]:
+        """Returns the address of the host containing the created model without blocking the
+        event loop (see locate_created_model)
+        """
+        host = self.find_created_model_in_remote_hosts(model_id)
+        if host is not None:
+            return host
+        return await run_in_database_executor(self.locate_created_model, model_id)
+
+    async def add_model_to_created_model_list_async(self: RS, ip: str, model_id: str) -> None:
+        """Adds a newly created model to the list of remote models without blocking the
+        event loop (see add_model_to_created_model_list)
+        """
+        await run_in_database_executor(self.add_model_to_created_model_list, ip, model_id)
+
+    async def remove_model_from_created_model_list_async(self: RS, ip: str, model_id: str) -> None:
+        """Removes a created model from the list of remote models without blocking the
+        event loop (see remove_model_from_created_model_list)
+        """
+        await run_in_database_executor(self.remove_model_from_created_model_list, ip, model_id)
+
+    async def add_models_to_created_model_list_async(
+        self: RS, ip: str, model_ids: List[str]
+    ) -> None:
+        """Adds newly created models to the list of remote models without blocking the
+        event loop (see add_models_to_created_model_list)
+        """
+        await run_in_database_executor(self.add_models_to_created_model_list, ip, model_ids)
+
+    async def remove_models_from_created_model_list_async(
+        self: RS, ip: str, model_ids: List[str]
+    ) -> None:
+        """Removes created models from the list of remote models without blocking the
+        event loop (see remove_models_from_created_model_list)
+        """
+        await run_in_database_executor(self.remove_models_from_created_model_list, ip, model_ids)
+
+    async def add_remote_host_async(self: RS, to_add: RemoteHost) -> RemoteHost:
+        """Add a remote host to the list without blocking the event loop (see add_remote_host)"""
+        return await run_in_database_executor(self.add_remote_host, to_add)
+
+    async def remove_remote_host_async(self: RS, ip: str) -> bool:
+        """Remove a host from the remote host list without blocking the event loop
+        (see remove_remote_host)
+        """
+        return await run_in_database_executor(self.remove_remote_host, ip)
+
+
+def get_positions(model_ids: List[str]) -> Dict[str, int]:
+    """Returns the position of every model id in the list"""
+    return {model_id: i for i, model_id in enumerate(model_ids)}
+
+
+def get_version_update(changes: List[Dict[str, Any]]) -> UpdateOne:
+    """Returns the update incrementing the version of the registry and logging the changes
+    (see RemoteStorageController.apply_changes) as the entry of the new version
+    """
+    return UpdateOne(
+        {"_id": registry_document_id},
+        {
+            "$inc": {"version": 1},
+            "$push": {"changes": {"$each": [changes], "$slice": -registry_change_log_size}},
+        },
+        upsert=True,
+    )
+
 
 # remote_storage_controller: RemoteStorageController = RemoteStorageController(get_settings())
 
@@ -0,0 +1,166 @@
+"""This module implements a cache for expensive, serialized function call results"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Optional, Tuple, TypeVar
+
+from cs_insights_prediction_endpoint.utils.settings import get_settings
+
+RC = TypeVar("RC", bound="ResultCache")
+
+
+def fingerprint(*parts: Any) -> str:
+    """Returns a stable hash of json serializable parts (e.g., input data and parameters)
+
+    Args:
+        *parts (Any): The values the result depends on
+
+    Returns:
+        str: The hex digest of the parts
+    """
+    encoded = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """Cache of serialized results bounded by size and time to live (TTL).
+    Entries can additionally be persisted to a directory, so they survive restarts
+    and are shared by all processes using the same directory.
+    """
+
+    def __init__(
+        self: RC,
+        max_size: int,
+        ttl: float,
+        directory: Optional[str] = None,
+        max_disk_size: int = 0,
+    ) -> None:
+        """Constructor for the result cache
+
+        Args:
+            max_size (int): Maximum number of entries kept in memory
+            ttl (float): Seconds after which an entry expires
+            directory (Optional[str]): Directory to persist entries to; None to disable
+            max_disk_size (int): Maximum number of entries kept in directory (0: max_size)
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.directory = directory
+        self.max_disk_size = max_disk_size or max_size
+        self.entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def get(self: RC, key: str) -> Optional[str]:
+        """Returns the cached value for key if it exists and has not expired
+
+        Args:
+            key (str): The key of the entry (e.g., a fingerprint)
+
+        Returns:
+            Optional[str]: The cached value; None otherwise
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                entry = self.read_from_disk(key, now)
+                if entry is not None:
+                    self.store(key, entry)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self: RC, key: str, value: str) -> None:
+        """Caches value under key
+
+        Args:
+            key (str): The key of the entry (e.g., a fingerprint)
+            value (str): The serialized result
+        """
+        entry = (time.time() + self.ttl, value)
+        with self.lock:
+            self.store(key, entry)
+            if self.directory is not None:
+                self.write_to_disk(key, value)
+
+    def store(self: RC, key: str, entry: Tuple[float, str]) -> None:
+        """Puts entry into memory and evicts the least recently used entries beyond max_size"""
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def get_path(self: RC, key: str) -> str:
+        """Returns the path key is persisted to"""
+        return os.path.join(str(self.directory), f"{key}.json")
+
+    def read_from_disk(self: RC, key: str, now: float) -> Optional[Tuple[float, str]]:
+        """Reads a persisted entry; expired entries are removed
+
+        Returns:
+            Optional[Tuple[float, str]]: The expiration time and value; None if not found
+        """
+        if self.directory is None:
+            return None
+        path = self.get_path(key)
+        try:
+            expires = os.path.getmtime(path) + self.ttl
+            if expires <= now:
+                os.remove(path)
+                return None
+            with open(path, encoding="utf-8") as cache_file:
+                return expires, cache_file.read()
+        except OSError:
+            return None
+
+    def write_to_disk(self: RC, key: str, value: str) -> None:
+        """Persists an entry atomically and removes the oldest entries beyond max_disk_size"""
+        path = self.get_path(key)
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as cache_file:
+            cache_file.write(value)
+        os.replace(temporary_path, path)
+
+        persisted = [
+            os.path.join(str(self.directory), name)
+            for name in os.listdir(str(self.directory))
+            if name.endswith(".json")
+        ]
+        persisted.sort(key=os.path.getmtime)
+        for outdated in persisted[: max(0, len(persisted) - self.max_disk_size)]:
+            os.remove(outdated)
+
+    def clear(self: RC) -> None:
+        """Removes all entries from memory and disk"""
+        with self.lock:
+            self.entries.clear()
+            if self.directory is not None:
+                for name in os.listdir(self.directory):
+                    if name.endswith(".json"):
+                        os.remove(os.path.join(self.directory, name))
+
+
+@lru_cache()
+def get_lda_vis_cache() -> ResultCache:
+    """Return the cache for LDAvis results"""
+    settings = get_settings()
+    return ResultCache(
+        max_size=settings.lda_vis_cache_size,
+        ttl=settings.lda_vis_cache_ttl_seconds,
+        directory=settings.lda_vis_cache_directory,
+        max_disk_size=settings.lda_vis_cache_disk_size,
+    )
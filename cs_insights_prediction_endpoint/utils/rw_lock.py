@@ -0,0 +1,119 @@
+"""This module implements a reader/writer lock"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional, TypeVar
+
+RW = TypeVar("RW", bound="ReadWriteLock")
+
+
+class ReadWriteLock:
+    """Lock that is held either by any number of readers or by a single writer.
+    Waiting writers take precedence over new readers, so a steady stream of readers
+    cannot starve a writer. The lock is not reentrant and not bound to a thread, e.g.,
+    it can be released by another thread than the one that acquired it.
+    """
+
+    def __init__(self: RW) -> None:
+        """Constructor for the reader/writer lock"""
+        self.condition = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writer = False
+        self.waiting_writers = 0
+
+    def acquire_read(self: RW, timeout: Optional[float] = None) -> bool:
+        """Acquires the lock shared with other readers
+
+        Args:
+            timeout (Optional[float]): Maximum seconds to wait; None waits forever
+
+        Returns:
+            bool: True if the lock was acquired; False if the timeout expired
+        """
+        with self.condition:
+            if not self.wait_for(lambda: not self.writer and not self.waiting_writers, timeout):
+                return False
+            self.readers += 1
+            return True
+
+    def release_read(self: RW) -> None:
+        """Releases a shared lock"""
+        with self.condition:
+            if self.readers <= 0:
+                raise RuntimeError("Cannot release a read lock that is not held")
+            self.readers -= 1
+            if self.readers == 0:
+                self.condition.notify_all()
+
+    def acquire_write(self: RW, timeout: Optional[float] = None) -> bool:
+        """Acquires the lock exclusively
+
+        Args:
+            timeout (Optional[float]): Maximum seconds to wait; None waits forever,
+                                       0 does not wait at all
+
+        Returns:
+            bool: True if the lock was acquired; False if the timeout expired
+        """
+        with self.condition:
+            self.waiting_writers += 1
+            acquired = self.wait_for(lambda: not self.writer and not self.readers, timeout)
+            self.waiting_writers -= 1
+            if not acquired:
+                # Readers held back by this writer may proceed
+                self.condition.notify_all()
+                return False
+            self.writer = True
+            return True
+
+    def release_write(self: RW) -> None:
+        """Releases the exclusive lock"""
+        with self.condition:
+            if not self.writer:
+                raise RuntimeError("Cannot release a write lock that is not held")
+            self.writer = False
+            self.condition.notify_all()
+
+    def wait_for(self: RW, predicate: Callable[[], bool], timeout: Optional[float]) -> bool:
+        """Waits until predicate is true; the condition has to be held by the caller
+
+        Returns:
+            bool: True if predicate is true; False if the timeout expired before
+        """
+        if timeout is None:
+            self.condition.wait_for(predicate)
+            return True
+        deadline = time.monotonic() + timeout
+        while not predicate():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            self.condition.wait(remaining)
+        return True
+
+    @contextmanager
+    def read_locked(self: RW) -> Iterator[None]:
+        """Holds the lock shared while the context is active"""
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write_locked(self: RW) -> Iterator[None]:
+        """Holds the lock exclusively while the context is active"""
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+    def get_state(self: RW) -> dict:
+        """Returns the number of readers, whether a writer holds the lock and waiting writers"""
+        with self.condition:
+            return {
+                "readers": self.readers,
+                "writer": self.writer,
+                "waiting_writers": self.waiting_writers,
+            }
@@ -20,11 +20,86 @@ class Settings(BaseSettings):
     jwt_sign_alg: str = "HS256"
     jwt_token_expiration_minutes: int = 30
 
+    # Serializer of json responses ("orjson" if installed or "json")
+    json_response_class: str = "orjson"
+
+    # Connection pool and timeouts used when forwarding requests to SECONDARY nodes
+    forward_max_connections: int = 100
+    forward_max_keepalive_connections: int = 20
+    forward_keepalive_expiry: float = 5.0
+    forward_connect_timeout: float = 5.0
+    forward_timeout: Optional[float] = 300.0
+    # Circuit breaking of remote hosts: a host failing circuit_failure_threshold requests in a row
+    # is skipped for circuit_reset_timeout seconds; every health_check_interval seconds (0: never)
+    # all hosts are probed; health_smoothing weights the latest request in the moving averages
+    circuit_failure_threshold: int = 3
+    circuit_reset_timeout: float = 30.0
+    health_check_interval: float = 10.0
+    health_check_timeout: float = 2.0
+    health_smoothing: float = 0.2
+
+    # Seconds between checks of the remote host registry for changes of other workers (MAIN
+    # nodes only) and minimum seconds between refreshes on lookups of unknown created models
+    remote_host_refresh_interval: float = 5.0
+    remote_host_miss_refresh_interval: float = 1.0
+    # Placement of created models on hosts: "first", "consistent_hash", "least_loaded"
+    # or "weighted"; consistent hashing uses placement_virtual_nodes per unit of capacity
+    placement_strategy: str = "consistent_hash"
+    placement_virtual_nodes: int = 100
+
+    # Load models on first use and keep at most this many models/bytes in memory (0: no limit)
+    lazy_model_loading: bool = False
+    model_cache_max_models: int = 0
+    model_cache_max_bytes: int = 0
+    # Memory-map arrays of at least model_mmap_sep_limit elements read-only when loading models
+    # (opt-in, e.g., to share the arrays between the worker processes of a host)
+    model_mmap: bool = False
+    model_mmap_sep_limit: int = 1024
+    # Saved versions kept per model, including the current one (0: keep all versions; every
+    # version is a full copy of the state on disk)
+    model_version_retention: int = 3
+    # Number of tokenized texts memoized by the preprocessing pipeline in every process; an
+    # entry holds the text and its tokens (about 10 KB for an abstract), i.e., ~20 MB by default
+    preprocessing_cache_size: int = 2000
+    # Worker processes tokenizing chunks of texts (None: one per cpu core, 0 or 1: in process)
+    preprocessing_workers: Optional[int] = None
+    preprocessing_chunk_size: int = 1000
+    # Cache for LDAvis results; entries are persisted to the directory if one is given
+    lda_vis_cache_size: int = 32
+    lda_vis_cache_ttl_seconds: float = 24 * 60 * 60
+    lda_vis_cache_directory: Optional[str] = None
+    lda_vis_cache_disk_size: int = 256
+    # Number of most probable words per topic precomputed for getTopWords
+    top_words_index_size: int = 100
+    # Documents per update when training from a streamed (NDJSON) corpus
+    train_chunk_size: int = 2000
+    # Items per bulk request and models built at the same time by a bulk creation
+    bulk_max_items: int = 1000
+    bulk_create_concurrency: int = 4
+    # Asynchronous jobs: at most job_workers jobs run and job_max_queued jobs wait per host, shared
+    # by all worker processes of the host through the slot files in job_slot_directory (a
+    # directory local to the host); queued jobs retry every job_slot_poll_interval seconds
+    # while jobs of other processes use all slots
+    job_workers: int = 2
+    job_max_queued: int = 100
+    job_history_size: int = 1000
+    job_start_method: str = "spawn"
+    job_slot_directory: str = "/tmp/cs_insights_prediction_endpoint/job_slots"
+    job_slot_poll_interval: float = 1.0
+
     jwt_secret: SecretStr = SecretStr("super_secret_secret")
     mongo_user: SecretStr = SecretStr("admin")
     mongo_password: SecretStr = SecretStr("admin_user")
     mongo_db: str = "nlpland"
     mongo_host: str = "127.0.0.1"
+    # Connections of the database client shared by a process and threads running the
+    # database operations of async route handlers
+    mongo_max_pool_size: int = 100
+    mongo_executor_workers: int = 8
+    # Write-behind of model metadata and created model lists: changes are written in batches of
+    # at most write_behind_max_batch at the latest after write_behind_interval seconds (0: off)
+    write_behind_interval: float = 0.0
+    write_behind_max_batch: int = 500
     auth_backend_url: str = "http://127.0.0.1/api/{version}"
 
     class Config:
@@ -1,79 +1,577 @@
 """This module implements a storage controller for the endpoint management"""
 
+import logging
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 from functools import lru_cache
 from importlib import import_module
-from typing import Any, List, Optional, TypeVar
+from typing import Any, Dict, Iterator, List, Optional, TypeVar
 
-import pymongo
-from pymongo import MongoClient
+from pymongo import DeleteOne, InsertOne, MongoClient, UpdateOne
 from pymongo.collection import Collection
 
 from cs_insights_prediction_endpoint.models.generic_model import GenericModel
+from cs_insights_prediction_endpoint.utils.database import (
+    get_mongo_client,
+    run_in_database_executor,
+)
+from cs_insights_prediction_endpoint.utils.rw_lock import ReadWriteLock
 from cs_insights_prediction_endpoint.utils.settings import Settings, get_settings
+from cs_insights_prediction_endpoint.utils.write_behind import WriteBehindBuffer
 
 T = TypeVar("T", bound="StorageController")
 
+logger = logging.getLogger(__name__)
+
 # Attributes to exclude when saving pydentic models to the database
 exclude_attributes: Any = {"function_calls": True, "processing_model": True}
 
 
+class VersionConflictError(Exception):
+    """Raised if an update computed from a version is installed after the model changed"""
+
+
 class StorageController:
-    """Storage Controller class to enable access to currently created Models"""
+    """Storage Controller class to enable access to currently created Models.
+    Changes of the indexes are atomic (registry_lock) and every model has a reader/writer
+    lock: function calls reading a model run in parallel, deletion gets exclusive access.
+    Updating calls (e.g., train) run one at a time on a copy of the model, which is saved
+    as a new version and swapped in when the call finished (see use_model), so reading
+    calls are served by the previous version in the meantime.
+    """
 
-    models: List[GenericModel] = list([])
+    models: Dict[str, GenericModel] = {}
 
     def __init__(self: T, settings: Settings) -> None:
         """Constructor for the storage controller
         Args:
             settings (Settings): Settings object used for information on the databse
         """
-        self.model_client: MongoClient = pymongo.MongoClient(
-            f"mongodb://{settings.mongo_user.get_secret_value()}"
-            + f":{settings.mongo_password.get_secret_value()}@{settings.mongo_host}",
-        )
+        self.model_client: MongoClient = get_mongo_client(settings)
         self.model_db: Collection = self.model_client[settings.model_db_name][
             settings.model_db_name
         ]
-        self.models = list([])
+        # Changes of the metadata are written in batches if write-behind is enabled
+        self.write_buffer: Optional[WriteBehindBuffer] = None
+        if settings.write_behind_interval > 0:
+            self.write_buffer = WriteBehindBuffer(
+                self.model_db, settings.write_behind_interval, settings.write_behind_max_batch
+            )
+        # Primary index (id -> model) and secondary indexes (attribute -> id -> model)
+        self.models = {}
+        self.model_locks: Dict[str, ReadWriteLock] = {}
+        # Held while a copy of the model is updated, so updates are not lost
+        self.update_locks: Dict[str, threading.Lock] = {}
+        # Update locks held by updates that were begun but not yet committed or aborted
+        self.pending_updates: Dict[str, threading.Lock] = {}
+        # The oldest saved versions beyond this number are deleted on updates (0: none)
+        self.model_version_retention = settings.model_version_retention
+        self.registry_lock = threading.RLock()
+        self.models_by_type: Dict[str, Dict[str, GenericModel]] = {}
+        self.models_by_creator: Dict[str, Dict[str, GenericModel]] = {}
+
+        # In lazy mode only the metadata of a model is kept in memory until it is used;
+        # loaded models are evicted in least recently used order (id -> memory usage)
+        self.lazy_model_loading = settings.lazy_model_loading
+        self.max_resident_models = settings.model_cache_max_models
+        self.max_resident_bytes = settings.model_cache_max_bytes
+        self.resident_models: "OrderedDict[str, int]" = OrderedDict()
+        self.cache_lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_evictions = 0
 
         for db_model in self.model_db.find({}):
             # self.models.append(GenericModel(**model))
             for implemented_models in settings.implemented_models:
                 if db_model["type_of_model"] in implemented_models:
                     model_specs = implemented_models[db_model["type_of_model"]]
-                    model_module = import_module(model_specs[0])
-                    model_class = model_specs[1]
-                    model = getattr(model_module, model_class)(**db_model)
-                    model.load(f"{model.save_directory}/{model.id}")
-                    self.models.append(model)
+                    model = self.restore_model(model_specs, db_model)
+                    if model is not None:
+                        self.register_model(model)
+
+    def restore_model(self: T, model_specs: List[str], db_model: dict) -> Optional[GenericModel]:
+        """Rebuilds a stored model from its database document. The model is neither
+        trained nor saved; its state is loaded from save_directory (on first use in lazy mode)
+
+        Args:
+            model_specs (List[str]): Module and class name of the model implementation
+            db_model (dict): The document of the model in the database
+
+        Returns:
+            Optional[GenericModel]: The restored model; None if its state was not saved
+        """
+        model_module = import_module(model_specs[0])
+        model_class = model_specs[1]
+        # Passing a processing_model skips building (and saving) a new one
+        model: GenericModel = getattr(model_module, model_class)(
+            **{**db_model, "processing_model": None}
+        )
+        # A model without state could not serve any request, so it is not registered
+        if not os.path.exists(model.get_save_path()):
+            logger.warning("No saved state found for model %s; it is not restored", model.id)
+            return None
+        if not self.lazy_model_loading:
+            model.load(model.get_save_path())
+        return model
+
+    def register_model(self: T, model: GenericModel) -> None:
+        """Adds model to the in-memory indexes without persisting it"""
+        with self.registry_lock:
+            self.models[model.id] = model
+            self.model_locks.setdefault(model.id, ReadWriteLock())
+            self.update_locks.setdefault(model.id, threading.Lock())
+            self.models_by_type.setdefault(model.type_of_model, {})[model.id] = model
+            self.models_by_creator.setdefault(model.created_by, {})[model.id] = model
+
+    def unregister_model(self: T, model: GenericModel) -> None:
+        """Removes model from the in-memory indexes without touching the database"""
+        with self.registry_lock:
+            del self.models[model.id]
+            self.model_locks.pop(model.id, None)
+            self.update_locks.pop(model.id, None)
+            for index, key in (
+                (self.models_by_type, model.type_of_model),
+                (self.models_by_creator, model.created_by),
+            ):
+                index[key].pop(model.id, None)
+                if not index[key]:
+                    del index[key]
 
     def get_model(self: T, id: str) -> Optional[GenericModel]:
-        """Returns the model with id"""
-        for model in self.models:
-            if model.id == id:
-                return model
-        return None
+        """Returns the model with id; in lazy mode its state is loaded if necessary.
+        The model is not locked; use use_model to run function calls on it.
+        """
+        model = self.models.get(id)
+        if model is not None and self.lazy_model_loading:
+            self.make_resident(model)
+        return model
+
+    def get_model_lock(self: T, id: str) -> Optional[ReadWriteLock]:
+        """Returns the reader/writer lock of the model with id; None if it does not exist"""
+        with self.registry_lock:
+            return self.model_locks.get(id)
+
+    @contextmanager
+    def use_model(
+        self: T, id: str, function_call: Optional[str] = None
+    ) -> Iterator[Optional[GenericModel]]:
+        """Provides the model with id for a function call while the context is active.
+        Reading calls share the lock of the model. Function calls that update the model
+        (see GenericModel.updating_function_calls) get a copy of it, which is committed as
+        a new version if the context exits without an exception and the call changed its
+        state (see begin_update).
+        A model deleted while waiting for its lock is not returned.
+
+        Args:
+            id (str): The id of the model
+            function_call (Optional[str]): The function call to run; None only reads
+
+        Yields:
+            Optional[GenericModel]: The (loaded) model or its copy; None if it does not exist
+        """
+        with self.registry_lock:
+            model = self.models.get(id)
+            lock = self.model_locks.get(id)
+        if model is None or lock is None:
+            yield None
+            return
+        if function_call in model.updating_function_calls:
+            staged = self.begin_update(id)
+            if staged is None:
+                yield None
+                return
+            try:
+                yield staged
+            except BaseException:
+                self.abort_update(id)
+                raise
+            if staged.is_state_changed():
+                self.commit_update(id, staged)
+            else:
+                self.abort_update(id)
+            return
+        with lock.read_locked():
+            if self.models.get(id) is not model:
+                yield None
+                return
+            if self.lazy_model_loading:
+                self.make_resident(model)
+            yield model
+
+    def begin_update(self: T, id: str, copy_state: bool = True) -> Optional[GenericModel]:
+        """Starts an update of the model with id and returns a copy of it to update.
+        Updates of a model run one after another, so this waits for the running one;
+        every update has to be finished by commit_update or abort_update.
+
+        Args:
+            id (str): The id of the model
+            copy_state (bool): Whether the state is copied; False if it is replaced anyway
+
+        Returns:
+            Optional[GenericModel]: The copy carrying the next version; None if the model
+                                    does not exist
+        """
+        with self.registry_lock:
+            update_lock = self.update_locks.get(id)
+        if update_lock is None:
+            return None
+        update_lock.acquire()
+        try:
+            with self.registry_lock:
+                model = self.models.get(id)
+                lock = self.model_locks.get(id)
+            if model is None or lock is None:
+                update_lock.release()
+                return None
+            with lock.read_locked():
+                if self.lazy_model_loading and copy_state:
+                    self.make_resident(model)
+                staged = model.snapshot(copy_state)
+            # Versions are never overwritten, also not after a rollback
+            staged.version = max([model.version, *model.get_saved_versions()]) + 1
+            self.pending_updates[id] = update_lock
+            return staged
+        except BaseException:
+            update_lock.release()
+            raise
+
+    def commit_update(self: T, id: str, staged: GenericModel) -> Optional[int]:
+        """Saves the updated copy of the model with id as its new version and swaps it in.
+        Function calls reading the model are only blocked while the state is replaced.
+        Saved versions beyond model_version_retention are deleted afterwards.
+
+        Args:
+            id (str): The id of the model
+            staged (GenericModel): The copy returned by begin_update
+
+        Returns:
+            Optional[int]: The new version; None if the model was deleted in the meantime
+        """
+        try:
+            staged.save(staged.get_save_path())
+            version = self.swap_version(id, staged)
+            if version is None:
+                staged.delete_saved_versions([staged.version])
+            else:
+                self.prune_versions(id)
+            return version
+        finally:
+            self.abort_update(id)
+
+    def abort_update(self: T, id: str) -> None:
+        """Finishes an update of the model with id without changing the model"""
+        update_lock = self.pending_updates.pop(id, None)
+        if update_lock is not None:
+            update_lock.release()
+
+    def swap_version(self: T, id: str, staged: GenericModel) -> Optional[int]:
+        """Replaces the state and version of the model with id by those of staged and
+        persists the version; the update lock of the model has to be held by the caller
+        """
+        with self.registry_lock:
+            model = self.models.get(id)
+            lock = self.model_locks.get(id)
+        if model is None or lock is None:
+            return None
+        with lock.write_locked():
+            if self.models.get(id) is not model:
+                return None
+            model.replace_state(staged)
+            model.version = staged.version
+        if self.lazy_model_loading:
+            with self.cache_lock:
+                self.mark_used(model)
+        self.write([UpdateOne({"id": id}, {"$set": {"version": staged.version}})])
+        return staged.version
+
+    def prune_versions(self: T, id: str) -> List[int]:
+        """Deletes the oldest saved versions of the model with id, so that at most
+        model_version_retention versions are kept; the current version is always kept.
+        The update lock of the model has to be held by the caller
+
+        Returns:
+            List[int]: The deleted versions
+        """
+        model = self.get_model(id)
+        if model is None or self.model_version_retention <= 0:
+            return []
+        versions = [version for version in model.get_saved_versions() if version != model.version]
+        versions = versions[: max(len(versions) - self.model_version_retention + 1, 0)]
+        model.delete_saved_versions(versions)
+        return versions
+
+    def install_version(
+        self: T, id: str, processing_model: Any, base_version: Optional[int] = None
+    ) -> Optional[int]:
+        """Saves processing_model (e.g., updated by a job) as the new version of the model
+        with id and swaps it in
+
+        Args:
+            id (str): The id of the model
+            processing_model (Any): The updated state
+            base_version (Optional[int]): The version the update was computed from; it is
+                                          rejected if the model changed in the meantime
+
+        Raises:
+            VersionConflictError: If the current version of the model is not base_version
+
+        Returns:
+            Optional[int]: The new version; None if the model does not exist
+        """
+        staged = self.begin_update(id, copy_state=False)
+        if staged is None:
+            return None
+        model = self.get_model(id)
+        # Installing the update would silently discard the updates since base_version
+        if base_version is not None and model is not None and model.version != base_version:
+            self.abort_update(id)
+            raise VersionConflictError(
+                f"The model changed from version {base_version} to {model.version} "
+                "while the job was running"
+            )
+        staged.processing_model = processing_model
+        return self.commit_update(id, staged)
+
+    def rollback_model(self: T, id: str, version: int) -> GenericModel:
+        """Restores a saved version of the model with id. Later versions are kept,
+        so a rollback can be undone by another rollback.
+
+        Args:
+            id (str): The id of the model
+            version (int): The saved version to restore
+
+        Raises:
+            KeyError: If the model does not exist
+            ValueError: If the version was not saved
+
+        Returns:
+            GenericModel: The model
+        """
+        with self.registry_lock:
+            model = self.models.get(id)
+            update_lock = self.update_locks.get(id)
+        if model is None or update_lock is None:
+            raise KeyError("Model not found")
+        with update_lock:
+            # Checked under the update lock, so the version is not pruned before it is loaded
+            if version not in model.get_saved_versions():
+                raise ValueError(f"Version {version} of the model was not saved")
+            # The saved state is loaded into a copy, so the model keeps serving until the swap
+            staged = model.snapshot(copy_state=False)
+            staged.load(model.get_save_path(version))
+            staged.version = version
+            if self.swap_version(id, staged) is None:
+                raise KeyError("Model not found")
+        return model
+
+    def get_model_versions(self: T, id: str) -> Optional[Dict[str, Any]]:
+        """Returns the current and all saved versions of the model with id; None if the
+        model does not exist
+        """
+        with self.registry_lock:
+            model = self.models.get(id)
+        if model is None:
+            return None
+        return {"version": model.version, "versions": model.get_saved_versions()}
+
+    def get_function_calls(self: T, id: str) -> Optional[List[str]]:
+        """Returns the names of the function calls of the model with id without loading its
+        state; None if the model does not exist
+        """
+        with self.registry_lock:
+            model = self.models.get(id)
+        if model is None:
+            return None
+        return model.get_function_calls()
+
+    def make_resident(self: T, model: GenericModel) -> None:
+        """Loads the state of model if it is not in memory and marks it as most recently used.
+        Least recently used models are unloaded afterwards until the cache budget is met.
+
+        Args:
+            model (GenericModel): The model that is about to be used
+        """
+        with self.cache_lock:
+            if model.is_loaded():
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+                model.load(model.get_save_path())
+            self.mark_used(model)
+
+    def mark_used(self: T, model: GenericModel) -> None:
+        """Marks a loaded model as most recently used and evicts models if necessary.
+        The cache_lock has to be held by the caller.
+
+        Args:
+            model (GenericModel): The loaded model
+        """
+        self.resident_models[model.id] = model.get_memory_usage()
+        self.resident_models.move_to_end(model.id)
+        self.evict_models(keep=model.id)
+
+    def evict_models(self: T, keep: str) -> None:
+        """Unloads least recently used models until the cache budget is met
+
+        Args:
+            keep (str): Id of a model that must not be evicted (the one currently in use)
+        """
+        for evict_id in list(self.resident_models):
+            if not self.is_over_budget():
+                break
+            if evict_id == keep:
+                continue
+            # Models in use are skipped; waiting for them could deadlock with their users
+            lock = self.get_model_lock(evict_id)
+            if lock is not None and not lock.acquire_write(timeout=0):
+                continue
+            try:
+                del self.resident_models[evict_id]
+                model = self.models.get(evict_id)
+                if model is not None:
+                    model.unload()
+                    self.cache_evictions += 1
+            finally:
+                if lock is not None:
+                    lock.release_write()
+
+    def is_over_budget(self: T) -> bool:
+        """Returns whether the resident models exceed the configured count or memory budget"""
+        if self.max_resident_models and len(self.resident_models) > self.max_resident_models:
+            return True
+        if self.max_resident_bytes and sum(self.resident_models.values()) > self.max_resident_bytes:
+            return True
+        return False
+
+    def get_memory_report(self: T) -> Dict[str, dict]:
+        """Returns the memory report of every model whose state is loaded"""
+        return {
+            model.id: model.get_memory_report()
+            for model in self.get_all_models()
+            if model.is_loaded()
+        }
+
+    def get_cache_statistics(self: T) -> Dict[str, int]:
+        """Returns the hit/miss/eviction counters of the lazy model cache"""
+        with self.cache_lock:
+            return {
+                "hits": self.cache_hits,
+                "misses": self.cache_misses,
+                "evictions": self.cache_evictions,
+                "resident_models": len(self.resident_models),
+                "resident_bytes": sum(self.resident_models.values()),
+            }
 
     def get_all_models(self: T) -> List[GenericModel]:
         """Returns all models"""
-        return self.models
+        with self.registry_lock:
+            return list(self.models.values())
+
+    def get_models_by_type(self: T, type_of_model: str) -> List[GenericModel]:
+        """Returns all models of the type type_of_model (e.g., lda)"""
+        with self.registry_lock:
+            return list(self.models_by_type.get(type_of_model, {}).values())
+
+    def get_models_by_creator(self: T, created_by: str) -> List[GenericModel]:
+        """Returns all models created by created_by"""
+        with self.registry_lock:
+            return list(self.models_by_creator.get(created_by, {}).values())
 
     def add_model(self: T, model: GenericModel) -> str:
         """Adds model to models"""
-        self.model_db.insert_one(model.dict(exclude=exclude_attributes))
-        self.models.append(model)
-        return model.id
+        return self.add_models([model])[0]
+
+    def add_models(self: T, models: List[GenericModel]) -> List[str]:
+        """Adds models to models; their metadata is written in one batch
+
+        Returns:
+            List[str]: The ids of the models
+        """
+        self.write(
+            [InsertOne(model.dict(exclude=exclude_attributes)) for model in models],
+            keys=[model.id for model in models],
+        )
+        for model in models:
+            self.register_model(model)
+            if self.lazy_model_loading:
+                with self.cache_lock:
+                    self.mark_used(model)
+        return [model.id for model in models]
 
     # TODO For consitency maybe return bool or switch
     #      remote_storage_controler function to raise key error
     def del_model(self: T, id: str) -> None:
         """Delete model from storage"""
-        model = self.get_model(id)
-        if model is None:
+        if not self.del_models([id]):
             raise KeyError("Model not found")
+
+    def del_models(self: T, ids: List[str]) -> List[str]:
+        """Delete models from storage together with all of their saved versions;
+        their metadata is deleted in one batch
+
+        Returns:
+            List[str]: The ids of the deleted models; ids of models not found are left out
+        """
+        models: Dict[str, GenericModel] = {}
+        for id in ids:
+            lock = self.get_model_lock(id)
+            if lock is None:
+                continue
+            # Function calls running on the model finish before it is removed
+            # Cache before registry lock, in the order evict_models takes them
+            with lock.write_locked(), self.cache_lock, self.registry_lock:
+                model = self.models.get(id)
+                if model is not None and id not in models:
+                    models[id] = model
+                    self.unregister_model(model)
+                    self.resident_models.pop(id, None)
+        for model in models.values():
+            model.delete_saved_versions()
+        # A model deleted before its insert was written is never written
+        self.write(
+            [
+                DeleteOne({"id": model.id})
+                for model in models.values()
+                if self.write_buffer is None or not self.write_buffer.cancel(model.id)
+            ]
+        )
+        return list(models)
+
+    def write(self: T, operations: List[Any], keys: Optional[List[Optional[str]]] = None) -> None:
+        """Writes operations to the database in one batch now or, with write-behind,
+        with the next batches; keys allow cancelling buffered operations
+        """
+        if not operations:
+            return
+        if self.write_buffer is None:
+            self.model_db.bulk_write(operations)
         else:
-            self.model_db.delete_one({"id": model.id})
-            self.models.remove(model)
+            for operation, key in zip(operations, keys or [None] * len(operations)):
+                self.write_buffer.submit(operation, key)
+
+    def flush(self: T) -> None:
+        """Writes all buffered changes now (e.g., before shutdown)"""
+        if self.write_buffer is not None:
+            self.write_buffer.flush()
+
+    async def add_model_async(self: T, model: GenericModel) -> str:
+        """Adds model to models without blocking the event loop (see add_model)"""
+        return await run_in_database_executor(self.add_model, model)
+
+    async def del_model_async(self: T, id: str) -> None:
+        """Delete model from storage without blocking the event loop (see del_model)"""
+        await run_in_database_executor(self.del_model, id)
+
+    async def add_models_async(self: T, models: List[GenericModel]) -> List[str]:
+        """Adds models to models without blocking the event loop (see add_models)"""
+        return await run_in_database_executor(self.add_models, models)
+
+    async def del_models_async(self: T, ids: List[str]) -> List[str]:
+        """Delete models from storage without blocking the event loop (see del_models)"""
+        return await run_in_database_executor(self.del_models, ids)
 
 
 # storage_controller: StorageController = StorageController(get_settings())
@@ -0,0 +1,164 @@
+"""This module implements the write-behind buffer batching writes of the storage controllers"""
+import atexit
+import logging
+import threading
+from typing import Any, Callable, List, Optional, Tuple, TypeVar
+
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError, PyMongoError
+
+WB = TypeVar("WB", bound="WriteBehindBuffer")
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    """Buffers write operations (e.g., InsertOne or UpdateOne) of a collection and writes
+    them in ordered bulk_write batches by a background thread. A batch is written at the
+    latest flush_interval seconds after its first operation, or as soon as max_batch
+    operations are pending. The order of operations is kept: batches are written one at a
+    time and failed operations stay in front of newer ones until they were written.
+    """
+
+    def __init__(
+        self: WB,
+        collection: Collection,
+        flush_interval: float,
+        max_batch: int,
+        on_flush: Optional[Callable[[List[Any]], None]] = None,
+    ) -> None:
+        """Constructor for the write-behind buffer
+
+        Args:
+            collection (Collection): The collection the operations are written to
+            flush_interval (float): Maximum seconds an operation is buffered
+            max_batch (int): Maximum number of operations written by one bulk_write
+            on_flush (Optional[Callable[[List[Any]], None]]): Called with the tags of the written
+                                                               operations in order after they
+                                                               were written
+        """
+        self.collection = collection
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.on_flush = on_flush
+        # Pending operations in order with the key they can be cancelled by and their tag
+        self.pending: List[Tuple[Optional[str], Any, Any]] = []
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.closed = False
+        self.batches = 0
+        self.written = 0
+        self.cancelled = 0
+        self.thread = threading.Thread(target=self.flush_loop, daemon=True)
+        self.thread.start()
+        # Pending operations are written on exit; close unregisters it again
+        atexit.register(self.close)
+
+    def submit(self: WB, operation: Any, key: Optional[str] = None, tag: Any = None) -> None:
+        """Buffers a write operation
+
+        Args:
+            operation (Any): The operation (e.g., InsertOne) to write
+            key (Optional[str]): A key the operation can be cancelled by before it was written
+            tag (Any): Passed to on_flush once the operation was written (e.g., the document
+                       it changes)
+        """
+        with self.lock:
+            self.pending.append((key, operation, tag))
+            if len(self.pending) == 1 or len(self.pending) >= self.max_batch:
+                self.wakeup.notify()
+
+    def cancel(self: WB, key: str) -> bool:
+        """Removes the latest pending operation submitted with key, e.g., the insert of a
+        document that is deleted before it was written
+
+        Returns:
+            bool: True if an operation was removed; False if none is pending
+        """
+        with self.lock:
+            for index in range(len(self.pending) - 1, -1, -1):
+                if self.pending[index][0] == key:
+                    del self.pending[index]
+                    self.cancelled += 1
+                    return True
+        return False
+
+    def flush(self: WB) -> int:
+        """Writes all pending operations now; returns when they were written
+
+        Returns:
+            int: The number of operations written
+
+        Raises:
+            PyMongoError: If the database could not be reached; the operations stay pending
+        """
+        written = 0
+        tags: List[Any] = []
+        with self.flush_lock:
+            while True:
+                with self.lock:
+                    batch = self.pending[: self.max_batch]
+                if not batch:
+                    break
+                try:
+                    self.collection.bulk_write(
+                        [operation for _, operation, _ in batch], ordered=True
+                    )
+                    done = len(batch)
+                except BulkWriteError as error:
+                    # Operations before the failed one were written; the failed one is dropped
+                    done = error.details["writeErrors"][0]["index"] + 1
+                    logger.error("Dropped a buffered write that failed: %s", error.details)
+                with self.lock:
+                    del self.pending[:done]
+                    self.batches += 1
+                    self.written += done
+                written += done
+                tags.extend(tag for _, _, tag in batch[:done] if tag is not None)
+            # Called before the next flush writes, so the tags are passed on in order
+            if written and self.on_flush is not None:
+                self.on_flush(tags)
+        return written
+
+    def flush_loop(self: WB) -> None:
+        """Writes pending operations at most flush_interval seconds after their submission"""
+        while True:
+            with self.lock:
+                while not self.pending and not self.closed:
+                    self.wakeup.wait()
+                if self.closed:
+                    return
+                if len(self.pending) < self.max_batch:
+                    self.wakeup.wait(self.flush_interval)
+            try:
+                self.flush()
+                continue
+            except PyMongoError as error:
+                logger.warning("Writing buffered operations failed: %s", error)
+            except Exception:
+                # The thread has to keep running, otherwise nothing would be written anymore
+                logger.exception("Writing buffered operations failed unexpectedly")
+            with self.lock:
+                self.wakeup.wait(self.flush_interval)
+
+    def get_statistics(self: WB) -> dict:
+        """Returns the number of pending, written and cancelled operations and batches"""
+        with self.lock:
+            return {
+                "pending": len(self.pending),
+                "written": self.written,
+                "cancelled": self.cancelled,
+                "batches": self.batches,
+            }
+
+    def close(self: WB) -> None:
+        """Writes all pending operations and stops the background thread"""
+        atexit.unregister(self.close)
+        with self.lock:
+            self.closed = True
+            self.wakeup.notify()
+        try:
+            self.flush()
+        except PyMongoError as error:
+            logger.error("Writing buffered operations on close failed: %s", error)
@@ -0,0 +1,27 @@
+from typing import Any, Iterator
+
+import pytest
+
+from cs_insights_prediction_endpoint.models.generic_model import GenericModel
+from cs_insights_prediction_endpoint.models.lda_model import LdaModelWrapper
+from cs_insights_prediction_endpoint.utils.database import close_mongo_clients
+
+
+@pytest.fixture(autouse=True)
+def fresh_mongo_clients() -> Iterator[None]:
+    """Controllers created by a test share one (mocked) database client; a new one per test
+    keeps the databases of the tests apart
+    """
+    close_mongo_clients()
+    yield
+    close_mongo_clients()
+
+
+@pytest.fixture
+def save_directory(tmp_path: Any, monkeypatch: Any) -> str:
+    """Models created by a test without a save_directory save their states (and versions)
+    to a temporary directory of the test instead of the working directory
+    """
+    for model_class in (GenericModel, LdaModelWrapper):
+        monkeypatch.setattr(model_class.__fields__["save_directory"], "default", str(tmp_path))
+    return str(tmp_path)
@@ -42,6 +42,10 @@ def test_generic_model_initial_values(dummy_generic_model: GenericModel) -> None
     assert dummy_generic_model.function_calls == {}
     assert dummy_generic_model.get_function_calls() == []
     assert str(dummy_generic_model) == dummy_generic_model.id
+    assert dummy_generic_model.get_save_path() == f"./saved_models/{dummy_generic_model.id}"
+    assert dummy_generic_model.get_memory_usage() == 0
+    assert dummy_generic_model.get_memory_report() == {"private_bytes": 0}
+    assert not dummy_generic_model.is_loaded()
 
     with pytest.raises(NotImplementedError):
         dummy_generic_model.train({})
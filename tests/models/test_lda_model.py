@@ -1,11 +1,19 @@
 """Test the lda model."""
 from datetime import datetime
+from typing import Any, Dict, List
 
 import pytest
 from gensim.models.ldamodel import LdaModel  # type: ignore
+from gensim.models.ldamulticore import LdaMulticore  # type: ignore
 from gensim.test.utils import common_corpus  # type: ignore
 
 from cs_insights_prediction_endpoint.models.lda_model import LdaModelWrapper
+from cs_insights_prediction_endpoint.utils.json_response import RawJSON
+from cs_insights_prediction_endpoint.utils.result_cache import get_lda_vis_cache
+from cs_insights_prediction_endpoint.utils.settings import get_settings
+
+# Models save their states to a temporary directory
+pytestmark = pytest.mark.usefixtures("save_directory")
 
 
 @pytest.fixture
@@ -128,7 +136,7 @@ def test_lda_model_initial_values(
                 num_topics=3,
                 passes=1,
             ),
-            dict,
+            RawJSON,
         )
         is True
     )
@@ -187,3 +195,228 @@ def test_lda_model_initial_values_no_creation_paramers(
 
     with pytest.raises(FileNotFoundError):
         dummy_lda_model_no_creation_parameters.load("")
+
+
+def test_lda_model_unload_and_load(dummy_lda_model: LdaModelWrapper) -> None:
+    """Test for freeing the state of the LDAModel and restoring it from disk
+
+    Arguments:
+        dummy_lda_model (LDAModel): An instance of our LDA_Model implementation
+    """
+    topics = dummy_lda_model.get_topics()
+    assert dummy_lda_model.is_loaded()
+    assert dummy_lda_model.get_memory_usage() > 0
+
+    dummy_lda_model.unload()
+    assert not dummy_lda_model.is_loaded()
+    assert dummy_lda_model.get_memory_usage() == 0
+
+    dummy_lda_model.load(dummy_lda_model.get_save_path())
+    assert dummy_lda_model.is_loaded()
+    assert dummy_lda_model.get_topics() == topics
+
+
+def test_lda_model_mmap(monkeypatch: Any, dummy_lda_model: LdaModelWrapper) -> None:
+    """Test for memory-mapping the arrays of the LDAModel and training it afterwards
+
+    Arguments:
+        monkeypatch (Any): a monkeypatch object
+        dummy_lda_model (LDAModel): An instance of our LDA_Model implementation
+    """
+    monkeypatch.setattr(get_settings(), "model_mmap", True)
+    monkeypatch.setattr(get_settings(), "model_mmap_sep_limit", 0)
+    dummy_lda_model.save(dummy_lda_model.get_save_path())
+    dummy_lda_model.load(dummy_lda_model.get_save_path())
+    report = dummy_lda_model.get_memory_report()
+    assert set(report["mapped_arrays"]) == {"expElogbeta", "sstats", "eta"}
+    assert report["mapped_bytes"] > 0
+    assert report["private_bytes"] == dummy_lda_model.processing_model.alpha.nbytes
+
+    dummy_lda_model.train({"corpus": common_corpus})
+    report = dummy_lda_model.get_memory_report()
+    assert report["mapped_bytes"] == 0
+    assert report["private_bytes"] > 0
+
+    monkeypatch.setattr(get_settings(), "model_mmap", False)
+    dummy_lda_model.load(dummy_lda_model.get_save_path())
+    assert dummy_lda_model.get_memory_report()["mapped_arrays"] == []
+
+
+def test_lda_model_predict_batch(dummy_lda_model: LdaModelWrapper) -> None:
+    """Test for classifying many documents in one call
+
+    Arguments:
+        dummy_lda_model (LDAModel): An instance of our LDA_Model implementation
+    """
+    output = dummy_lda_model.predict_batch(common_corpus)
+    assert len(output["topics"]) == len(common_corpus)
+    for document, topics, probabilities in zip(
+        common_corpus, output["topics"], output["probabilities"]
+    ):
+        expected = dict(dummy_lda_model.predict({"bow": document}))
+        assert set(topics) == set(expected)
+        assert probabilities == sorted(probabilities, reverse=True)
+        for topic, probability in zip(topics, probabilities):
+            assert probability == pytest.approx(expected[topic], abs=0.05)
+
+    output = dummy_lda_model.predict_batch(common_corpus, minimum_probability=0.5, top_k=1)
+    assert all(len(topics) <= 1 for topics in output["topics"])
+    assert all(p >= 0.5 for probabilities in output["probabilities"] for p in probabilities)
+    assert dummy_lda_model.predict_batch([]) == {"topics": [], "probabilities": []}
+    for top_k in [0, -1, 11]:
+        with pytest.raises(ValueError):
+            dummy_lda_model.predict_batch(common_corpus, top_k=top_k)
+
+
+def test_lda_model_predict_text(dummy_lda_model: LdaModelWrapper) -> None:
+    """Test for classifying raw text with the dictionary of the LDAModel
+
+    Arguments:
+        dummy_lda_model (LDAModel): An instance of our LDA_Model implementation
+    """
+    assert dummy_lda_model.get_dictionary() is None
+    with pytest.raises(ValueError):
+        dummy_lda_model.predict_text("Attention is all you need")
+
+    papers: List[Dict[str, Any]] = [
+        {"title": "Attention is all you need", "abstractText": "Transformers attention"},
+        {"title": "Topic models for papers", "abstractText": None},
+    ]
+    dummy_lda_model.get_lda_vis(papers, num_topics=2, passes=1)
+    dictionary = dummy_lda_model.get_dictionary()
+    assert dictionary is not None
+    assert "attent" in dictionary.token2id
+    topics = dummy_lda_model.predict_text("Attention is all you need", "Transformers")
+    assert len(topics) > 0
+    assert dummy_lda_model.predict_text("Topic models") != []
+
+    # The dictionary is persisted together with the model
+    dummy_lda_model.save(dummy_lda_model.get_save_path())
+    dummy_lda_model.load(dummy_lda_model.get_save_path())
+    restored = dummy_lda_model.get_dictionary()
+    assert restored is not None
+    assert restored.token2id == dictionary.token2id
+
+
+def test_lda_model_get_lda_vis_cached(
+    dummy_lda_model: LdaModelWrapper, dummy_lda_model_no_creation_parameters: LdaModelWrapper
+) -> None:
+    """Test that LDAvis results are cached by their model and input
+
+    Arguments:
+        dummy_lda_model (LDAModel): An instance of our LDA_Model implementation
+        dummy_lda_model_no_creation_parameters (LDAModel): Another instance
+    """
+    cache = get_lda_vis_cache()
+    cache.clear()
+    papers: List[Dict[str, Any]] = [
+        {"title": "Attention is all you need", "abstractText": "Transformers attention"},
+        {"title": "Topic models for papers", "abstractText": None},
+    ]
+    result = dummy_lda_model.get_lda_vis(papers, num_topics=2, passes=1)
+    assert cache.misses >= 1
+    assert "topic.order" in result.loads()
+    trained = dummy_lda_model.processing_model
+
+    hits = cache.hits
+    assert dummy_lda_model.get_lda_vis(papers, num_topics=2, passes=1) == result
+    assert cache.hits == hits + 1
+    assert dummy_lda_model.processing_model is trained
+
+    # Other parameters are a different result
+    dummy_lda_model.get_lda_vis(papers, num_topics=3, passes=1)
+    assert cache.hits == hits + 1
+
+    # Another model is trained on the same papers instead of getting the cached result
+    other_model = dummy_lda_model_no_creation_parameters
+    assert other_model.id != dummy_lda_model.id
+    other_model.get_lda_vis(papers, num_topics=2, passes=1)
+    assert cache.hits == hits + 1
+    other_dictionary = other_model.get_dictionary()
+    assert other_dictionary is not None
+    assert "attent" in other_dictionary.token2id
+
+
+def test_lda_model_multicore_engine() -> None:
+    """Test for training with the multicore engine"""
+    multicore_model = LdaModelWrapper(
+        name="Multicore",
+        created_by="Alpha Tester",
+        type_of_model="lda",
+        creation_parameters={
+            "engine": "multicore",
+            "workers": 2,
+            "corpus": common_corpus,
+            "num_topics": 5,
+        },
+    )
+    assert isinstance(multicore_model.processing_model, LdaMulticore)
+    assert multicore_model.processing_model.workers == 2
+    assert multicore_model.get_num_topics() == 5
+    topics = multicore_model.get_topics()
+    multicore_model.train({"corpus": common_corpus})
+    assert multicore_model.get_topics() != topics
+
+    # The engine is kept when the model is restored
+    multicore_model.load(multicore_model.get_save_path())
+    assert isinstance(multicore_model.processing_model, LdaMulticore)
+
+    multicore_model.get_lda_vis(
+        [{"title": "Attention is all you need", "abstractText": "Transformers attention"}],
+        num_topics=2,
+        passes=1,
+    )
+    assert isinstance(multicore_model.processing_model, LdaMulticore)
+
+    # Only the engine parameters given results in the default model
+    default_model = LdaModelWrapper(
+        created_by="Alpha Tester",
+        type_of_model="lda",
+        creation_parameters={"engine": "multicore", "workers": 1},
+    )
+    assert isinstance(default_model.processing_model, LdaMulticore)
+    assert default_model.get_num_topics() == 10
+
+    with pytest.raises(ValueError):
+        LdaModelWrapper(
+            created_by="Alpha Tester",
+            type_of_model="lda",
+            creation_parameters={"engine": "unknown"},
+        )
+
+
+def test_lda_model_get_top_words(dummy_lda_model: LdaModelWrapper) -> None:
+    """Test for listing the top words of the topics from the precomputed index
+
+    Arguments:
+        dummy_lda_model (LDAModel): An instance of our LDA_Model implementation
+    """
+    top_words = dummy_lda_model.get_top_words(top_n=3)
+    assert top_words["num_topics"] == 10
+    assert len(top_words["topics"]) == 10
+    for topic in top_words["topics"]:
+        expected = dummy_lda_model.processing_model.get_topic_terms(topic["topic"], topn=3)
+        assert [word["id"] for word in topic["words"]] == [word_id for word_id, _ in expected]
+        assert [word["probability"] for word in topic["words"]] == pytest.approx(
+            [float(p) for _, p in expected]
+        )
+        assert topic["words"][0]["word"] == str(topic["words"][0]["id"])
+
+    page = dummy_lda_model.get_top_words(top_n=2, offset=8, limit=5)
+    assert page["offset"] == 8
+    assert [topic["topic"] for topic in page["topics"]] == [8, 9]
+    assert dummy_lda_model.get_top_words(offset=10)["topics"] == []
+    with pytest.raises(ValueError):
+        dummy_lda_model.get_top_words(top_n=0)
+    with pytest.raises(ValueError):
+        dummy_lda_model.get_top_words(top_n=get_settings().top_words_index_size + 1)
+    with pytest.raises(ValueError):
+        dummy_lda_model.get_top_words(offset=-1)
+
+    # Training rebuilds the index
+    dummy_lda_model.train({"corpus": common_corpus * 10})
+    assert dummy_lda_model.get_top_words(top_n=3) != top_words
+
+    # Replacing the processing model (e.g., loading it) invalidates the index
+    dummy_lda_model.processing_model = LdaModel(common_corpus, num_topics=2)
+    assert dummy_lda_model.get_top_words()["num_topics"] == 2
@@ -1,6 +1,6 @@
 """Test the hosts route."""
 from importlib import reload
-from typing import Any
+from typing import Any, Dict
 
 import mongomock  # type: ignore
 import pytest
@@ -47,7 +47,7 @@ def remote_host_creation_request() -> RemoteHost:
     Returns:
         ModelCreationRequest: An correct modelcreation request
     """
-    dummy_remote_host = {
+    dummy_remote_host: Dict[str, Any] = {
         "ip": "192.168.0.100",
         "port": "666",
         "models": ["test"],
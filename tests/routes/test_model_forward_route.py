@@ -1,11 +1,11 @@
+import json
 from importlib import reload
-from typing import Any
+from typing import Any, AsyncIterator, Callable, Dict, List
 
+import httpx
 import mongomock  # type: ignore
 import pytest
-import requests
 from fastapi.testclient import TestClient
-from requests.models import Response
 
 import cs_insights_prediction_endpoint.app as app
 from cs_insights_prediction_endpoint import __version__
@@ -16,9 +16,21 @@ from cs_insights_prediction_endpoint.routes.route_model import (
     ModelDeletionRequest,
     ModelFunctionRequest,
 )
+from cs_insights_prediction_endpoint.utils.host_health import get_health_monitor
+from cs_insights_prediction_endpoint.utils.http_client import get_http_client
+from cs_insights_prediction_endpoint.utils.remote_storage_controller import (
+    RemoteStorageController,
+    get_remote_storage_controller,
+)
 from cs_insights_prediction_endpoint.utils.settings import get_settings
 
 
+def override_http_client(handler: Callable[[httpx.Request], httpx.Response]) -> None:
+    """Route every forwarded request of the current app to handler"""
+    mock_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    app.app.dependency_overrides[get_http_client] = lambda: mock_client  # type: ignore
+
+
 @pytest.fixture
 def patch_settings(monkeypatch: Any) -> None:
     monkeypatch.setattr(get_settings(), "node_type", "MAIN")
@@ -31,6 +43,8 @@ def client(patch_settings: Any) -> TestClient:
     Yields:
         TestClient: Yields the test client as input argument for each test.
     """
+    # Circuits opened by earlier tests must not affect this test
+    get_health_monitor.cache_clear()
     reload_app = reload(app)
     with TestClient(reload_app.app) as client:  # type: ignore
         return client
@@ -47,15 +61,8 @@ def endpoint() -> str:
 
 
 @pytest.fixture
-def mock_deletion(monkeypatch: Any) -> None:
-    def mock_post(*args, **kwargs):
-        # type: (*str, **int) -> Response
-        response = Response()
-        response.status_code = 200
-        response._content = b'{"model_id": "1234"}'
-        return response
-
-    monkeypatch.setattr(requests, "delete", mock_post)
+def mock_deletion(client: TestClient) -> None:
+    override_http_client(lambda request: httpx.Response(200, content=b'{"model_id": "1234"}'))
 
 
 @pytest.fixture
@@ -70,7 +77,7 @@ def hosts_endpoint() -> str:
 
 @pytest.fixture
 def dummy_remote_host() -> RemoteHost:
-    dummy_remote_host = {
+    dummy_remote_host: Dict[str, Any] = {
         "ip": "192.168.0.100",
         "port": "666",
         "models": ["lda"],
@@ -84,43 +91,39 @@ def remote_host_creation(
     client: TestClient, dummy_remote_host: RemoteHost, hosts_endpoint: str
 ) -> None:
     """Creates a dummy remote Host for further tests"""
-    client.post(hosts_endpoint, json=dummy_remote_host.dict())
+    with mongomock.patch(servers=(("127.0.0.1", 27017),)):
+        client.post(hosts_endpoint, json=dummy_remote_host.dict())
 
 
 @pytest.fixture
-def mock_post_request(monkeypatch: Any) -> None:
-    def mock_post(*args, **kwargs):
-        # type: (*str, **int) -> Response
-        response = Response()
-        response.status_code = 200
-        response._content = b"{}"
-        return response
+def mock_post_request(client: TestClient) -> None:
+    override_http_client(lambda request: httpx.Response(200, content=b"{}"))
 
-    monkeypatch.setattr(requests, "post", mock_post)
+
+@pytest.fixture
+def mock_get_request(client: TestClient) -> None:
+    override_http_client(lambda request: httpx.Response(200, content=b'{"models": []"}'))
 
 
 @pytest.fixture
-def mock_get_request(monkeypatch: Any) -> None:
-    def mock_get(*args, **kwargs):
-        # type: (*str, **int) -> Response
-        response = Response()
-        response.status_code = 200
-        response._content = b'{"models": []"}'
-        return response
+def mock_creation(client: TestClient) -> None:
+    override_http_client(lambda request: httpx.Response(201, content=b'{"model_id": "1234"}'))
 
-    monkeypatch.setattr(requests, "get", mock_get)
+
+@pytest.fixture
+def mock_timeout(client: TestClient) -> None:
+    def handler(request: httpx.Request) -> httpx.Response:
+        raise httpx.ReadTimeout("Timed out", request=request)
+
+    override_http_client(handler)
 
 
 @pytest.fixture
-def mock_creation(monkeypatch: Any) -> None:
-    def mock_post(*args, **kwargs):
-        # type: (*str, **int) -> Response
-        response = Response()
-        response.status_code = 201
-        response._content = b'{"model_id": "1234"}'
-        return response
+def mock_unreachable(client: TestClient) -> None:
+    def handler(request: httpx.Request) -> httpx.Response:
+        raise httpx.ConnectError("Connection refused", request=request)
 
-    monkeypatch.setattr(requests, "post", mock_post)
+    override_http_client(handler)
 
 
 @pytest.fixture
@@ -217,6 +220,7 @@ def test_function_call_model_forward(
     endpoint: str,
     model_function_call_request: GenericInputModel,
     mock_post_request: Any,
+    remote_host_creation: Any,
 ) -> None:
 
     response = client.post(endpoint + "1234", json=model_function_call_request.dict())
@@ -224,9 +228,402 @@ def test_function_call_model_forward(
 
 
 @mongomock.patch(servers=(("127.0.0.1", 27017),))
-def test_delete_model_forward(client: TestClient, endpoint: str, mock_deletion: Any) -> None:
+def test_delete_model_forward(
+    client: TestClient, endpoint: str, mock_deletion: Any, remote_host_creation: Any
+) -> None:
     response = client.delete(endpoint + "1234")
     assert response.status_code == 200
     response_json = response.json()
     assert "model_id" in response_json
     assert response_json["model_id"] == "1234"
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_forward_timeout(
+    client: TestClient,
+    endpoint: str,
+    model_function_call_request: GenericInputModel,
+    mock_timeout: Any,
+    remote_host_creation: Any,
+) -> None:
+    response = client.post(endpoint + "1234", json=model_function_call_request.dict())
+    assert response.status_code == 504
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_forward_unreachable(
+    client: TestClient, endpoint: str, mock_unreachable: Any, remote_host_creation: Any
+) -> None:
+    response = client.get(endpoint + "1234")
+    assert response.status_code == 502
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_forward_routing_miss(client: TestClient, endpoint: str, mock_post_request: Any) -> None:
+    # Models created through another worker are found by refreshing the registry once
+    get_remote_storage_controller().close()
+    get_remote_storage_controller.cache_clear()
+    get_remote_storage_controller()
+    RemoteStorageController(get_settings()).add_remote_host(
+        RemoteHost(ip="192.168.0.101", port="666", models=["lda"], created_models=["5678"])
+    )
+    response = client.get(endpoint + "5678")
+    assert response.status_code == 200
+    # Unknown models are not forwarded
+    response = client.get(endpoint + "unknown")
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Model not found"
+    assert list(get_health_monitor().get_report()) == ["192.168.0.101:666"]
+
+
+@pytest.fixture
+def mock_streaming(client: TestClient) -> None:
+    async def chunks(body: bytes) -> AsyncIterator[bytes]:
+        for start in range(0, len(body), 1024):
+            end = start + 1024
+            yield body[start:end]
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        body = b'{"output_data": ' + request.content + b"}"
+        return httpx.Response(
+            200, content=chunks(body), headers={"content-type": "application/x-test"}
+        )
+
+    override_http_client(handler)
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_function_call_model_forward_streaming(
+    client: TestClient, endpoint: str, mock_streaming: Any, remote_host_creation: Any
+) -> None:
+    generic_input = GenericInputModel(
+        function_call="train", input_data={"corpus": [[[i, 1] for i in range(10000)]]}
+    )
+    response = client.post(endpoint + "1234", data=generic_input.json())
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-test"
+    assert response.json() == {"output_data": generic_input.dict()}
+
+
+@pytest.fixture
+def mock_jobs(client: TestClient) -> None:
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(
+            202,
+            json={"method": request.method, "path": request.url.path},
+            headers={"location": request.url.path + "/5678"},
+        )
+
+    override_http_client(handler)
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_job_forward(
+    client: TestClient, endpoint: str, mock_jobs: Any, remote_host_creation: Any
+) -> None:
+    generic_input = GenericInputModel(function_call="train", input_data={"corpus": []})
+    response = client.post(endpoint + "1234/jobs", data=generic_input.json())
+    assert response.status_code == 202
+    assert response.json() == {"method": "POST", "path": endpoint + "1234/jobs"}
+    assert response.headers["location"] == endpoint + "1234/jobs/5678"
+
+    response = client.get(endpoint + "1234/jobs/5678/result")
+    assert response.json() == {"method": "GET", "path": endpoint + "1234/jobs/5678/result"}
+    response = client.delete(endpoint + "1234/jobs/5678")
+    assert response.json() == {"method": "DELETE", "path": endpoint + "1234/jobs/5678"}
+
+
+@pytest.fixture
+def mock_versions(client: TestClient) -> None:
+    def handler(request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content) if request.method == "POST" else {}
+        return httpx.Response(200, json={"version": body.get("version", 2), "versions": [0, 1, 2]})
+
+    override_http_client(handler)
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_version_forward(
+    client: TestClient, endpoint: str, mock_versions: Any, remote_host_creation: Any
+) -> None:
+    response = client.get(endpoint + "1234/versions")
+    assert response.status_code == 200
+    assert response.json() == {"version": 2, "versions": [0, 1, 2]}
+    response = client.post(endpoint + "1234/rollback", json={"version": 1})
+    assert response.status_code == 200
+    assert response.json() == {"version": 1, "versions": [0, 1, 2]}
+
+
+@pytest.fixture
+def mock_train_stream(client: TestClient) -> None:
+    def handler(request: httpx.Request) -> httpx.Response:
+        documents = request.read().decode().splitlines()
+        return httpx.Response(
+            200,
+            json={"documents": len(documents), "chunk_size": request.url.params["chunk_size"]},
+        )
+
+    override_http_client(handler)
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_train_stream_forward(
+    client: TestClient, endpoint: str, mock_train_stream: Any, remote_host_creation: Any
+) -> None:
+    response = client.post(
+        endpoint + "1234/train",
+        params={"chunk_size": 2},
+        data=b"[[0, 1]]\n[[1, 1]]\n[[2, 1]]\n",
+        headers={"content-type": "application/x-ndjson"},
+    )
+    assert response.status_code == 200
+    assert response.json() == {"documents": 3, "chunk_size": "2"}
+
+
+@pytest.fixture
+def mock_binary(client: TestClient) -> None:
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(
+            200,
+            content=b"\x01\x00\x00\x00" + request.headers["accept"].encode(),
+            headers={"content-type": request.headers["accept"], "x-array-shape": "10"},
+        )
+
+    override_http_client(handler)
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_function_call_model_forward_binary(
+    client: TestClient, endpoint: str, mock_binary: Any, remote_host_creation: Any
+) -> None:
+    generic_input = GenericInputModel(function_call="getTopics", input_data={})
+    response = client.post(
+        endpoint + "1234",
+        data=generic_input.json(),
+        headers={"accept": "application/octet-stream"},
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/octet-stream"
+    assert response.headers["x-array-shape"] == "10"
+    assert response.content == b"\x01\x00\x00\x00application/octet-stream"
+
+
+@pytest.fixture
+def failover_remote_hosts(client: TestClient, hosts_endpoint: str) -> Any:
+    hosts = [
+        RemoteHost(ip="10.1.0.1", port="80", models=["failover"], created_models=[]),
+        RemoteHost(ip="10.1.0.2", port="80", models=["failover"], created_models=[]),
+    ]
+    with mongomock.patch(servers=(("127.0.0.1", 27017),)):
+        for host in hosts:
+            client.post(hosts_endpoint, json=host.dict())
+    yield hosts
+    with mongomock.patch(servers=(("127.0.0.1", 27017),)):
+        for host in hosts:
+            client.delete(hosts_endpoint, json={"ip": host.ip})
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_create_model_failover(
+    client: TestClient, endpoint: str, hosts_endpoint: str, failover_remote_hosts: Any
+) -> None:
+    requested_hosts = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requested_hosts.append(request.url.host)
+        if request.url.host == "10.1.0.1":
+            raise httpx.ConnectError("Connection refused", request=request)
+        if request.url.host == "10.1.0.2" and request.method == "POST":
+            return httpx.Response(201, json={"model_id": "failover_model"})
+        return httpx.Response(200, json={})
+
+    override_http_client(handler)
+    # A name that is placed on the dead host first
+    rsc = get_remote_storage_controller()
+    name = next(
+        f"model{i}" for i in range(100) if rsc.place_model("failover", f"model{i}") == "10.1.0.1:80"
+    )
+    creation_request: Dict[str, Any] = {
+        "model_type": "failover",
+        "model_specification": {"name": name},
+    }
+    for _ in range(get_settings().circuit_failure_threshold):
+        response = client.post(endpoint, json=creation_request)
+        assert response.status_code == 201
+        assert response.json()["model_id"] == "failover_model"
+    assert requested_hosts.count("10.1.0.2") == get_settings().circuit_failure_threshold
+    # The circuit of the dead host is open now, so it is not tried anymore
+    requested_hosts.clear()
+    response = client.post(endpoint, json=creation_request)
+    assert response.status_code == 201
+    assert requested_hosts == ["10.1.0.2"]
+    response = client.get(hosts_endpoint + "health")
+    assert response.status_code == 200
+    assert response.json()["10.1.0.1:80"]["state"] == "open"
+    assert response.json()["10.1.0.2:80"]["state"] == "closed"
+    # Requests to models on a host with an open circuit fail fast
+    client.post(
+        hosts_endpoint,
+        json=RemoteHost(ip="10.1.0.1", port="80", models=[], created_models=["dead"]).dict(),
+    )
+    requested_hosts.clear()
+    response = client.get(endpoint + "dead")
+    assert response.status_code == 503
+    assert requested_hosts == []
+
+
+@pytest.mark.parametrize(
+    "failure", [httpx.ReadTimeout("Timed out"), httpx.Response(503, json={"detail": "Busy"})]
+)
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_create_model_no_failover_after_sending(
+    client: TestClient, endpoint: str, failover_remote_hosts: Any, failure: Any
+) -> None:
+    requested_hosts = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requested_hosts.append(request.url.host)
+        if isinstance(failure, httpx.Response):
+            return failure
+        raise failure
+
+    override_http_client(handler)
+    # The host may have created the model already, so the request is not sent to another host
+    creation_request: Dict[str, Any] = {
+        "model_type": "failover",
+        "model_specification": {"name": "model"},
+    }
+    response = client.post(endpoint, json=creation_request)
+    assert response.status_code == (504 if isinstance(failure, Exception) else 503)
+    assert len(requested_hosts) == 1
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_job_forward_load_shedding(
+    client: TestClient, endpoint: str, remote_host_creation: Any
+) -> None:
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(
+            503, json={"detail": "Job queue is full"}, headers={"x-load-shedding": "job-queue"}
+        )
+
+    override_http_client(handler)
+    generic_input: Dict[str, Any] = {"function_call": "train", "input_data": {}}
+    for _ in range(get_settings().circuit_failure_threshold + 1):
+        response = client.post(endpoint + "1234/jobs", json=generic_input)
+        assert response.status_code == 503
+        assert response.headers["x-load-shedding"] == "job-queue"
+    # A full job queue is no failure of the host, so its circuit stays closed
+    assert get_health_monitor().allow_request("192.168.0.100:666")
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_create_model_all_hosts_failing(
+    client: TestClient, endpoint: str, failover_remote_hosts: Any, mock_unreachable: Any
+) -> None:
+    creation_request: Dict[str, Any] = {"model_type": "failover", "model_specification": {}}
+    response = client.post(endpoint, json=creation_request)
+    assert response.status_code == 502
+    for _ in range(get_settings().circuit_failure_threshold):
+        client.post(endpoint, json=creation_request)
+    response = client.post(endpoint, json=creation_request)
+    assert response.status_code == 503
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_bulk_forward(
+    client: TestClient, endpoint: str, hosts_endpoint: str, failover_remote_hosts: Any
+) -> None:
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        requests.append((request.method, request.url.host, body))
+        if request.url.host == "10.1.0.1":
+            raise httpx.ConnectError("Connection refused", request=request)
+        if request.method == "POST":
+            results = [
+                {
+                    "index": index,
+                    "status_code": 201,
+                    "model_id": model["model_specification"]["name"],
+                }
+                for index, model in enumerate(body["models"])
+            ]
+        else:
+            results = [
+                {"index": index, "status_code": 200, "model_id": model_id}
+                for index, model_id in enumerate(body["model_ids"])
+            ]
+        return httpx.Response(207, json={"results": results})
+
+    override_http_client(handler)
+    models: List[Dict[str, Any]] = [
+        {"model_type": "failover", "model_specification": {"name": f"bulk{i}"}} for i in range(6)
+    ]
+    models.insert(2, {"model_type": "unknown", "model_specification": {}})
+    response = client.post(endpoint + "bulk", json={"models": models})
+    assert response.status_code == 207
+    results = response.json()["results"]
+    assert [result["index"] for result in results] == list(range(7))
+    assert [result["status_code"] for result in results] == [201, 201, 404, 201, 201, 201, 201]
+    # One bulk request per host; the models of the dead host were created on the other one
+    assert len([request for request in requests if request[1] == "10.1.0.1"]) == 1
+    live_requests = [request for request in requests if request[1] == "10.1.0.2"]
+    assert 1 <= len(live_requests) <= 2
+    assert sum(len(request[2]["models"]) for request in live_requests) == 6
+    rsc = get_remote_storage_controller()
+    for i in range(6):
+        assert rsc.find_created_model_in_remote_hosts(f"bulk{i}") == "10.1.0.2:80"
+
+    requests.clear()
+    model_ids = ["bulk0", "unknown", "bulk1"]
+    response = client.delete(endpoint + "bulk", json={"model_ids": model_ids})
+    assert response.status_code == 207
+    results = response.json()["results"]
+    assert [result["status_code"] for result in results] == [200, 404, 200]
+    assert requests == [("DELETE", "10.1.0.2", {"model_ids": ["bulk0", "bulk1"]})]
+    assert rsc.find_created_model_in_remote_hosts("bulk0") is None
+    assert rsc.find_created_model_in_remote_hosts("bulk2") == "10.1.0.2:80"
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_bulk_forward_failover(
+    client: TestClient, endpoint: str, failover_remote_hosts: Any, monkeypatch: Any
+) -> None:
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        requests.append(request.url.host)
+        if request.url.host == "10.1.0.2":
+            return httpx.Response(503, json={"detail": "Busy"})
+        results = [
+            {"index": index, "status_code": 201, "model_id": model["model_specification"]["name"]}
+            for index, model in enumerate(body["models"])
+        ]
+        return httpx.Response(207, json={"results": results})
+
+    override_http_client(handler)
+    models: List[Dict[str, Any]] = [
+        {"model_type": "failover", "model_specification": {"name": f"bulk{i}"}} for i in range(6)
+    ]
+    # Groups that reached their host may have been created partly, so they do not fail over
+    response = client.post(endpoint + "bulk", json={"models": models})
+    status_codes = [result["status_code"] for result in response.json()["results"]]
+    assert sorted(set(status_codes)) == [201, 503]
+    assert sorted(requests) == ["10.1.0.1", "10.1.0.2"]
+
+    # Hosts that do not allow a request (e.g., a half open circuit already running its trial
+    # request) are not sent a group; it fails over to the next host
+    requests.clear()
+    monitor = get_health_monitor()
+    allow_request = monitor.allow_request
+    monkeypatch.setattr(
+        monitor,
+        "allow_request",
+        lambda address: address != "10.1.0.2:80" and allow_request(address),
+    )
+    response = client.post(endpoint + "bulk", json={"models": models})
+    assert [result["status_code"] for result in response.json()["results"]] == [201] * 6
+    assert set(requests) == {"10.1.0.1"}
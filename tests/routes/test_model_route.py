@@ -1,4 +1,10 @@
+import asyncio
+import json
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List
+
 import mongomock  # type: ignore
+import numpy as np
 import pytest
 from fastapi.testclient import TestClient
 
@@ -10,11 +16,22 @@ from cs_insights_prediction_endpoint.routes.route_model import (
     ModelDeletionRequest,
     ModelFunctionRequest,
     ModelUpdateRequest,
+    iter_ndjson,
+)
+from cs_insights_prediction_endpoint.utils.array_encoding import (
+    RAW_MEDIA_TYPE,
+    SHAPE_HEADER,
+    decode_raw,
 )
+from cs_insights_prediction_endpoint.utils.job_controller import get_job_controller
+from cs_insights_prediction_endpoint.utils.settings import get_settings
 from cs_insights_prediction_endpoint.utils.storage_controller import (
     get_storage_controller,
 )
 
+# Models save their states to a temporary directory
+pytestmark = pytest.mark.usefixtures("save_directory")
+
 
 @pytest.fixture()
 def client() -> TestClient:
@@ -256,3 +273,428 @@ def test_model_delete(
     assert deleted_model_id == mdr.model_id
     failing_response = client.delete(endpoint + "thisWillNeverEverExist")
     assert failing_response.status_code == 404
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_model_cache_statistics(client: TestClient, endpoint: str) -> None:
+    """Test for getting the statistics of the lazy model cache
+
+    Arguments:
+        client (TestClient): The current test client
+        endpoint (str): Endpoint to query
+    """
+    response = client.get(endpoint + "cache")
+    assert response.status_code == 200
+    assert set(response.json()) == {
+        "hits",
+        "misses",
+        "evictions",
+        "resident_models",
+        "resident_bytes",
+    }
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_model_memory_report(client: TestClient, endpoint: str) -> None:
+    """Test for getting the memory reports of all loaded models
+
+    Arguments:
+        client (TestClient): The current test client
+        endpoint (str): Endpoint to query
+    """
+    models = client.get(endpoint).json()
+    response = client.get(endpoint + "memory")
+    assert response.status_code == 200
+    response_json = response.json()
+    assert set(response_json["models"]) <= set(models["models"])
+    for report in response_json["models"].values():
+        assert "private_bytes" in report
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_model_function_predict_batch(client: TestClient, endpoint: str) -> None:
+    """Test for classifying a batch of documents through the function call endpoint
+
+    Arguments:
+        client (TestClient): The current test client
+        endpoint (str): Endpoint to query
+    """
+    test_model_id = client.post(
+        endpoint,
+        json=ModelCreationRequest(
+            model_type="lda", model_specification={"created_by": "Test"}
+        ).dict(),
+    ).json()["model_id"]
+    generic_input = GenericInputModel(
+        function_call="predictBatch",
+        input_data={"documents": [[[0, 1], [1, 2]], [[2, 1]]], "top_k": 2},
+    )
+    response = client.post(endpoint + test_model_id, json=generic_input.dict())
+    assert response.status_code == 200
+    output_data = response.json()["output_data"]
+    assert len(output_data["topics"]) == 2
+    assert all(len(topics) <= 2 for topics in output_data["topics"])
+    generic_input.input_data["top_k"] = 0
+    response = client.post(endpoint + test_model_id, json=generic_input.dict())
+    assert response.status_code == 400
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_model_function_invalid_input(client: TestClient, endpoint: str) -> None:
+    """Test for a function call that rejects its input
+
+    Arguments:
+        client (TestClient): The current test client
+        endpoint (str): Endpoint to query
+    """
+    test_model_id = client.post(
+        endpoint,
+        json=ModelCreationRequest(
+            model_type="lda", model_specification={"created_by": "Test"}
+        ).dict(),
+    ).json()["model_id"]
+    generic_input = GenericInputModel(
+        function_call="predictText", input_data={"title": "Attention is all you need"}
+    )
+    response = client.post(endpoint + test_model_id, json=generic_input.dict())
+    assert response.status_code == 400
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_model_jobs(client: TestClient, endpoint: str) -> None:
+    """Test for running function calls asynchronously
+
+    Arguments:
+        client (TestClient): The current test client
+        endpoint (str): Endpoint to query
+    """
+    test_model_id = client.post(
+        endpoint,
+        json=ModelCreationRequest(
+            model_type="lda", model_specification={"created_by": "Test"}
+        ).dict(),
+    ).json()["model_id"]
+    topics = client.post(
+        endpoint + test_model_id, json={"function_call": "getTopics", "input_data": {}}
+    ).json()
+    generic_input = GenericInputModel(
+        function_call="train", input_data={"input_object": {"corpus": [[[0, 5], [1, 3]]] * 20}}
+    )
+    response = client.post(endpoint + test_model_id + "/jobs", json=generic_input.dict())
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+    assert response.headers["location"].endswith(f"/models/{test_model_id}/jobs/{job_id}")
+    # The job runs on a snapshot, so unloading the model (e.g., by eviction) does not affect it
+    model = get_storage_controller().models[test_model_id]
+    assert get_job_controller().jobs[job_id].model is not model
+    model.unload()
+
+    deadline = time.time() + 60
+    status = client.get(endpoint + test_model_id + "/jobs/" + job_id).json()
+    while status["state"] in ("queued", "running") and time.time() < deadline:
+        time.sleep(0.1)
+        status = client.get(endpoint + test_model_id + "/jobs/" + job_id).json()
+    assert status["state"] == "succeeded"
+    assert status["running_seconds"] > 0
+
+    response = client.get(endpoint + test_model_id + "/jobs/" + job_id + "/result")
+    assert response.status_code == 200
+    # The trained model replaced the model of the endpoint as its next version
+    assert client.get(endpoint + test_model_id + "/versions").json()["version"] == 1
+    assert (
+        client.post(
+            endpoint + test_model_id, json={"function_call": "getTopics", "input_data": {}}
+        ).json()
+        != topics
+    )
+    assert client.delete(endpoint + test_model_id + "/jobs/" + job_id).status_code == 409
+
+    statistics = client.get(endpoint + "jobs").json()
+    assert statistics["succeeded"] >= 1
+    assert statistics["queued"] == 0
+
+    generic_input = GenericInputModel(function_call="unknown", input_data={})
+    response = client.post(endpoint + test_model_id + "/jobs", json=generic_input.dict())
+    assert response.status_code == 404
+    assert client.get(endpoint + test_model_id + "/jobs/1234").status_code == 404
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_model_jobs_lda_vis_rollback(client: TestClient, endpoint: str) -> None:
+    """Test for restoring the original model after a getLDAvis job replaced it
+
+    Arguments:
+        client (TestClient): The current test client
+        endpoint (str): Endpoint to query
+    """
+    test_model_id = client.post(
+        endpoint,
+        json=ModelCreationRequest(
+            model_type="lda", model_specification={"created_by": "Test"}
+        ).dict(),
+    ).json()["model_id"]
+    generic_input = GenericInputModel(
+        function_call="getLDAvis",
+        input_data={
+            "data": [{"title": "Topic models for papers", "abstractText": "Latent topics"}],
+            "num_topics": 2,
+            "passes": 1,
+        },
+    )
+    job_id = client.post(endpoint + test_model_id + "/jobs", json=generic_input.dict()).json()[
+        "job_id"
+    ]
+    deadline = time.time() + 60
+    status = client.get(endpoint + test_model_id + "/jobs/" + job_id).json()
+    while status["state"] in ("queued", "running") and time.time() < deadline:
+        time.sleep(0.1)
+        status = client.get(endpoint + test_model_id + "/jobs/" + job_id).json()
+    assert status["state"] == "succeeded"
+
+    def get_num_topics() -> str:
+        return str(
+            client.post(
+                endpoint + test_model_id, json={"function_call": "getNumTopics", "input_data": {}}
+            ).json()["output_data"]["getNumTopics"]
+        )
+
+    assert get_num_topics() == "2"
+    # The job saved its model as a new version and left the original one untouched
+    response = client.post(endpoint + test_model_id + "/rollback", json={"version": 0})
+    assert response.status_code == 200
+    assert get_num_topics() == "10"
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_model_create_unknown_engine(client: TestClient, endpoint: str) -> None:
+    """Test for creating a model with invalid creation parameters
+
+    Arguments:
+        client (TestClient): The current test client
+        endpoint (str): Endpoint to query
+    """
+    response = client.post(
+        endpoint,
+        json=ModelCreationRequest(
+            model_type="lda",
+            model_specification={
+                "created_by": "Test",
+                "creation_parameters": {"engine": "unknown"},
+            },
+        ).dict(),
+    )
+    assert response.status_code == 400
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_model_train_stream(client: TestClient, endpoint: str) -> None:
+    """Test for training a model from a NDJSON corpus
+
+    Arguments:
+        client (TestClient): The current test client
+        endpoint (str): Endpoint to query
+    """
+    test_model_id = client.post(
+        endpoint,
+        json=ModelCreationRequest(
+            model_type="lda", model_specification={"created_by": "Test"}
+        ).dict(),
+    ).json()["model_id"]
+    topics = client.post(
+        endpoint + test_model_id, json={"function_call": "getTopics", "input_data": {}}
+    ).json()
+
+    def documents() -> Iterator[bytes]:
+        for i in range(10):
+            yield f"[[{i % 12}, 2], [{(i + 1) % 12}, 1]]\n".encode()
+        yield b"\n[[3, 1]]"
+
+    response = client.post(
+        endpoint + test_model_id + "/train",
+        params={"chunk_size": 4},
+        data=documents(),
+        headers={"content-type": "application/x-ndjson"},
+    )
+    assert response.status_code == 200
+    assert response.json() == {"documents": 11, "chunks": 3}
+    assert (
+        client.post(
+            endpoint + test_model_id, json={"function_call": "getTopics", "input_data": {}}
+        ).json()
+        != topics
+    )
+
+    # All chunks are trained on a copy, which becomes one new version
+    assert client.get(endpoint + test_model_id + "/versions").json() == {
+        "version": 1,
+        "versions": [0, 1],
+    }
+
+    response = client.post(endpoint + test_model_id + "/train", data=b"[[0, 1]]\n[[0, 1]")
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid json in line 2"
+    # A failed training does not change the model
+    assert client.get(endpoint + test_model_id + "/versions").json()["version"] == 1
+    assert client.post(endpoint + "1234/train", data=b"[[0, 1]]").status_code == 404
+
+    # The model can be rolled back to a saved version
+    response = client.post(endpoint + test_model_id + "/rollback", json={"version": 0})
+    assert response.status_code == 200
+    assert response.json() == {"version": 0, "versions": [0, 1]}
+    assert (
+        client.post(
+            endpoint + test_model_id, json={"function_call": "getTopics", "input_data": {}}
+        ).json()
+        == topics
+    )
+    response = client.post(endpoint + test_model_id + "/rollback", json={"version": 5})
+    assert response.status_code == 404
+    assert client.post(endpoint + "1234/rollback", json={"version": 0}).status_code == 404
+    assert client.get(endpoint + "1234/versions").status_code == 404
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_model_function_get_top_words(client: TestClient, endpoint: str) -> None:
+    """Test for listing the top words of the topics
+
+    Arguments:
+        client (TestClient): The current test client
+        endpoint (str): Endpoint to query
+    """
+    test_model_id = client.post(
+        endpoint,
+        json=ModelCreationRequest(
+            model_type="lda", model_specification={"created_by": "Test"}
+        ).dict(),
+    ).json()["model_id"]
+    generic_input = GenericInputModel(
+        function_call="getTopWords", input_data={"top_n": 5, "offset": 2, "limit": 3}
+    )
+    response = client.post(endpoint + test_model_id, json=generic_input.dict())
+    assert response.status_code == 200
+    output_data = response.json()["output_data"]
+    assert output_data["num_topics"] == 10
+    assert [topic["topic"] for topic in output_data["topics"]] == [2, 3, 4]
+    assert all(len(topic["words"]) == 5 for topic in output_data["topics"])
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_model_function_binary_output(client: TestClient, endpoint: str) -> None:
+    """Test for returning array outputs in a binary encoding
+
+    Arguments:
+        client (TestClient): The current test client
+        endpoint (str): Endpoint to query
+    """
+    test_model_id = client.post(
+        endpoint,
+        json=ModelCreationRequest(
+            model_type="lda", model_specification={"created_by": "Test"}
+        ).dict(),
+    ).json()["model_id"]
+    generic_input = GenericInputModel(function_call="getTopics", input_data={})
+    response = client.post(endpoint + test_model_id, json=generic_input.dict())
+    assert response.headers["content-type"] == "application/json"
+    topics = json.loads(response.json()["output_data"]["getTopics"])
+
+    response = client.post(
+        endpoint + test_model_id,
+        json=generic_input.dict(),
+        headers={"accept": RAW_MEDIA_TYPE},
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == RAW_MEDIA_TYPE
+    assert response.headers[SHAPE_HEADER] == "10,12"
+    assert np.allclose(decode_raw(response.content), topics)
+
+    # Outputs that are no arrays are returned as json
+    generic_input = GenericInputModel(function_call="getNumTopics", input_data={})
+    response = client.post(
+        endpoint + test_model_id,
+        json=generic_input.dict(),
+        headers={"accept": RAW_MEDIA_TYPE},
+    )
+    assert response.json() == {"output_data": {"getNumTopics": "10"}}
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_model_function_get_lda_vis(client: TestClient, endpoint: str) -> None:
+    """Test for returning the pre-encoded output of pyLDAvis
+
+    Arguments:
+        client (TestClient): The current test client
+        endpoint (str): Endpoint to query
+    """
+    test_model_id = client.post(
+        endpoint,
+        json=ModelCreationRequest(
+            model_type="lda", model_specification={"created_by": "Test"}
+        ).dict(),
+    ).json()["model_id"]
+    generic_input = GenericInputModel(
+        function_call="getLDAvis",
+        input_data={
+            "data": [
+                {"title": "Attention is all you need", "abstractText": "Transformer attention"},
+                {"title": "Topic models for papers", "abstractText": None},
+            ],
+            "num_topics": 2,
+            "passes": 1,
+        },
+    )
+    response = client.post(endpoint + test_model_id, json=generic_input.dict())
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    output_data = response.json()["output_data"]
+    assert len(output_data["topic.order"]) == 2
+    assert "mdsDat" in output_data
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_model_bulk_create_and_delete(client: TestClient, endpoint: str) -> None:
+    """Test for creating and deleting many models with one request each
+
+    Arguments:
+        client (TestClient): The current test client
+        endpoint (str): Endpoint to query
+    """
+    models: List[Dict[str, Any]] = [
+        {"model_type": "lda", "model_specification": {"name": "venue-a", "created_by": "Test"}},
+        {"model_type": "unknown", "model_specification": {"created_by": "Test"}},
+        {"model_type": "lda", "model_specification": {"name": "no creator"}},
+        {"model_type": "lda", "model_specification": {"name": "venue-b", "created_by": "Test"}},
+    ]
+    response = client.post(endpoint + "bulk", json={"models": models})
+    assert response.status_code == 207
+    results = response.json()["results"]
+    assert [result["index"] for result in results] == [0, 1, 2, 3]
+    assert [result["status_code"] for result in results] == [201, 404, 400, 201]
+    model_ids = [results[0]["model_id"], results[3]["model_id"]]
+    sc = get_storage_controller()
+    assert sc.get_model(model_ids[0]).name == "venue-a"  # type: ignore
+    assert sc.model_db.count_documents({"id": {"$in": model_ids}}) == 2
+
+    response = client.delete(endpoint + "bulk", json={"model_ids": model_ids + ["unknown"]})
+    assert response.status_code == 207
+    results = response.json()["results"]
+    assert [result["status_code"] for result in results] == [200, 200, 404]
+    assert [result["model_id"] for result in results] == model_ids + ["unknown"]
+    assert sc.get_model(model_ids[0]) is None
+    assert sc.model_db.count_documents({"id": {"$in": model_ids}}) == 0
+
+    too_many = get_settings().bulk_max_items + 1
+    response = client.delete(endpoint + "bulk", json={"model_ids": ["unknown"] * too_many})
+    assert response.status_code == 400
+
+
+def test_iter_ndjson() -> None:
+    """Test for parsing NDJSON lines split across chunks of the body"""
+
+    async def chunks() -> AsyncIterator[bytes]:
+        for data in [b"[[0, 1]]\n[[1", b", 2]", b", [2", b", 3]]\n\n", b"[[3, 4]]"]:
+            yield data
+
+    async def parse() -> List[Any]:
+        return [document async for document in iter_ndjson(chunks())]
+
+    assert asyncio.run(parse()) == [[[0, 1]], [[1, 2], [2, 3]], [[3, 4]]]
@@ -0,0 +1,67 @@
+"""Test the binary encodings of arrays."""
+import numpy as np
+import pytest
+
+from cs_insights_prediction_endpoint.utils.array_encoding import (
+    ARROW_MEDIA_TYPE,
+    RAW_MEDIA_TYPE,
+    decode_raw,
+    encode_array,
+    get_shape_header,
+    negotiate_array_media_type,
+)
+
+
+def test_negotiate_array_media_type() -> None:
+    assert negotiate_array_media_type(None) is None
+    assert negotiate_array_media_type("application/json") is None
+    assert negotiate_array_media_type("*/*") is None
+    assert negotiate_array_media_type("application/octet-stream") == RAW_MEDIA_TYPE
+    # The type with the highest quality is chosen; JSON wins ties
+    assert negotiate_array_media_type("application/json, application/octet-stream;q=0.9") is None
+    assert (
+        negotiate_array_media_type("application/json;q=1, application/octet-stream;q=0.1") is None
+    )
+    assert negotiate_array_media_type("application/json, application/octet-stream") is None
+    assert (
+        negotiate_array_media_type("application/json;q=0.5, application/octet-stream")
+        == RAW_MEDIA_TYPE
+    )
+    assert negotiate_array_media_type("*/*;q=0.1, application/octet-stream") == RAW_MEDIA_TYPE
+    # The most specific range gives the quality of JSON
+    assert (
+        negotiate_array_media_type("*/*, application/json;q=0.1, application/octet-stream;q=0.5")
+        == RAW_MEDIA_TYPE
+    )
+    assert negotiate_array_media_type("application/octet-stream;q=0") is None
+    assert negotiate_array_media_type("application/octet-stream; q=0.000") is None
+    assert negotiate_array_media_type("application/octet-stream;Q=0.0") is None
+    assert negotiate_array_media_type("application/octet-stream;q=0.001") == RAW_MEDIA_TYPE
+
+
+def test_raw_encoding() -> None:
+    array = np.arange(12, dtype=np.float64).reshape(3, 4) / 7
+    data = encode_array(array, RAW_MEDIA_TYPE)
+    assert len(data) == 4 + 2 * 8 + 12 * 4
+    assert data[:4] == b"\x02\x00\x00\x00"
+    decoded = decode_raw(data)
+    assert decoded.dtype == np.float32
+    assert decoded.shape == (3, 4)
+    assert np.allclose(decoded, array)
+    assert decode_raw(encode_array(np.array([1.5]), RAW_MEDIA_TYPE)).tolist() == [1.5]
+    assert get_shape_header(array) == "3,4"
+
+
+def test_arrow_encoding() -> None:
+    pyarrow = pytest.importorskip("pyarrow")
+    assert negotiate_array_media_type(ARROW_MEDIA_TYPE) == ARROW_MEDIA_TYPE
+
+    array = np.arange(12, dtype=np.float64).reshape(3, 4) / 7
+    table = pyarrow.ipc.open_stream(encode_array(array, ARROW_MEDIA_TYPE)).read_all()
+    assert table.schema.metadata[b"shape"] == b"3,4"
+    values = table.column("values").combine_chunks().flatten().to_numpy()
+    assert values.dtype == np.float32
+    assert np.allclose(values.reshape(3, 4), array)
+
+    table = pyarrow.ipc.open_stream(encode_array(np.ones(3), ARROW_MEDIA_TYPE)).read_all()
+    assert table.column("values").to_pylist() == [1.0, 1.0, 1.0]
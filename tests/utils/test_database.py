@@ -0,0 +1,79 @@
+"""Test the database access shared by the storage controllers."""
+import threading
+
+import mongomock  # type: ignore
+import pytest
+
+from cs_insights_prediction_endpoint.models.generic_model import GenericModel
+from cs_insights_prediction_endpoint.models.model_hosts import RemoteHost
+from cs_insights_prediction_endpoint.utils.database import (
+    close_mongo_clients,
+    get_mongo_client,
+    run_in_database_executor,
+)
+from cs_insights_prediction_endpoint.utils.remote_storage_controller import (
+    RemoteStorageController,
+)
+from cs_insights_prediction_endpoint.utils.settings import get_settings
+from cs_insights_prediction_endpoint.utils.storage_controller import StorageController
+
+
+@pytest.fixture
+def anyio_backend() -> str:
+    return "asyncio"
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_shared_mongo_client() -> None:
+    settings = get_settings()
+    client = get_mongo_client(settings)
+    assert get_mongo_client(settings.copy()) is client
+    assert StorageController(settings).model_client is client
+    assert RemoteStorageController(settings).remote_host_client is client
+    close_mongo_clients()
+    assert get_mongo_client(settings) is not client
+
+
+@pytest.mark.anyio
+async def test_run_in_database_executor() -> None:
+    thread_name = await run_in_database_executor(lambda: threading.current_thread().name)
+    assert thread_name.startswith("database")
+    assert thread_name != threading.current_thread().name
+
+
+@pytest.mark.anyio
+async def test_async_controller_methods() -> None:
+    with mongomock.patch(servers=(("127.0.0.1", 27017),)):
+        sc = StorageController(get_settings())
+        rsc = RemoteStorageController(
+            get_settings().copy(update={"remote_host_refresh_interval": 0})
+        )
+    model = GenericModel(
+        name="Generic",
+        created_by="Alpha Tester",
+        description="",
+        creation_parameters={},
+        function_calls={},
+        type_of_model="lda",
+    )
+    assert await sc.add_model_async(model) == model.id
+    assert sc.model_db.find_one({"id": model.id}) is not None
+    await sc.del_model_async(model.id)
+    assert sc.get_model(model.id) is None
+    with pytest.raises(KeyError):
+        await sc.del_model_async(model.id)
+
+    host = RemoteHost(ip="10.0.2.1", port="80", models=["lda"], created_models=[])
+    assert await rsc.add_remote_host_async(host) is host
+    await rsc.add_model_to_created_model_list_async("10.0.2.1", "a")
+    assert rsc.find_created_model_in_remote_hosts("a") == "10.0.2.1:80"
+    document = rsc.remote_host_db.find_one({"ip": "10.0.2.1"})
+    assert document is not None and document["created_models"] == ["a"]
+    await rsc.remove_model_from_created_model_list_async("10.0.2.1", "a")
+    assert rsc.find_created_model_in_remote_hosts("a") is None
+    # Own changes are applied again without effect
+    assert await rsc.refresh_registry_async()
+    assert rsc.find_created_model_in_remote_hosts("a") is None
+    assert not await rsc.refresh_registry_async()
+    assert await rsc.remove_remote_host_async("10.0.2.1")
+    assert not await rsc.remove_remote_host_async("10.0.2.1")
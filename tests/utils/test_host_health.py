@@ -0,0 +1,110 @@
+"""Test the health checks and circuit breakers of remote hosts."""
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from cs_insights_prediction_endpoint.utils.host_health import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    HealthMonitor,
+)
+from cs_insights_prediction_endpoint.utils.settings import get_settings
+
+
+@pytest.fixture
+def anyio_backend() -> str:
+    # The prober uses asyncio (like the app)
+    return "asyncio"
+
+
+def test_circuit_breaker() -> None:
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    assert breaker.state == CLOSED
+    breaker.record_failure()
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow_request()
+    assert not breaker.is_available()
+    # After the reset timeout a single trial request is let through
+    breaker.opened_at = time.monotonic() - 61
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+    # A failed trial opens the circuit again
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    breaker.opened_at = time.monotonic() - 61
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.consecutive_failures == 0
+
+
+def test_health_monitor_record() -> None:
+    monitor = HealthMonitor(get_settings())
+    assert monitor.allow_request("10.0.0.1:80")
+    monitor.record("10.0.0.1:80", True, 0.1)
+    monitor.record("10.0.0.1:80", True, 0.2)
+    for _ in range(monitor.failure_threshold):
+        monitor.record("10.0.0.2:80", False)
+    assert monitor.get_unavailable() == {"10.0.0.2:80"}
+    assert not monitor.allow_request("10.0.0.2:80")
+    report = monitor.get_report()
+    assert report["10.0.0.1:80"]["state"] == CLOSED
+    assert report["10.0.0.1:80"]["requests"] == 2
+    assert 100 < report["10.0.0.1:80"]["latency_ms"] < 200
+    assert report["10.0.0.2:80"]["state"] == OPEN
+    assert report["10.0.0.2:80"]["error_rate"] > 0
+    monitor.forget(["10.0.0.1:80"])
+    assert list(monitor.get_report()) == ["10.0.0.1:80"]
+
+
+@pytest.mark.anyio
+async def test_health_monitor_probe() -> None:
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.host == "10.0.0.2":
+            raise httpx.ConnectError("Connection refused", request=request)
+        assert request.url.path.endswith("/models/jobs")
+        return httpx.Response(200, json={"workers": 4, "running": 1, "queued": 3})
+
+    monitor = HealthMonitor(get_settings())
+    monitor.record("10.0.0.3:80", False)
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    for _ in range(monitor.failure_threshold):
+        await monitor.probe_all(client, ["10.0.0.1:80", "10.0.0.2:80"])
+    await client.aclose()
+    report = monitor.get_report()
+    # Removed hosts are forgotten
+    assert set(report) == {"10.0.0.1:80", "10.0.0.2:80"}
+    assert report["10.0.0.1:80"]["free_workers"] == 3
+    assert report["10.0.0.1:80"]["queued_jobs"] == 3
+    assert report["10.0.0.1:80"]["last_checked"] is not None
+    assert report["10.0.0.2:80"]["state"] == OPEN
+    # A successful probe closes the circuit of a recovered host
+    client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(404)))
+    await monitor.probe(client, "10.0.0.2:80")
+    await client.aclose()
+    assert monitor.get_report()["10.0.0.2:80"]["state"] == CLOSED
+
+
+@pytest.mark.anyio
+async def test_health_monitor_run() -> None:
+    probed = asyncio.Event()
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        probed.set()
+        return httpx.Response(200, json={})
+
+    monitor = HealthMonitor(get_settings())
+    monitor.check_interval = 0.01
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    task = asyncio.create_task(monitor.run(lambda: client, lambda: ["10.0.0.1:80"]))
+    await asyncio.wait_for(probed.wait(), timeout=5)
+    task.cancel()
+    await client.aclose()
+    assert monitor.get_report()["10.0.0.1:80"]["state"] == CLOSED
@@ -0,0 +1,33 @@
+"""Test the shared http client."""
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from cs_insights_prediction_endpoint.utils.http_client import (
+    create_http_client,
+    get_http_client,
+)
+from cs_insights_prediction_endpoint.utils.settings import get_settings
+
+
+@pytest.mark.anyio
+async def test_create_http_client() -> None:
+    settings = get_settings()
+    client = create_http_client(settings)
+    assert isinstance(client, httpx.AsyncClient)
+    assert client.timeout.connect == settings.forward_connect_timeout
+    assert client.timeout.read == settings.forward_timeout
+    await client.aclose()
+
+
+@pytest.mark.anyio
+async def test_get_http_client_reuses_and_recreates() -> None:
+    request = SimpleNamespace(app=SimpleNamespace(state=SimpleNamespace()))
+    client = get_http_client(request)  # type: ignore
+    assert get_http_client(request) is client  # type: ignore
+    await client.aclose()
+    recreated = get_http_client(request)  # type: ignore
+    assert recreated is not client
+    assert not recreated.is_closed
+    await recreated.aclose()
@@ -0,0 +1,315 @@
+"""Test the job controller."""
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Iterator
+
+import mongomock  # type: ignore
+import numpy as np
+import pytest
+from gensim.test.utils import common_corpus  # type: ignore
+from pymongo.collection import Collection
+
+from cs_insights_prediction_endpoint.models.lda_model import LdaModelWrapper
+from cs_insights_prediction_endpoint.utils.job_controller import (
+    HostSlots,
+    Job,
+    JobController,
+    JobQueueFullError,
+    decode_output,
+    encode_output,
+)
+from cs_insights_prediction_endpoint.utils.json_response import RawJSON
+from cs_insights_prediction_endpoint.utils.storage_controller import VersionConflictError
+
+# Models save their states to a temporary directory
+pytestmark = pytest.mark.usefixtures("save_directory")
+
+
+@pytest.fixture
+def dummy_lda_model() -> LdaModelWrapper:
+    """Provides a dummy LDA model
+
+    Returns:
+        LdaModelWrapper: A model trained on common_corpus
+    """
+    return LdaModelWrapper(name="Jobs", created_by="Alpha Tester", type_of_model="lda")
+
+
+@pytest.fixture
+def dummy_job_controller() -> Iterator[JobController]:
+    """Provides a job controller with a single worker
+
+    Yields:
+        JobController: A job controller allowing one queued job
+    """
+    job_controller = JobController(workers=1, max_queued=1, history_size=2)
+    yield job_controller
+    job_controller.shutdown()
+
+
+def wait_for(job: Job, timeout: float = 60) -> None:
+    deadline = time.time() + timeout
+    while not job.is_finished() and time.time() < deadline:
+        time.sleep(0.05)
+
+
+def test_job_controller_train(
+    dummy_job_controller: JobController, dummy_lda_model: LdaModelWrapper
+) -> None:
+    topics = dummy_lda_model.get_topics()
+    job = dummy_job_controller.submit(
+        dummy_lda_model, "train", {"input_object": {"corpus": common_corpus * 50}}
+    )
+    # The job does not block and the model keeps serving requests until the job is done
+    assert dummy_lda_model.get_topics() == topics
+    wait_for(job)
+    assert job.state == "succeeded"
+    assert dummy_lda_model.get_topics() != topics
+    status = dummy_job_controller.get_status(job)
+    assert status["running_seconds"] > 0
+    assert status["position"] is None
+
+    # Functions not changing the model return their output only
+    job = dummy_job_controller.submit(dummy_lda_model, "getNumTopics", {})
+    wait_for(job)
+    assert job.output == 10
+    statistics = dummy_job_controller.get_statistics()
+    assert statistics["succeeded"] == 2
+    assert statistics["queued"] == 0
+    assert statistics["running"] == 0
+    assert statistics["max_running_seconds"] > 0
+
+    with pytest.raises(KeyError):
+        dummy_job_controller.submit(dummy_lda_model, "unknown", {})
+
+
+def test_job_controller_failure(
+    dummy_job_controller: JobController, dummy_lda_model: LdaModelWrapper
+) -> None:
+    job = dummy_job_controller.submit(dummy_lda_model, "predictText", {"title": "Test"})
+    wait_for(job)
+    assert job.state == "failed"
+    assert job.error_status == 400
+    job = dummy_job_controller.submit(dummy_lda_model, "train", {"unknown": 1})
+    wait_for(job)
+    assert job.state == "failed"
+    assert job.error_status == 500
+    assert job.error is not None and job.error.startswith("TypeError")
+
+
+def test_job_controller_update_conflict(
+    dummy_job_controller: JobController, dummy_lda_model: LdaModelWrapper
+) -> None:
+    def reject_update(processing_model: Any) -> None:
+        raise VersionConflictError("The model changed")
+
+    topics = dummy_lda_model.get_topics()
+    job = dummy_job_controller.submit(
+        dummy_lda_model,
+        "train",
+        {"input_object": {"corpus": common_corpus}},
+        on_update=reject_update,
+    )
+    wait_for(job)
+    assert job.state == "failed"
+    assert job.error_status == 409
+    assert job.error == "The model changed"
+    assert dummy_lda_model.get_topics() == topics
+
+
+def test_job_controller_queue(
+    dummy_job_controller: JobController, dummy_lda_model: LdaModelWrapper
+) -> None:
+    running = dummy_job_controller.submit(
+        dummy_lda_model, "train", {"input_object": {"corpus": common_corpus * 200}}
+    )
+    queued = dummy_job_controller.submit(dummy_lda_model, "getNumTopics", {})
+    assert running.state == "running"
+    assert queued.state == "queued"
+    assert dummy_job_controller.get_status(queued)["position"] == 0
+    with pytest.raises(JobQueueFullError):
+        dummy_job_controller.submit(dummy_lda_model, "getNumTopics", {})
+
+    assert dummy_job_controller.cancel(queued) is True
+    assert queued.state == "cancelled"
+    topics = dummy_lda_model.get_topics()
+    assert dummy_job_controller.cancel(running) is True
+    wait_for(running)
+    time.sleep(0.5)
+    # The result of a cancelled job is discarded
+    assert dummy_lda_model.get_topics() == topics
+    assert dummy_job_controller.cancel(running) is False
+    assert dummy_job_controller.get_statistics()["cancelled"] == 2
+
+
+def test_job_controller_serializes_model_jobs(
+    dummy_job_controller: JobController, dummy_lda_model: LdaModelWrapper
+) -> None:
+    dummy_job_controller.workers = 2
+    first = dummy_job_controller.submit(
+        dummy_lda_model, "train", {"input_object": {"corpus": common_corpus * 50}}
+    )
+    second = dummy_job_controller.submit(
+        dummy_lda_model, "train", {"input_object": {"corpus": common_corpus}}
+    )
+    # The second job has to wait, since it trains the result of the first job
+    assert second.state == "queued"
+    wait_for(first)
+    wait_for(second)
+    assert second.state == "succeeded"
+    assert second.started_at is not None and first.finished_at is not None
+    assert second.started_at >= first.finished_at
+    # Only history_size finished jobs are kept
+    dummy_job_controller.submit(dummy_lda_model, "getNumTopics", {})
+    wait_for(dummy_job_controller.jobs[list(dummy_job_controller.jobs)[-1]])
+    assert dummy_job_controller.get_job(first.id) is None
+
+
+def test_job_controller_replaces_broken_pool(
+    dummy_job_controller: JobController, dummy_lda_model: LdaModelWrapper
+) -> None:
+    broken = dummy_job_controller.get_executor()
+    # A killed worker breaks the pool; jobs submitted afterwards fail to start
+    broken._broken = "A worker died"  # type: ignore
+    job = dummy_job_controller.submit(dummy_lda_model, "getNumTopics", {})
+    wait_for(job)
+    assert job.state == "succeeded"
+    assert dummy_job_controller.executor is not broken
+    # The broken pool was shut down instead of leaking its processes
+    assert broken._shutdown_thread  # type: ignore
+
+
+def test_job_controller_slow_update(
+    dummy_job_controller: JobController, dummy_lda_model: LdaModelWrapper
+) -> None:
+    installing = threading.Event()
+    installed = threading.Event()
+
+    def install_slowly(processing_model: Any) -> None:
+        installing.set()
+        assert installed.wait(timeout=60)
+        dummy_lda_model.processing_model = processing_model
+
+    slow = dummy_job_controller.submit(
+        dummy_lda_model,
+        "train",
+        {"input_object": {"corpus": common_corpus}},
+        on_update=install_slowly,
+    )
+    assert installing.wait(timeout=60)
+    # Jobs of other models finish while the update is saved
+    other_model = LdaModelWrapper(name="Other", created_by="Alpha Tester", type_of_model="lda")
+    job = dummy_job_controller.submit(other_model, "getNumTopics", {})
+    wait_for(job)
+    assert job.state == "succeeded"
+    # Jobs of the model wait for the update
+    waiting = dummy_job_controller.submit(dummy_lda_model, "getNumTopics", {})
+    assert slow.state == "running"
+    assert waiting.state == "queued"
+    installed.set()
+    wait_for(slow)
+    wait_for(waiting)
+    assert slow.state == "succeeded"
+    assert waiting.state == "succeeded"
+
+
+def test_job_controller_shared_state(dummy_lda_model: LdaModelWrapper) -> None:
+    # Two worker processes of a host share the jobs through the database
+    collection: Collection = mongomock.MongoClient()["models"]["models_jobs"]
+    owner = JobController(workers=1, max_queued=1, history_size=2, collection=collection)
+    other = JobController(workers=1, max_queued=1, history_size=2, collection=collection)
+    try:
+        job = owner.submit(dummy_lda_model, "getNumTopics", {})
+        wait_for(job)
+        shared = other.get_job(job.id)
+        assert shared is not None and shared is not job
+        assert shared.state == "succeeded"
+        assert shared.output == 10
+        assert other.get_job("unknown") is None
+
+        running = owner.submit(
+            dummy_lda_model, "train", {"input_object": {"corpus": common_corpus * 200}}
+        )
+        queued = owner.submit(dummy_lda_model, "getNumTopics", {})
+        # The queue limit applies to all processes of the host
+        with pytest.raises(JobQueueFullError):
+            other.submit(dummy_lda_model, "getNumTopics", {})
+        shared = other.get_job(queued.id)
+        assert shared is not None
+        assert other.get_status(shared)["state"] == "queued"
+        assert other.get_status(shared)["position"] is None
+        assert other.cancel(shared) is True
+        assert other.cancel(shared) is False
+        wait_for(running)
+        # The owner skipped the job cancelled by the other process
+        assert queued.state == "cancelled"
+        assert queued.started_at is None
+    finally:
+        owner.shutdown()
+        other.shutdown()
+
+    array = np.arange(6, dtype=np.float32).reshape(2, 3)
+    assert np.array_equal(decode_output(encode_output(array)), array)
+    assert decode_output(encode_output(RawJSON('{"a": 1}'))) == RawJSON('{"a": 1}')
+    assert decode_output(encode_output([(0, np.float32(0.5))])) == [[0, 0.5]]
+
+
+def test_job_controller_host_slots(tmp_path: Any, dummy_lda_model: LdaModelWrapper) -> None:
+    slots = HostSlots(str(tmp_path), 1)
+    # Another process of the host runs a job in the only slot
+    holder = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            "import fcntl, os, sys\n"
+            f"descriptor = os.open({slots.paths[0]!r}, os.O_RDWR | os.O_CREAT)\n"
+            "fcntl.lockf(descriptor, fcntl.LOCK_EX)\n"
+            "print('locked', flush=True)\n"
+            "sys.stdin.read()\n",
+        ],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+    )
+    assert holder.stdout is not None and holder.stdout.readline() == b"locked\n"
+    assert slots.acquire() is None
+
+    collection: Collection = mongomock.MongoClient()["models"]["models_jobs"]
+    job_controller = JobController(
+        workers=1,
+        max_queued=1,
+        history_size=2,
+        collection=collection,
+        slots=slots,
+        slot_poll_interval=0.1,
+    )
+    try:
+        job = job_controller.submit(dummy_lda_model, "getNumTopics", {})
+        time.sleep(0.3)
+        assert job.state == "queued"
+        # The job starts once the slot is free
+        holder.communicate()
+        wait_for(job)
+        assert job.state == "succeeded"
+        assert slots.held == {}
+        slot = slots.acquire()
+        assert slot == 0
+        assert slots.acquire() is None
+        slots.release(slot)
+    finally:
+        job_controller.shutdown()
+
+    # Jobs of processes that exited are reported as failed
+    collection.insert_one(
+        {
+            **Job(dummy_lda_model, "train", {}).to_document(),
+            "id": "abandoned",
+            "state": "running",
+            "host": socket.gethostname(),
+            "pid": holder.pid,
+        }
+    )
+    abandoned = job_controller.get_job("abandoned")
+    assert abandoned is not None and abandoned.state == "failed"
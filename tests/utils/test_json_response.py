@@ -0,0 +1,35 @@
+"""Test the json serialization of responses."""
+import json
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+from cs_insights_prediction_endpoint.utils.json_response import (
+    RawJSON,
+    get_response_class,
+)
+from cs_insights_prediction_endpoint.utils.settings import get_settings
+
+
+def test_get_response_class() -> None:
+    settings = get_settings()
+    assert get_response_class(settings) is ORJSONResponse
+    assert get_response_class(settings.copy(update={"json_response_class": "json"})) is (
+        JSONResponse
+    )
+
+
+def test_orjson_response() -> None:
+    content = {"output_data": {"topics": [[0.5, 0.25]], "array": [1.5, 2.0]}}
+    response = ORJSONResponse(content)
+    assert response.media_type == "application/json"
+    assert json.loads(response.body) == {
+        "output_data": {"topics": [[0.5, 0.25]], "array": [1.5, 2.0]}
+    }
+
+
+def test_raw_json() -> None:
+    raw = RawJSON('{"topic.order": [1, 2]}')
+    assert raw.data == b'{"topic.order": [1, 2]}'
+    assert raw.loads() == {"topic.order": [1, 2]}
+    assert raw == RawJSON(b'{"topic.order": [1, 2]}')
+    assert raw != {"topic.order": [1, 2]}
@@ -0,0 +1,34 @@
+"""Test the memory report utilities."""
+from typing import Any
+
+from cs_insights_prediction_endpoint.utils.memory_report import get_mapped_file_usage
+
+dummy_smaps = """7f0000000000-7f0000001000 r--s 00000000 08:01 1234 /models/1.expElogbeta.npy
+Size:                  4 kB
+Rss:                   8 kB
+Shared_Clean:          8 kB
+Shared_Dirty:          0 kB
+Private_Clean:         0 kB
+Private_Dirty:         0 kB
+7f0000001000-7f0000002000 rw-p 00000000 00:00 0
+Rss:                  12 kB
+Private_Dirty:        12 kB
+7f0000002000-7f0000003000 r--s 00000000 08:01 1235 /models/1.state.sstats.npy
+Rss:                   4 kB
+Shared_Clean:          0 kB
+Private_Clean:         4 kB
+"""
+
+
+def test_mapped_file_usage(tmp_path: Any) -> None:
+    smaps = tmp_path / "smaps"
+    smaps.write_text(dummy_smaps)
+    usage = get_mapped_file_usage(
+        ["/models/1.expElogbeta.npy", "/models/1.state.sstats.npy"], str(smaps)
+    )
+    assert usage == {"resident_bytes": 12 * 1024, "shared_bytes": 8 * 1024, "private_bytes": 4096}
+
+
+def test_mapped_file_usage_without_smaps(tmp_path: Any) -> None:
+    usage = get_mapped_file_usage(["/models/1.expElogbeta.npy"], str(tmp_path / "missing"))
+    assert usage == {"resident_bytes": 0, "shared_bytes": 0, "private_bytes": 0}
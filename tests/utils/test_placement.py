@@ -0,0 +1,114 @@
+"""Test the placement of created models on remote hosts."""
+from collections import Counter
+from typing import List
+
+import mongomock  # type: ignore
+import pytest
+
+from cs_insights_prediction_endpoint.models.model_hosts import RemoteHost
+from cs_insights_prediction_endpoint.utils.placement import (
+    HashRing,
+    select_least_loaded,
+    select_weighted,
+)
+from cs_insights_prediction_endpoint.utils.remote_storage_controller import (
+    RemoteStorageController,
+)
+from cs_insights_prediction_endpoint.utils.settings import get_settings
+
+keys = [f"model-{i}" for i in range(3000)]
+
+
+@pytest.fixture
+def dummy_remote_hosts() -> List[RemoteHost]:
+    """Provides three hosts, where the last one does not implement lda
+
+    Returns:
+        List[RemoteHost]: The hosts
+    """
+    return [
+        RemoteHost(ip=f"10.0.0.{i}", port="80", models=models, created_models=[])
+        for i, models in enumerate([["lda"], ["lda"], ["other"]])
+    ]
+
+
+def test_hash_ring_balance_and_movement() -> None:
+    ring = HashRing(virtual_nodes=100)
+    for host in ["a:80", "b:80", "c:80"]:
+        ring.add_host(host)
+    placement = {key: ring.get_host(key) for key in keys}
+    counts = Counter(placement.values())
+    assert all(700 < count < 1300 for count in counts.values())
+
+    # Only keys of the new host move when a host joins
+    ring.add_host("d:80")
+    moved = [key for key in keys if ring.get_host(key) != placement[key]]
+    assert all(ring.get_host(key) == "d:80" for key in moved)
+    assert 450 < len(moved) < 1050
+
+    # Only keys of the leaving host move when a host leaves
+    ring.remove_host("d:80")
+    assert {key: ring.get_host(key) for key in keys} == placement
+    ring.remove_host("d:80")
+    ring.remove_host("a:80")
+    assert all(ring.get_host(key) == placement[key] for key in keys if placement[key] != "a:80")
+
+    assert ring.get_host("model", candidates=["c:80"]) == "c:80"
+    assert ring.get_host("model", candidates=["x:80"]) is None
+    assert HashRing(virtual_nodes=10).get_host("model") is None
+
+
+def test_hash_ring_capacity() -> None:
+    ring = HashRing(virtual_nodes=100)
+    ring.sync({"a:80": 1.0, "b:80": 3.0})
+    counts = Counter(ring.get_host(key) for key in keys)
+    assert 2.0 < counts["b:80"] / counts["a:80"] < 4.5
+    ring.sync({"a:80": 1.0})
+    assert ring.hosts == {"a:80": 1.0}
+    assert set(ring.nodes) == {"a:80"}
+
+
+def test_select_least_loaded(dummy_remote_hosts: List[RemoteHost]) -> None:
+    dummy_remote_hosts[0].created_models = ["1", "2"]
+    dummy_remote_hosts[1].created_models = ["3"]
+    assert select_least_loaded(dummy_remote_hosts[:2]) is dummy_remote_hosts[1]
+    dummy_remote_hosts[0].capacity = 4
+    assert select_least_loaded(dummy_remote_hosts[:2]) is dummy_remote_hosts[0]
+    assert select_least_loaded([]) is None
+
+
+def test_select_weighted(dummy_remote_hosts: List[RemoteHost]) -> None:
+    dummy_remote_hosts[1].capacity = 3
+    selected = [select_weighted(dummy_remote_hosts[:2], key) for key in keys]
+    counts = Counter(host.ip for host in selected if host is not None)
+    assert 2.0 < counts["10.0.0.1"] / counts["10.0.0.0"] < 4.5
+    assert select_weighted(dummy_remote_hosts[:2], "model") is select_weighted(
+        dummy_remote_hosts[:2], "model"
+    )
+    assert select_weighted([], "model") is None
+
+
+@pytest.mark.parametrize("strategy", ["first", "consistent_hash", "least_loaded", "weighted"])
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_place_model(
+    dummy_remote_hosts: List[RemoteHost], strategy: str, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    rsc = RemoteStorageController(get_settings().copy(update={"placement_strategy": strategy}))
+    monkeypatch.setattr(rsc, "remote_host_list", dummy_remote_hosts)
+    placed = Counter(rsc.place_model("lda", key) for key in keys[:200])
+    assert set(placed) <= {"10.0.0.0:80", "10.0.0.1:80"}
+    if strategy == "first":
+        assert placed == {"10.0.0.0:80": 200}
+    elif strategy != "least_loaded":
+        assert len(placed) == 2
+    assert rsc.place_model("other", "model") == "10.0.0.2:80"
+    assert rsc.place_model("unknown", "model") is None
+    # Excluded (e.g., unhealthy) hosts are skipped
+    for key in keys[:50]:
+        assert rsc.place_model("lda", key, exclude={"10.0.0.0:80"}) == "10.0.0.1:80"
+    assert rsc.place_model("other", "model", exclude={"10.0.0.2:80"}) is None
+
+
+def test_place_model_unknown_strategy() -> None:
+    with pytest.raises(ValueError):
+        RemoteStorageController(get_settings().copy(update={"placement_strategy": "unknown"}))
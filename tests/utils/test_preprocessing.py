@@ -0,0 +1,51 @@
+"""Test the preprocessing pipeline."""
+from gensim.corpora.dictionary import Dictionary  # type: ignore
+
+from cs_insights_prediction_endpoint.utils.preprocessing import (
+    build_corpus,
+    get_preprocessing_pool,
+    iter_preprocessed,
+    preprocess_text,
+    shutdown_preprocessing_pool,
+)
+
+
+def test_preprocess_text() -> None:
+    preprocess_text.cache_clear()
+    tokens = preprocess_text("Attention is all you need for the transformers")
+    assert tokens == ("attent", "need", "transform")
+    assert preprocess_text("Attention is all you need for the transformers") is tokens
+    assert preprocess_text.cache_info().hits == 1
+
+
+def test_iter_preprocessed() -> None:
+    texts = [f"Attention number {i} is all you need for the transformers" for i in range(50)]
+    expected = [preprocess_text(text) for text in texts]
+    assert list(iter_preprocessed(texts, workers=0, chunk_size=7)) == expected
+    # Chunks are tokenized by worker processes, but returned in order
+    assert list(iter_preprocessed(iter(texts), workers=2, chunk_size=7)) == expected
+    # A single chunk is tokenized in process
+    assert list(iter_preprocessed(texts[:3], workers=2, chunk_size=7)) == expected[:3]
+    assert list(iter_preprocessed([], workers=2, chunk_size=7)) == []
+
+
+def test_build_corpus() -> None:
+    texts = ["Attention is all you need", "Topic models for papers", "Attention for topics"]
+    docs = [preprocess_text(text) for text in texts]
+    expected_dictionary = Dictionary(docs)
+
+    dictionary, bow_corpus = build_corpus(texts, workers=2, chunk_size=1)
+    assert dictionary.token2id == expected_dictionary.token2id
+    assert dictionary.dfs == expected_dictionary.dfs
+    assert bow_corpus == [expected_dictionary.doc2bow(doc) for doc in docs]
+
+
+def test_shutdown_preprocessing_pool() -> None:
+    pool = get_preprocessing_pool()
+    shutdown_preprocessing_pool()
+    assert get_preprocessing_pool.cache_info().currsize == 0
+    # Stopping a pool that was not started does nothing
+    shutdown_preprocessing_pool()
+    # The pool is started again on next use
+    assert get_preprocessing_pool() is not pool
+    shutdown_preprocessing_pool()
@@ -1,6 +1,12 @@
 """Test the remote storage controller."""
+import time
+from typing import Any, List
+
+import mongomock  # type: ignore
 import pytest
 
+from cs_insights_prediction_endpoint.models.model_hosts import RemoteHost
+from cs_insights_prediction_endpoint.utils import remote_storage_controller
 from cs_insights_prediction_endpoint.utils.remote_storage_controller import (
     RemoteStorageController,
 )
@@ -14,7 +20,15 @@ def dummy_remote_storage_controller() -> RemoteStorageController:
     Returns:
         StorageController: empty
     """
-    return RemoteStorageController(get_settings())
+    with mongomock.patch(servers=(("127.0.0.1", 27017),)):
+        return RemoteStorageController(get_settings())
+
+
+def get_stored_created_models(rsc: RemoteStorageController, ip: str) -> List[str]:
+    """Returns the created models of the host ip stored in the database"""
+    document = rsc.remote_host_db.find_one({"ip": ip})
+    assert document is not None
+    return list(document["created_models"])
 
 
 def test_host_not_found(dummy_remote_storage_controller: RemoteStorageController) -> None:
@@ -27,3 +41,161 @@ def test_host_no_created_model_found(
 ) -> None:
     output = dummy_remote_storage_controller.find_created_model_in_remote_hosts("")
     assert output is None
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_model_routes() -> None:
+    rsc = RemoteStorageController(get_settings())
+    host = RemoteHost(ip="10.0.1.1", port="80", models=["lda"], created_models=["a", "b"])
+    rsc.add_remote_host(host)
+    try:
+        assert rsc.find_created_model_in_remote_hosts("a") == "10.0.1.1:80"
+        # Other controllers (e.g., of other workers) load the hosts from the database
+        assert RemoteStorageController(get_settings()).model_routes["b"] == host
+
+        rsc.add_model_to_created_model_list("10.0.1.1", "c")
+        assert rsc.find_created_model_in_remote_hosts("c") == "10.0.1.1:80"
+        assert get_stored_created_models(rsc, "10.0.1.1") == ["a", "b", "c"]
+
+        rsc.remove_model_from_created_model_list("10.0.1.1", "a")
+        assert rsc.find_created_model_in_remote_hosts("a") is None
+        # The last model is moved to the position of the removed one
+        assert host.created_models == ["c", "b"]
+        assert rsc.model_positions["10.0.1.1"] == {"c": 0, "b": 1}
+        assert get_stored_created_models(rsc, "10.0.1.1") == ["b", "c"]
+
+        # Unknown hosts are ignored
+        rsc.add_model_to_created_model_list("10.0.1.2", "d")
+        assert rsc.find_created_model_in_remote_hosts("d") is None
+        # So are unknown models
+        rsc.remove_model_from_created_model_list("10.0.1.1", "d")
+        assert host.created_models == ["c", "b"]
+    finally:
+        assert rsc.remove_remote_host("10.0.1.1") is True
+    assert rsc.find_created_model_in_remote_hosts("b") is None
+    assert rsc.remove_remote_host("10.0.1.1") is False
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_registry_refresh() -> None:
+    settings = get_settings().copy(update={"remote_host_refresh_interval": 0})
+    rsc = RemoteStorageController(settings)
+    other_rsc = RemoteStorageController(settings)
+    assert rsc.refresh_registry() is False
+
+    host = RemoteHost(ip="10.0.1.3", port="80", models=["lda"], created_models=["a"])
+    rsc.add_remote_host(host)
+    rsc.add_model_to_created_model_list("10.0.1.3", "b")
+    # Own changes are applied again without effect
+    assert rsc.refresh_registry() is True
+    assert rsc.get_all_created_models() == ["a", "b"]
+    assert rsc.refresh_registry() is False
+    assert other_rsc.find_created_model_in_remote_hosts("b") is None
+
+    assert other_rsc.refresh_registry() is True
+    assert other_rsc.find_created_model_in_remote_hosts("b") == "10.0.1.3:80"
+    assert other_rsc.get_remote_host("10.0.1.3") == host
+
+    # Concurrent changes of both workers are applied by both of them
+    other_rsc.remove_model_from_created_model_list("10.0.1.3", "a")
+    rsc.add_model_to_created_model_list("10.0.1.3", "c")
+    assert rsc.refresh_registry() is True
+    assert other_rsc.refresh_registry() is True
+    for controller in [rsc, other_rsc]:
+        assert sorted(controller.get_all_created_models()) == ["b", "c"]
+        assert controller.find_created_model_in_remote_hosts("a") is None
+
+    assert other_rsc.remove_remote_host("10.0.1.3") is True
+    assert rsc.refresh_registry() is True
+    assert rsc.get_all_remote_hosts() == []
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_registry_refresh_loop() -> None:
+    settings = get_settings().copy(
+        update={"remote_host_refresh_interval": 0.01, "node_type": "MAIN"}
+    )
+    rsc = RemoteStorageController(settings)
+    # SECONDARY nodes do not route requests, so they do not refresh the registry
+    secondary_rsc = RemoteStorageController(settings.copy(update={"node_type": "SECONDARY"}))
+    RemoteStorageController(settings).add_remote_host(
+        RemoteHost(ip="10.0.1.4", port="80", models=["lda"], created_models=["a"])
+    )
+    deadline = time.time() + 5
+    while rsc.find_created_model_in_remote_hosts("a") is None and time.time() < deadline:
+        time.sleep(0.01)
+    rsc.close()
+    assert rsc.find_created_model_in_remote_hosts("a") == "10.0.1.4:80"
+    assert secondary_rsc.find_created_model_in_remote_hosts("a") is None
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_registry_refresh_incremental(monkeypatch: Any) -> None:
+    settings = get_settings().copy(update={"remote_host_refresh_interval": 0})
+    rsc = RemoteStorageController(settings)
+    other_rsc = RemoteStorageController(settings)
+    for ip in ["10.0.5.1", "10.0.5.2", "10.0.5.3"]:
+        other_rsc.add_remote_host(RemoteHost(ip=ip, port="80", models=["lda"], created_models=[]))
+    assert rsc.refresh_registry() is True
+    changed = rsc.get_remote_host("10.0.5.1")
+    unchanged = rsc.get_remote_host("10.0.5.2")
+
+    # Created models are added without reloading their host; only removed hosts are reloaded
+    other_rsc.add_model_to_created_model_list("10.0.5.1", "a")
+    other_rsc.remove_remote_host("10.0.5.3")
+    find = rsc.remote_host_db.find
+    queries: List[Any] = []
+
+    def recording_find(*args: Any, **kwargs: Any) -> Any:
+        queries.append(args[0])
+        return find(*args, **kwargs)
+
+    monkeypatch.setattr(rsc.remote_host_db, "find", recording_find)
+    assert rsc.refresh_registry() is True
+    monkeypatch.undo()
+    # Reads of the version document aside
+    assert [query for query in queries if "ip" in query] == [{"ip": {"$in": ["10.0.5.3"]}}]
+    assert rsc.get_remote_host("10.0.5.1") is changed
+    assert rsc.get_remote_host("10.0.5.2") is unchanged
+    assert rsc.find_created_model_in_remote_hosts("a") == "10.0.5.1:80"
+    assert [host.ip for host in rsc.get_all_remote_hosts()] == ["10.0.5.1", "10.0.5.2"]
+
+    # Workers further behind than the change log reaches reload all hosts
+    monkeypatch.setattr(remote_storage_controller, "registry_change_log_size", 2)
+    for model_id in ["b", "c", "d"]:
+        other_rsc.add_model_to_created_model_list("10.0.5.1", model_id)
+    assert rsc.refresh_registry() is True
+    assert rsc.get_remote_host("10.0.5.2") is not unchanged
+    assert rsc.get_all_created_models() == ["a", "b", "c", "d"]
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_locate_created_model() -> None:
+    settings = get_settings().copy(update={"remote_host_refresh_interval": 0})
+    rsc = RemoteStorageController(settings)
+    other_rsc = RemoteStorageController(settings)
+    other_rsc.add_remote_host(
+        RemoteHost(ip="10.0.6.1", port="80", models=["lda"], created_models=["a"])
+    )
+    assert rsc.find_created_model_in_remote_hosts("a") is None
+    assert rsc.locate_created_model("a") == "10.0.6.1:80"
+    # Misses refresh the registry at most every remote_host_miss_refresh_interval seconds
+    other_rsc.add_model_to_created_model_list("10.0.6.1", "b")
+    assert rsc.locate_created_model("b") is None
+    rsc.last_miss_refresh -= settings.remote_host_miss_refresh_interval
+    assert rsc.locate_created_model("b") == "10.0.6.1:80"
+    assert rsc.locate_created_model("c") is None
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_bulk_created_model_list() -> None:
+    rsc = RemoteStorageController(get_settings())
+    rsc.add_remote_host(RemoteHost(ip="10.0.4.1", port="80", models=["lda"], created_models=["a"]))
+    rsc.add_models_to_created_model_list("10.0.4.1", ["b", "c", "d"])
+    assert rsc.find_created_model_in_remote_hosts("c") == "10.0.4.1:80"
+    rsc.remove_models_from_created_model_list("10.0.4.1", ["a", "c"])
+    assert sorted(rsc.get_all_created_models()) == ["b", "d"]
+    assert rsc.model_positions["10.0.4.1"] == {"d": 0, "b": 1}
+    assert rsc.find_created_model_in_remote_hosts("a") is None
+    assert get_stored_created_models(rsc, "10.0.4.1") == ["b", "d"]
+    rsc.close()
@@ -0,0 +1,54 @@
+"""Test the result cache."""
+import os
+import time
+
+from cs_insights_prediction_endpoint.utils.result_cache import ResultCache, fingerprint
+
+
+def test_fingerprint() -> None:
+    assert fingerprint([["a", "b"]], 10) == fingerprint([["a", "b"]], 10)
+    assert fingerprint([["a", "b"]], 10) != fingerprint([["a", "b"]], 11)
+    assert fingerprint([["a", "b"]], 10) != fingerprint([["a", None]], 10)
+
+
+def test_result_cache_size() -> None:
+    cache = ResultCache(max_size=2, ttl=60)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    assert cache.get("a") == "1"
+    cache.set("c", "3")
+    # b was the least recently used entry
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.get("c") == "3"
+    assert cache.hits == 3
+    assert cache.misses == 1
+
+
+def test_result_cache_ttl() -> None:
+    cache = ResultCache(max_size=2, ttl=0.05)
+    cache.set("a", "1")
+    assert cache.get("a") == "1"
+    time.sleep(0.1)
+    assert cache.get("a") is None
+    assert len(cache.entries) == 0
+
+
+def test_result_cache_directory(tmp_path: str) -> None:
+    directory = os.path.join(tmp_path, "cache")
+    cache = ResultCache(max_size=1, ttl=60, directory=directory, max_disk_size=2)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    # a is evicted from memory, but read from disk
+    assert cache.get("a") == "1"
+
+    # Another process reads the same directory
+    assert ResultCache(max_size=1, ttl=60, directory=directory).get("b") == "2"
+
+    time.sleep(0.01)
+    cache.set("c", "3")
+    assert sorted(os.listdir(directory)) == ["b.json", "c.json"]
+
+    cache.clear()
+    assert os.listdir(directory) == []
+    assert cache.get("c") is None
@@ -0,0 +1,73 @@
+"""Test the reader/writer lock."""
+import threading
+import time
+
+import pytest
+
+from cs_insights_prediction_endpoint.utils.rw_lock import ReadWriteLock
+
+
+def test_readers_share_the_lock() -> None:
+    lock = ReadWriteLock()
+    assert lock.acquire_read()
+    assert lock.acquire_read(timeout=0)
+    assert lock.get_state() == {"readers": 2, "writer": False, "waiting_writers": 0}
+    assert not lock.acquire_write(timeout=0.01)
+    lock.release_read()
+    lock.release_read()
+    assert lock.acquire_write(timeout=0)
+    assert not lock.acquire_read(timeout=0.01)
+    assert not lock.acquire_write(timeout=0)
+    lock.release_write()
+    with pytest.raises(RuntimeError):
+        lock.release_write()
+    with pytest.raises(RuntimeError):
+        lock.release_read()
+
+
+def test_waiting_writer_takes_precedence() -> None:
+    lock = ReadWriteLock()
+    order = []
+    lock.acquire_read()
+
+    def write() -> None:
+        with lock.write_locked():
+            order.append("write")
+
+    def read() -> None:
+        with lock.read_locked():
+            order.append("read")
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    while not lock.get_state()["waiting_writers"]:
+        time.sleep(0.001)
+    # New readers wait for the writer, so it is not starved by them
+    reader = threading.Thread(target=read)
+    reader.start()
+    time.sleep(0.05)
+    assert order == []
+    lock.release_read()
+    writer.join(timeout=5)
+    reader.join(timeout=5)
+    assert order == ["write", "read"]
+
+
+def test_writer_timeout_releases_readers() -> None:
+    lock = ReadWriteLock()
+    lock.acquire_read()
+    acquired = []
+
+    def read() -> None:
+        acquired.append(lock.acquire_read(timeout=5))
+
+    reader = threading.Thread(target=read)
+    writer = threading.Thread(target=lambda: lock.acquire_write(timeout=0.1))
+    writer.start()
+    while not lock.get_state()["waiting_writers"]:
+        time.sleep(0.001)
+    reader.start()
+    writer.join(timeout=5)
+    reader.join(timeout=5)
+    assert acquired == [True]
+    assert lock.get_state() == {"readers": 2, "writer": False, "waiting_writers": 0}
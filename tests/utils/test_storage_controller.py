@@ -1,11 +1,24 @@
 """Test the storage controller."""
+import os
+import threading
+import time
+from random import Random
+from typing import List
 
 import mongomock  # type: ignore
 import pytest
+from gensim.test.utils import common_corpus  # type: ignore
 
 from cs_insights_prediction_endpoint.models.generic_model import GenericModel
+from cs_insights_prediction_endpoint.models.lda_model import LdaModelWrapper
 from cs_insights_prediction_endpoint.utils.settings import get_settings
-from cs_insights_prediction_endpoint.utils.storage_controller import StorageController
+from cs_insights_prediction_endpoint.utils.storage_controller import (
+    StorageController,
+    VersionConflictError,
+)
+
+# Models save their states to a temporary directory
+pytestmark = pytest.mark.usefixtures("save_directory")
 
 
 @pytest.fixture
@@ -71,10 +84,359 @@ def test_add_model(dummy_generic_model: GenericModel) -> None:
     old = dummy_storage_controller.get_all_models()
     dummy_storage_controller.add_model(dummy_generic_model)
 
-    assert dummy_storage_controller.get_all_models() == old
+    assert len(dummy_storage_controller.get_all_models()) == len(old) + 1
     assert dummy_storage_controller.get_model(dummy_generic_model.id) == dummy_generic_model
+    saved_model = LdaModelWrapper(
+        name="Saved", created_by="Alpha Tester", type_of_model="lda", function_calls={}
+    )
+    dummy_storage_controller.add_model(saved_model)
     restarted_storage_controller = StorageController(get_settings())
-    assert len(restarted_storage_controller.get_all_models()) > 0
-    added_model = restarted_storage_controller.get_model(dummy_generic_model.get_id())
+    added_model = restarted_storage_controller.get_model(saved_model.get_id())
     assert added_model is not None
-    assert added_model.name == dummy_generic_model.name
+    assert added_model.name == saved_model.name
+    # The generic model has no saved state to restore
+    assert restarted_storage_controller.get_model(dummy_generic_model.get_id()) is None
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_secondary_indexes(dummy_generic_model: GenericModel) -> None:
+    """Test for looking up models by type and creator
+
+    Arguments:
+        dummy_generic_model (GenericModel): A dummy GenericModel
+    """
+    dummy_storage_controller = StorageController(get_settings())
+    dummy_storage_controller.add_model(dummy_generic_model)
+    assert dummy_storage_controller.get_models_by_type("lda") == [dummy_generic_model]
+    assert dummy_storage_controller.get_models_by_creator("Alpha Tester") == [dummy_generic_model]
+    assert dummy_storage_controller.get_models_by_type("Non-Existent") == []
+
+    dummy_storage_controller.del_model(dummy_generic_model.id)
+    assert dummy_storage_controller.get_models_by_type("lda") == []
+    assert dummy_storage_controller.get_models_by_creator("Alpha Tester") == []
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_lazy_model_loading() -> None:
+    """Test for loading models on first use and evicting the least recently used one"""
+    settings = get_settings().copy(update={"lazy_model_loading": True, "model_cache_max_models": 1})
+    dummy_storage_controller = StorageController(settings)
+    first = LdaModelWrapper(created_by="Alpha Tester", type_of_model="lda", function_calls={})
+    second = LdaModelWrapper(created_by="Alpha Tester", type_of_model="lda", function_calls={})
+    dummy_storage_controller.add_model(first)
+    dummy_storage_controller.add_model(second)
+    assert not first.is_loaded()
+
+    restarted_storage_controller = StorageController(settings)
+    assert restarted_storage_controller.models[first.id].is_loaded() is False
+    assert restarted_storage_controller.models[second.id].is_loaded() is False
+    # Listing the function calls does not load the model
+    assert "getTopWords" in (restarted_storage_controller.get_function_calls(first.id) or [])
+    assert restarted_storage_controller.get_function_calls("unknown") is None
+    assert restarted_storage_controller.models[first.id].is_loaded() is False
+
+    model = restarted_storage_controller.get_model(first.id)
+    assert model is not None and model.is_loaded()
+    assert restarted_storage_controller.get_model(first.id) is model
+    restarted_storage_controller.get_model(second.id)
+    assert not model.is_loaded()
+
+    statistics = restarted_storage_controller.get_cache_statistics()
+    assert statistics["hits"] == 1
+    assert statistics["misses"] == 2
+    assert statistics["evictions"] == 1
+    assert statistics["resident_models"] == 1
+    assert statistics["resident_bytes"] > 0
+
+    restarted_storage_controller.del_model(second.id)
+    assert restarted_storage_controller.get_cache_statistics()["resident_models"] == 0
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_lazy_model_loading_memory_budget() -> None:
+    """Test for evicting models once the memory budget is exceeded"""
+    first = LdaModelWrapper(created_by="Alpha Tester", type_of_model="lda", function_calls={})
+    second = LdaModelWrapper(created_by="Alpha Tester", type_of_model="lda", function_calls={})
+    settings = get_settings().copy(
+        update={
+            "lazy_model_loading": True,
+            "model_cache_max_bytes": first.get_memory_usage() + 1,
+        }
+    )
+    dummy_storage_controller = StorageController(settings)
+    dummy_storage_controller.add_model(first)
+    dummy_storage_controller.add_model(second)
+    assert not first.is_loaded()
+    assert second.is_loaded()
+    assert dummy_storage_controller.get_cache_statistics()["evictions"] == 1
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_restore_model_from_disk() -> None:
+    """Test for restoring a stored model without retraining or overwriting it"""
+    dummy_storage_controller = StorageController(get_settings())
+    model = LdaModelWrapper(
+        created_by="Alpha Tester",
+        type_of_model="lda",
+        function_calls={},
+        creation_parameters={"corpus": common_corpus, "num_topics": 3, "random_state": 0},
+    )
+    dummy_storage_controller.add_model(model)
+    saved_at = os.stat(f"{model.get_save_path()}.expElogbeta.npy").st_mtime_ns
+
+    restarted_storage_controller = StorageController(get_settings())
+    restored = restarted_storage_controller.get_model(model.id)
+    assert restored is not None
+    assert restored.get_topics() == model.get_topics()  # type: ignore
+    assert os.stat(f"{model.get_save_path()}.expElogbeta.npy").st_mtime_ns == saved_at
+
+    # A model whose state is missing is not restored
+    os.rename(model.get_save_path(), f"{model.get_save_path()}.moved")
+    try:
+        assert StorageController(get_settings()).get_model(model.id) is None
+    finally:
+        os.rename(f"{model.get_save_path()}.moved", model.get_save_path())
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_concurrent_train_predict_delete() -> None:
+    """Stress test running predictions, training and deletions of models in parallel threads.
+    Updates of a model must run one at a time, reads may overlap with each other and with
+    updates, no update may be lost and models in use must not be unloaded.
+    """
+    settings = get_settings().copy(update={"lazy_model_loading": True, "model_cache_max_models": 2})
+    sc = StorageController(settings)
+    models: List[GenericModel] = [
+        LdaModelWrapper(
+            created_by="Alpha Tester",
+            type_of_model="lda",
+            function_calls={},
+            creation_parameters={"corpus": common_corpus, "num_topics": 3, "random_state": 0},
+        )
+        for _ in range(3)
+    ]
+    sc.add_models(models)
+    usage_lock = threading.Lock()
+    usage = {model.id: {"readers": 0, "updates": 0, "trained": 0} for model in models}
+    errors: List[BaseException] = []
+    deleted = threading.Event()
+
+    def use(model_id: str, function_call: str) -> None:
+        with sc.use_model(model_id, function_call) as model:
+            if model is None:
+                assert deleted.is_set()
+                return
+            update = function_call == "train"
+            with usage_lock:
+                state = usage[model_id]
+                assert not update or state["updates"] == 0
+                state["updates" if update else "readers"] += 1
+            try:
+                assert model.is_loaded()
+                # Updates run on a copy, reads on the current version
+                assert (model is sc.models.get(model_id)) != update
+                if update:
+                    model.train({"corpus": common_corpus[:3]})
+                else:
+                    model.predict({"bow": common_corpus[0]})
+            finally:
+                with usage_lock:
+                    state["updates" if update else "readers"] -= 1
+                    state["trained"] += update
+
+    def worker(seed: int) -> None:
+        random = Random(seed)
+        try:
+            for _ in range(30):
+                model_id = random.choice(models).id
+                use(model_id, "train" if random.random() < 0.1 else "predict")
+        except BaseException as error:  # noqa: B902
+            errors.append(error)
+
+    def delete() -> None:
+        time.sleep(0.05)
+        deleted.set()
+        sc.del_models([models[2].id])
+
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(8)]
+    threads.append(threading.Thread(target=delete))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=120)
+    assert not any(thread.is_alive() for thread in threads)
+    assert errors == []
+    assert sc.get_model(models[2].id) is None
+    assert sc.get_model_lock(models[2].id) is None
+    assert sorted(model.id for model in sc.get_all_models()) == sorted(
+        model.id for model in models[:2]
+    )
+    # Predictions of a model run in parallel: the barrier is only passed if both readers
+    # hold the lock of the model at the same time
+    barrier = threading.Barrier(2, timeout=10)
+
+    def read_together() -> None:
+        try:
+            with sc.use_model(models[0].id, "predict") as model:
+                assert model is not None
+                barrier.wait()
+        except BaseException as error:  # noqa: B902
+            errors.append(error)
+
+    readers = [threading.Thread(target=read_together) for _ in range(2)]
+    for thread in readers:
+        thread.start()
+    for thread in readers:
+        thread.join(timeout=20)
+    assert errors == []
+    # Every update was committed as a new version; only the latest ones are kept
+    retention = get_settings().model_version_retention
+    for model in models[:2]:
+        assert model.version == usage[model.id]["trained"]
+        assert model.get_saved_versions() == list(
+            range(max(model.version + 1 - retention, 0), model.version + 1)
+        )
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_model_versions() -> None:
+    """Test for updating models on a copy, which is saved as a new version, and rolling
+    back to saved versions
+    """
+    sc = StorageController(get_settings())
+    model = LdaModelWrapper(created_by="Alpha Tester", type_of_model="lda", function_calls={})
+    sc.add_model(model)
+    topics = model.get_topics()
+    assert model.version == 0
+
+    staged = sc.begin_update(model.id)
+    assert staged is not None and staged.version == 1
+    staged.train({"corpus": common_corpus})
+    # The previous version serves requests until the update is committed
+    with sc.use_model(model.id, "getTopics") as current:
+        assert current is model
+        assert current.get_topics() == topics
+    assert sc.commit_update(model.id, staged) == 1
+    assert model.version == 1
+    assert model.get_topics() != topics
+    # The top words index built by training is taken over with the state
+    assert isinstance(staged, LdaModelWrapper) and staged._top_words is not None
+    assert model._top_words is staged._top_words
+    assert model.get_saved_versions() == [0, 1]
+    document = sc.model_db.find_one({"id": model.id})
+    assert document is not None and document["version"] == 1
+    trained_topics = model.get_topics()
+
+    # A failed update does not change the model
+    with pytest.raises(RuntimeError):
+        with sc.use_model(model.id, "train") as current:
+            assert current is not None and current is not model
+            current.train({"corpus": common_corpus})
+            raise RuntimeError("Training failed")
+    assert model.version == 1
+    assert model.get_topics() == trained_topics
+
+    assert sc.rollback_model(model.id, 0) is model
+    assert model.version == 0
+    assert model.get_topics() == topics
+    # Updates after a rollback do not overwrite later versions
+    with sc.use_model(model.id, "train") as current:
+        assert current is not None
+        current.train({"corpus": common_corpus})
+    assert model.version == 2
+    assert sc.get_model_versions(model.id) == {"version": 2, "versions": [0, 1, 2]}
+    assert sc.install_version(model.id, staged.processing_model) == 3
+    assert model.get_topics() == trained_topics
+    # An update computed from an older version does not discard the later updates
+    with pytest.raises(VersionConflictError):
+        sc.install_version(model.id, staged.processing_model, base_version=2)
+    assert model.version == 3
+    assert sc.install_version(model.id, staged.processing_model, base_version=3) == 4
+    assert sc.rollback_model(model.id, 3) is model
+
+    with pytest.raises(ValueError):
+        sc.rollback_model(model.id, 7)
+    with pytest.raises(KeyError):
+        sc.rollback_model("unknown", 0)
+    assert sc.get_model_versions("unknown") is None
+    assert sc.begin_update("unknown") is None
+
+    # The current version is restored with the model
+    restored = StorageController(get_settings()).get_model(model.id)
+    assert isinstance(restored, LdaModelWrapper) and restored.version == 3
+    assert restored.get_topics() == trained_topics
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_model_versions_unchanged_state() -> None:
+    """Test for not saving a new version if an updating call left the model unchanged"""
+    sc = StorageController(get_settings())
+    model = LdaModelWrapper(created_by="Alpha Tester", type_of_model="lda", function_calls={})
+    sc.add_model(model)
+    data = [{"title": "Topic models for papers", "abstractText": "Latent topics of papers"}]
+
+    for _ in range(2):
+        with sc.use_model(model.id, "getLDAvis") as current:
+            assert current is not None
+            current.function_calls["getLDAvis"](data, num_topics=2, passes=1)
+    # The second call was served from the cache
+    assert model.version == 1
+    assert model.get_saved_versions() == [0, 1]
+    assert not os.path.exists(model.get_save_path(2))
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_model_versions_retention(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test for deleting the oldest versions beyond the retention limit and all versions
+    of deleted models
+
+    Arguments:
+        monkeypatch (pytest.MonkeyPatch): a monkeypatch object
+    """
+    monkeypatch.setattr(get_settings(), "model_version_retention", 2)
+    monkeypatch.setattr(get_settings(), "model_mmap_sep_limit", 0)
+    sc = StorageController(get_settings())
+    model = LdaModelWrapper(created_by="Alpha Tester", type_of_model="lda", function_calls={})
+    other = LdaModelWrapper(created_by="Beta Tester", type_of_model="lda", function_calls={})
+    sc.add_models([model, other])
+
+    for _ in range(3):
+        with sc.use_model(model.id, "train") as current:
+            assert current is not None
+            current.train({"corpus": common_corpus})
+    assert model.version == 3
+    assert model.get_saved_versions() == [2, 3]
+    # Arrays saved next to a version are deleted with it
+    assert model.get_saved_files(0) == []
+    assert f"{model.get_save_path(3)}.expElogbeta.npy" in model.get_saved_files(3)
+
+    # The current version is kept after a rollback
+    sc.rollback_model(model.id, 2)
+    with sc.use_model(model.id, "train") as current:
+        assert current is not None
+        current.train({"corpus": common_corpus})
+    assert model.get_saved_versions() == [3, 4]
+
+    # A rollback waiting for an update finds out that the update pruned its version
+    staged = sc.begin_update(model.id)
+    assert staged is not None
+    errors: List[Exception] = []
+
+    def rollback() -> None:
+        try:
+            sc.rollback_model(model.id, 3)
+        except Exception as error:
+            errors.append(error)
+
+    thread = threading.Thread(target=rollback)
+    thread.start()
+    time.sleep(0.1)
+    assert sc.commit_update(model.id, staged) == 5
+    thread.join()
+    assert [type(error) for error in errors] == [ValueError]
+    assert model.version == 5
+
+    sc.del_model(model.id)
+    assert model.get_saved_versions() == []
+    assert not any(name.startswith(model.id) for name in os.listdir(model.save_directory))
+    assert other.get_saved_versions() == [0]
@@ -0,0 +1,212 @@
+"""Test the write-behind buffer of the storage controllers."""
+import atexit
+import threading
+import time
+from typing import Any, List
+
+import mongomock  # type: ignore
+import pytest
+from pymongo import InsertOne, UpdateOne
+
+from cs_insights_prediction_endpoint.models.generic_model import GenericModel
+from cs_insights_prediction_endpoint.models.model_hosts import RemoteHost
+from cs_insights_prediction_endpoint.utils.remote_storage_controller import (
+    RemoteStorageController,
+)
+from cs_insights_prediction_endpoint.utils.settings import get_settings
+from cs_insights_prediction_endpoint.utils.storage_controller import StorageController
+from cs_insights_prediction_endpoint.utils.write_behind import WriteBehindBuffer
+
+
+@pytest.fixture
+def collection() -> mongomock.Collection:
+    return mongomock.MongoClient()["test"]["write_behind"]
+
+
+def test_flush_in_order(collection: mongomock.Collection) -> None:
+    buffer = WriteBehindBuffer(collection, flush_interval=60, max_batch=3)
+    for i in range(5):
+        buffer.submit(InsertOne({"_id": i, "values": []}))
+        buffer.submit(UpdateOne({"_id": i}, {"$push": {"values": i}}))
+    buffer.submit(UpdateOne({"_id": 0}, {"$push": {"values": 10}}))
+    assert collection.count_documents({}) == 0
+    assert buffer.flush() == 11
+    assert [document["values"] for document in collection.find({})] == [
+        [0, 10],
+        [1],
+        [2],
+        [3],
+        [4],
+    ]
+    assert buffer.get_statistics() == {"pending": 0, "written": 11, "cancelled": 0, "batches": 4}
+    assert buffer.flush() == 0
+    buffer.close()
+
+
+def test_cancel(collection: mongomock.Collection) -> None:
+    buffer = WriteBehindBuffer(collection, flush_interval=60, max_batch=10)
+    buffer.submit(InsertOne({"_id": 1}), key="1")
+    buffer.submit(InsertOne({"_id": 2}), key="2")
+    assert buffer.cancel("1")
+    assert not buffer.cancel("1")
+    buffer.flush()
+    assert [document["_id"] for document in collection.find({})] == [2]
+    assert buffer.get_statistics()["cancelled"] == 1
+    buffer.close()
+
+
+def test_failed_write_is_dropped(collection: mongomock.Collection) -> None:
+    collection.insert_one({"_id": 2})
+    buffer = WriteBehindBuffer(collection, flush_interval=60, max_batch=10)
+    for i in range(1, 4):
+        buffer.submit(InsertOne({"_id": i, "buffered": True}))
+    buffer.flush()
+    assert buffer.get_statistics()["pending"] == 0
+    assert collection.count_documents({"buffered": True}) == 2
+    buffer.close()
+
+
+def test_background_flush(collection: mongomock.Collection) -> None:
+    on_flush: List[List[Any]] = []
+    buffer = WriteBehindBuffer(
+        collection, flush_interval=0.05, max_batch=10, on_flush=on_flush.append
+    )
+    buffer.submit(InsertOne({"_id": 1}), tag="1")
+    deadline = time.monotonic() + 5
+    while collection.count_documents({}) == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert collection.count_documents({}) == 1
+    # A full batch is written without waiting for the interval
+    buffer.flush_interval = 60
+    buffer.submit(InsertOne({"_id": 2}))
+    time.sleep(0.1)
+    for i in range(3, 12):
+        buffer.submit(InsertOne({"_id": i}))
+    deadline = time.monotonic() + 5
+    while collection.count_documents({}) < 11 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert collection.count_documents({}) == 11
+    # The tags of the written operations are passed on
+    assert on_flush[0] == ["1"]
+    buffer.close()
+    buffer.thread.join(timeout=5)
+    assert not buffer.thread.is_alive()
+
+
+def test_flush_loop_survives_errors(collection: mongomock.Collection, monkeypatch: Any) -> None:
+    bulk_write = collection.bulk_write
+    calls = []
+
+    def failing_bulk_write(*args: Any, **kwargs: Any) -> Any:
+        calls.append(1)
+        if len(calls) == 1:
+            raise KeyError("writeErrors")
+        return bulk_write(*args, **kwargs)
+
+    monkeypatch.setattr(collection, "bulk_write", failing_bulk_write)
+    buffer = WriteBehindBuffer(collection, flush_interval=0.01, max_batch=10)
+    buffer.submit(InsertOne({"_id": 1}))
+    deadline = time.monotonic() + 5
+    while collection.count_documents({}) == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert collection.count_documents({}) == 1
+    assert len(calls) == 2
+    assert buffer.thread.is_alive()
+    buffer.close()
+
+
+def test_close_unregisters_exit_handler(collection: mongomock.Collection, monkeypatch: Any) -> None:
+    registered: List[Any] = []
+    monkeypatch.setattr(atexit, "register", registered.append)
+    monkeypatch.setattr(atexit, "unregister", registered.remove)
+    buffer = WriteBehindBuffer(collection, flush_interval=60, max_batch=10)
+    assert registered == [buffer.close]
+    buffer.close()
+    assert registered == []
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_storage_controller_write_behind() -> None:
+    settings = get_settings().copy(update={"write_behind_interval": 60})
+    sc = StorageController(settings)
+    models = [
+        GenericModel(
+            name=f"Generic{i}",
+            created_by="Alpha Tester",
+            description="",
+            creation_parameters={},
+            function_calls={},
+            type_of_model="lda",
+        )
+        for i in range(3)
+    ]
+    for model in models:
+        sc.add_model(model)
+    assert sc.model_db.count_documents({}) == 0
+    assert sc.get_model(models[0].id) is models[0]
+    # Deleting a model that was not written yet writes neither
+    sc.del_model(models[0].id)
+    sc.flush()
+    assert sorted(document["id"] for document in sc.model_db.find({})) == sorted(
+        model.id for model in models[1:]
+    )
+    sc.del_model(models[1].id)
+    sc.flush()
+    assert [document["id"] for document in sc.model_db.find({})] == [models[2].id]
+    assert sc.write_buffer is not None
+    sc.write_buffer.close()
+
+
+@mongomock.patch(servers=(("127.0.0.1", 27017),))
+def test_remote_storage_controller_write_behind(monkeypatch: Any) -> None:
+    settings = get_settings().copy(
+        update={"write_behind_interval": 60, "remote_host_refresh_interval": 0}
+    )
+    rsc = RemoteStorageController(settings)
+    other_rsc = RemoteStorageController(settings)
+    rsc.add_remote_host(RemoteHost(ip="10.0.3.1", port="80", models=["lda"], created_models=[]))
+    assert other_rsc.refresh_registry()
+    for model_id in ["a", "b", "c"]:
+        rsc.add_model_to_created_model_list("10.0.3.1", model_id)
+    rsc.remove_model_from_created_model_list("10.0.3.1", "b")
+    assert rsc.find_created_model_in_remote_hosts("a") == "10.0.3.1:80"
+    # Other workers see the changes once they were written
+    assert not other_rsc.refresh_registry()
+    rsc.flush()
+    document = rsc.remote_host_db.find_one({"ip": "10.0.3.1"})
+    assert document is not None and document["created_models"] == ["a", "c"]
+    assert other_rsc.refresh_registry()
+    assert other_rsc.get_all_created_models() == ["a", "c"]
+    # Own changes are applied again without effect
+    assert rsc.refresh_registry()
+    assert rsc.get_all_created_models() == ["a", "c"]
+    assert not rsc.refresh_registry()
+    # Refreshing writes the buffered changes without blocking routing lookups
+    rsc.add_model_to_created_model_list("10.0.3.1", "e")
+    other_rsc.add_remote_host(RemoteHost(ip="10.0.3.2", port="80", models=[], created_models=[]))
+    bulk_write = rsc.remote_host_db.bulk_write
+    lock_free: List[bool] = []
+
+    def checking_bulk_write(*args: Any, **kwargs: Any) -> Any:
+        def try_lock() -> None:
+            lock_free.append(rsc.registry_lock.acquire(blocking=False))
+            if lock_free[-1]:
+                rsc.registry_lock.release()
+
+        thread = threading.Thread(target=try_lock)
+        thread.start()
+        thread.join()
+        return bulk_write(*args, **kwargs)
+
+    monkeypatch.setattr(rsc.remote_host_db, "bulk_write", checking_bulk_write)
+    assert rsc.refresh_registry()
+    # Both the batch and the entry of its changes in the log
+    assert lock_free == [True, True]
+    assert len(rsc.get_all_remote_hosts()) == 2
+    monkeypatch.undo()
+    # Buffered changes are written on close (e.g., on shutdown)
+    rsc.add_model_to_created_model_list("10.0.3.1", "d")
+    rsc.close()
+    document = rsc.remote_host_db.find_one({"ip": "10.0.3.1"})
+    assert document is not None and document["created_models"] == ["a", "c", "e", "d"]
+    other_rsc.close()